@@ -1,7 +1,13 @@
 """Database configuration for PostgreSQL using SQLAlchemy async."""
 
 import os
+import time
+import uuid
+
+import orjson
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
 from dotenv import load_dotenv
 
@@ -18,11 +24,37 @@ if DATABASE_URL.startswith("postgres://"):
 elif DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
+# Connection pool sizing (per worker process).
+# Keep DB_POOL_SIZE + DB_MAX_OVERFLOW (times worker count) below Postgres max_connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = 30  # Seconds to wait for a free connection
+DB_POOL_RECYCLE = 1800  # Recycle connections after 30 minutes
+
+# asyncpg prepared-statement cache per connection (set to 0 behind pgbouncer
+# in transaction pooling mode, which can't keep prepared statements)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+
 # Create async engine
 engine = create_async_engine(
     DATABASE_URL,
     echo=False,  # Set to True for SQL debugging
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
     pool_pre_ping=True,
+    connect_args={
+        "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        "server_settings": {
+            "application_name": "courseworkbuddy",
+            "jit": "off",  # JIT compilation only slows down short OLTP queries
+        },
+    },
+    # orjson for JSONB columns (roadmap_data); compact and much faster than stdlib json
+    json_serializer=lambda value: orjson.dumps(value).decode(),
+    json_deserializer=orjson.loads,
 )
 
 # Create async session factory
@@ -33,6 +65,82 @@ async_session_maker = async_sessionmaker(
 )
 
 
+class DatabaseUnavailableError(Exception):
+    """Raised when the circuit breaker is open and the database is skipped."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Simple circuit breaker for database access.
+    
+    After `failure_threshold` consecutive connection-level failures the
+    breaker opens and requests fail fast for `reset_timeout` seconds.
+    The next request after that is let through as a trial (half-open).
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+    
+    @property
+    def is_open(self) -> bool:
+        """True while the breaker is tripped and the reset timeout has not elapsed."""
+        if self._opened_at is None:
+            return False
+        return time.monotonic() - self._opened_at < self.reset_timeout
+    
+    def record_success(self):
+        """Close the breaker after a healthy request."""
+        self._failures = 0
+        self._opened_at = None
+    
+    def record_failure(self):
+        """Count a connection failure, tripping the breaker at the threshold."""
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+# Errors that indicate the database itself is unhealthy (not a bad query)
+DB_CONNECTION_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError, OSError)
+
+db_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("DB_BREAKER_THRESHOLD", "5")),
+    reset_timeout=float(os.getenv("DB_BREAKER_RESET_SECONDS", "30")),
+)
+
+
+_last_uuid7 = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Generate a time-ordered UUIDv7 (RFC 9562).
+    
+    48-bit Unix millisecond timestamp followed by random bits, so new
+    primary keys append to the right edge of the B-tree index instead of
+    scattering inserts like uuid4. Wire format is a regular UUID.
+    
+    Values are strictly increasing within a process, even for several ids
+    generated in the same millisecond (RFC 9562 section 6.2, method 2).
+    """
+    global _last_uuid7
+    timestamp_ms = time.time_ns() // 1_000_000
+    value = (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= int.from_bytes(os.urandom(10), "big")
+    # Set version (7) and RFC 4122 variant bits
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    if value <= _last_uuid7:
+        # Same millisecond (or clock stepped back): increment the random tail
+        value = _last_uuid7 + 1
+    _last_uuid7 = value
+    return uuid.UUID(int=value)
+
+
 class Base(DeclarativeBase):
     """Base class for all SQLAlchemy models."""
     pass
@@ -40,13 +148,27 @@ class Base(DeclarativeBase):
 
 async def get_db() -> AsyncSession:
     """Dependency for getting database session."""
+    if db_breaker.is_open:
+        raise DatabaseUnavailableError("Database temporarily unavailable")
+    
     async with async_session_maker() as session:
         try:
             yield session
+        except DB_CONNECTION_ERRORS:
+            db_breaker.record_failure()
+            raise
+        else:
+            db_breaker.record_success()
         finally:
             await session.close()
 
 
+# Run CREATE TABLE IF NOT EXISTS on startup. On by default because there are
+# no migrations yet; set AUTO_CREATE_TABLES=0 once the schema exists to skip
+# the round trip on every cold start.
+AUTO_CREATE_TABLES = os.getenv("AUTO_CREATE_TABLES", "1") == "1"
+
+
 async def create_tables():
     """Create all tables in the database."""
     async with engine.begin() as conn:
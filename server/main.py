@@ -1,49 +1,128 @@
 """InfoFlow Backend - FastAPI Application."""
 
+import asyncio
+import importlib
 import os
 import sys
-from pathlib import Path
 from contextlib import asynccontextmanager
 
-# Add server directory to path for imports
-sys.path.insert(0, str(Path(__file__).parent))
-
+import orjson
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from dotenv import load_dotenv
 
-from routers import decompose, auth, courseworks, chat, images
-from routers.auth import limiter, RATE_LIMIT_ENABLED
-from database import create_tables
+from server.routers import decompose, auth, courseworks, chat, images
+from server.routers.auth import limiter, RATE_LIMIT_ENABLED
+from server.database import AUTO_CREATE_TABLES, create_tables, async_session_maker, db_breaker, DatabaseUnavailableError
+from server.services.auth_service import REVOKED_JTIS_REFRESH_SECONDS, purge_expired_tokens, refresh_revoked_jtis
+from server.services.decomposition_cache import purge_stale_decompositions
+from server.prompts.decomposer import PROMPT_FINGERPRINT
 
 # Optional rate limiting imports
 if RATE_LIMIT_ENABLED:
     from slowapi import _rate_limit_exceeded_handler
     from slowapi.errors import RateLimitExceeded
 
+# Optional uvloop event loop (skip if not installed, e.g. on Windows)
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
+
 # Load environment variables
 load_dotenv()
 
 
+# Backoff between deferred startup attempts (doubles up to the cap)
+INIT_RETRY_INITIAL_SECONDS = 1.0
+INIT_RETRY_MAX_SECONDS = 60.0
+
+
+async def _deferred_init(app: FastAPI):
+    """Run heavy startup work after the server is already accepting traffic."""
+    print(f"Decomposer prompt fingerprint: {PROMPT_FINGERPRINT[:16]}")
+    # Retried until it succeeds (e.g. Postgres still starting) - otherwise
+    # /api/health/ready would report 503 for the life of the process
+    delay = INIT_RETRY_INITIAL_SECONDS
+    while True:
+        try:
+            # Create database tables (skippable on warm/production starts)
+            if AUTO_CREATE_TABLES:
+                await create_tables()
+            # Build the orchestrator singleton (LangChain, Qdrant, PyMuPDF, Gemini
+            # clients) off the event loop so the first decompose/chat request
+            # doesn't pay the import and client construction cost
+            orchestrator = await asyncio.to_thread(importlib.import_module, "server.services.agents.orchestrator")
+            await asyncio.to_thread(orchestrator.get_orchestrator)
+            app.state.ready = True
+            break
+        except Exception as e:
+            print(f"Deferred startup failed, retrying in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, INIT_RETRY_MAX_SECONDS)
+    
+    # Debug: Print all registered routes (single buffered write)
+    if os.getenv("LOG_ROUTES"):
+        lines = ["", "=" * 50, "Registered Routes:", "=" * 50]
+        lines.extend(
+            f"{','.join(route.methods):8} {route.path}"
+            for route in app.routes
+            if hasattr(route, 'methods') and hasattr(route, 'path')
+        )
+        lines.extend(["=" * 50, ""])
+        sys.stdout.write("\n".join(lines) + "\n")
+
+
+# How often expired rows are purged (token blacklist, decomposition cache)
+PURGE_INTERVAL_SECONDS = 24 * 60 * 60
+
+
+async def _purge_expired_rows_periodically():
+    """Nightly cleanup so the token blacklist and caches don't grow forever."""
+    while True:
+        await asyncio.sleep(PURGE_INTERVAL_SECONDS)
+        try:
+            async with async_session_maker() as session:
+                removed = await purge_expired_tokens(session)
+            print(f"Purged {removed} expired blacklisted tokens")
+            removed = await purge_stale_decompositions()
+            print(f"Purged {removed} stale cached decompositions")
+        except Exception as e:
+            print(f"Periodic purge failed: {e}")
+
+
+async def _refresh_revoked_tokens_periodically():
+    """Keep this worker's snapshot of revoked tokens current (see auth_service)."""
+    while True:
+        try:
+            async with async_session_maker() as session:
+                await refresh_revoked_jtis(session)
+        except Exception as e:
+            print(f"Revoked token refresh failed: {e}")
+        await asyncio.sleep(REVOKED_JTIS_REFRESH_SECONDS)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events."""
-    # Create database tables on startup
-    await create_tables()
-    
-    # Debug: Print all registered routes
-    print("\n" + "="*50)
-    print("Registered Routes:")
-    print("="*50)
-    for route in app.routes:
-        if hasattr(route, 'methods') and hasattr(route, 'path'):
-            methods = ','.join(route.methods)
-            print(f"{methods:8} {route.path}")
-    print("="*50 + "\n")
+    # Bind the port immediately; /api/health/ready reports 503 until init is done
+    app.state.ready = False
+    init_task = asyncio.create_task(_deferred_init(app))
+    purge_task = asyncio.create_task(_purge_expired_rows_periodically())
+    revoked_task = asyncio.create_task(_refresh_revoked_tokens_periodically())
     
     yield
-    # Cleanup on shutdown (if needed)
+    
+    # Cleanup on shutdown
+    for task in (init_task, purge_task, revoked_task):
+        if not task.done():
+            task.cancel()
+    
+    from server.services.pdf_parser import shutdown_pdf_pool
+    shutdown_pdf_pool()
 
 
 # Create FastAPI app
@@ -53,6 +132,7 @@ app = FastAPI(
     version="2.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan,
 )
 
@@ -61,6 +141,13 @@ if RATE_LIMIT_ENABLED and limiter:
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+@app.exception_handler(DatabaseUnavailableError)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailableError):
+    """Fast-fail with 503 while the database circuit breaker is open."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 # Build CORS origins list
 cors_origins = [
     "http://localhost:5173",  # Vite dev server
@@ -74,14 +161,25 @@ frontend_url = os.environ.get("FRONTEND_URL")
 if frontend_url:
     cors_origins.append(frontend_url)
 
+# Freeze the config - env is read once at import, never per request
+cors_origins = tuple(cors_origins)
+
+# Allow Vercel deployments and faizluqman.com subdomains
+CORS_ORIGIN_REGEX = r"https://(.*\.vercel\.app|.*\.faizluqman\.com)"
+
+# Compress larger bodies (saved roadmap_data is often tens of KB)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Starlette compiles the regex and does a set lookup for the explicit origins
 app.add_middleware(
     CORSMiddleware,
-    # Allow Vercel deployments and faizluqman.com subdomains
-    allow_origin_regex=r"https://(.*\.vercel\.app|.*\.faizluqman\.com)",
+    allow_origin_regex=CORS_ORIGIN_REGEX,
     allow_origins=cors_origins,  # Plus explicit origins
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Explicit lists (not "*") so browsers can cache the preflight response
+    allow_methods=["GET", "HEAD", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,  # Cache preflight for a day
 )
 
 # Include routers
@@ -92,23 +190,38 @@ app.include_router(chat.router)
 app.include_router(images.router)
 
 
+# Static bodies for monitor-heavy endpoints, serialized once at import
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "infoflow-api"})
+_ROOT_BODY = orjson.dumps({
+    "name": "CourseworkBuddy API",
+    "version": "2.0.0",
+    "docs": "/api/docs",
+    "features": [
+        "Multi-agent RAG decomposition",
+        "Follow-up chat with context",
+        "ChromaDB vector storage",
+    ],
+})
+
+
 @app.api_route("/api/health", methods=["GET", "HEAD"])
+@app.api_route("/api/health/live", methods=["GET", "HEAD"])
 async def health_check():
-    """Health check endpoint - supports both GET and HEAD (for UptimeRobot)."""
-    return {"status": "healthy", "service": "infoflow-api"}
+    """Liveness probe - always 200 once the process is serving. Supports HEAD (for UptimeRobot)."""
+    return Response(content=_HEALTH_BODY, media_type="application/json")
+
+
+@app.get("/api/health/ready")
+async def readiness_check():
+    """Readiness probe - 503 until startup init completes or while the database circuit breaker is open."""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    if db_breaker.is_open:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "reason": "database"})
+    return {"status": "ready"}
 
 
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
-    return {
-        "name": "CourseworkBuddy API",
-        "version": "2.0.0",
-        "docs": "/api/docs",
-        "features": [
-            "Multi-agent RAG decomposition",
-            "Follow-up chat with context",
-            "ChromaDB vector storage",
-        ],
-    }
-
+    return Response(content=_ROOT_BODY, media_type="application/json")
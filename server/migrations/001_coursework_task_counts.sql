@@ -0,0 +1,17 @@
+-- Add denormalized task counts to existing courseworks tables.
+-- New databases get these columns from create_tables(); run this once
+-- against databases created before the columns existed.
+
+ALTER TABLE courseworks ADD COLUMN IF NOT EXISTS total_tasks INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE courseworks ADD COLUMN IF NOT EXISTS completed_tasks INTEGER NOT NULL DEFAULT 0;
+
+-- Backfill from roadmap_data
+UPDATE courseworks
+SET
+    total_tasks = COALESCE(jsonb_array_length(roadmap_data->'tasks'), 0),
+    completed_tasks = (
+        SELECT count(*)
+        FROM jsonb_array_elements(roadmap_data->'tasks') AS task(value)
+        WHERE task.value->>'status' = 'done'
+    )
+WHERE jsonb_typeof(roadmap_data->'tasks') = 'array';
@@ -0,0 +1,14 @@
+-- Rebuild ix_courseworks_user_updated as a covering index for the
+-- list_courseworks summary columns. deadline_note is unbounded Text and is
+-- left out so long notes can't exceed the btree row size limit.
+-- New databases get this index from create_tables(). CONCURRENTLY cannot
+-- run inside a transaction, so run this file with plain psql (autocommit).
+-- Safe to re-run: it rebuilds an index that still includes deadline_note.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_courseworks_user_updated_new
+    ON courseworks (user_id, updated_at DESC)
+    INCLUDE (id, course_name, deadline, created_at, total_tasks, completed_tasks);
+
+DROP INDEX CONCURRENTLY IF EXISTS ix_courseworks_user_updated;
+
+ALTER INDEX ix_courseworks_user_updated_new RENAME TO ix_courseworks_user_updated;
@@ -0,0 +1,7 @@
+-- Add the GIN index for containment queries on roadmap_data
+-- (roadmap_data @> '{...}') to existing courseworks tables.
+-- New databases get this index from create_tables(). CONCURRENTLY cannot
+-- run inside a transaction, so run this file with plain psql (autocommit).
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_courseworks_roadmap_gin
+    ON courseworks USING gin (roadmap_data jsonb_path_ops);
@@ -0,0 +1,29 @@
+-- Move created_at/updated_at on users and courseworks to timestamptz with
+-- a now() default, so INSERTs that leave them to Postgres succeed.
+-- New databases get these columns from create_tables(). Existing values
+-- were written by datetime.utcnow(), so they are read as UTC. Safe to
+-- re-run: columns that are already timestamptz are left as they are.
+
+DO $$
+DECLARE
+    col record;
+BEGIN
+    FOR col IN
+        SELECT table_name, column_name
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+            AND table_name IN ('users', 'courseworks')
+            AND column_name IN ('created_at', 'updated_at')
+            AND data_type = 'timestamp without time zone'
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE %I ALTER COLUMN %I TYPE timestamptz USING %I AT TIME ZONE ''UTC''',
+            col.table_name, col.column_name, col.column_name
+        );
+    END LOOP;
+END $$;
+
+ALTER TABLE users ALTER COLUMN created_at SET DEFAULT now();
+ALTER TABLE users ALTER COLUMN updated_at SET DEFAULT now();
+ALTER TABLE courseworks ALTER COLUMN created_at SET DEFAULT now();
+ALTER TABLE courseworks ALTER COLUMN updated_at SET DEFAULT now();
@@ -2,11 +2,11 @@
 
 import uuid
 from datetime import datetime
-from sqlalchemy import String, DateTime, ForeignKey, Text
+from sqlalchemy import String, DateTime, ForeignKey, Text, Index, Integer, func
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from database import Base
+from server.database import Base, uuid7
 
 
 class Coursework(Base):
@@ -17,18 +17,19 @@ class Coursework(Base):
     """
     
     __tablename__ = "courseworks"
+    # Fetch server-generated timestamps via RETURNING (no lazy load in async)
+    __mapper_args__ = {"eager_defaults": True}
     
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True),
         primary_key=True,
-        default=uuid.uuid4
+        default=uuid7  # Time-ordered for index locality
     )
     user_id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True),
         ForeignKey("users.id", ondelete="CASCADE"),
-        nullable=False,
-        index=True
-    )
+        nullable=False
+    )  # Indexed via ix_courseworks_user_updated below
     
     # Quick-access fields for listing/filtering
     course_name: Mapped[str] = mapped_column(
@@ -45,6 +46,21 @@ class Coursework(Base):
         nullable=True
     )
     
+    # Task counts denormalized from roadmap_data on write, so the dashboard
+    # listing never has to load or scan the JSONB blob
+    total_tasks: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+    completed_tasks: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False,
+        default=0,
+        server_default="0"
+    )
+    
     # COMPLETE roadmap data as JSON - stores the ENTIRE DecompositionResponse
     # This includes: tasks, milestones, get_started_steps, terminology,
     # marking_criteria, prioritization_tiers, directory_structure,
@@ -54,20 +70,50 @@ class Coursework(Base):
         nullable=False
     )
     
+    # Timestamps are set by Postgres (server clock) rather than the worker
     created_at: Mapped[datetime] = mapped_column(
-        DateTime,
-        default=datetime.utcnow,
+        DateTime(timezone=True),
+        server_default=func.now(),
         nullable=False
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime,
-        default=datetime.utcnow,
-        onupdate=datetime.utcnow,
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
         nullable=False
     )
     
-    # Relationship to user
-    user = relationship("User", back_populates="courseworks")
+    # Relationship to user (routes already hold the User; load explicitly if needed)
+    user = relationship("User", back_populates="courseworks", lazy="raise")
     
     def __repr__(self) -> str:
         return f"<Coursework {self.course_name} ({self.id})>"
+
+
+# Dashboard listing: WHERE user_id = ? ORDER BY updated_at DESC
+Index(
+    "ix_courseworks_user_updated",
+    Coursework.user_id,
+    Coursework.updated_at.desc(),
+    # Covers the bounded summary columns for the dashboard listing.
+    # deadline_note (unbounded Text) is read from the heap instead: a long
+    # note would exceed the btree row size limit and fail the write.
+    # roadmap_data is deliberately left out
+    postgresql_include=[
+        "id",
+        "course_name",
+        "deadline",
+        "created_at",
+        "total_tasks",
+        "completed_tasks",
+    ],
+)
+
+# Containment queries (roadmap_data @> '{...}') evaluated in Postgres;
+# jsonb_path_ops is smaller and faster than the default jsonb_ops for @>
+Index(
+    "ix_courseworks_roadmap_gin",
+    Coursework.roadmap_data,
+    postgresql_using="gin",
+    postgresql_ops={"roadmap_data": "jsonb_path_ops"},
+)
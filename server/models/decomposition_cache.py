@@ -0,0 +1,46 @@
+"""Decomposition cache model - reuses LLM output for identical PDFs."""
+
+from datetime import datetime
+from sqlalchemy import String, DateTime, func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from server.database import Base
+
+
+class DecompositionCache(Base):
+    """Cached DecompositionResponse keyed by PDF content + prompt fingerprint.
+    
+    Students in the same course upload the same spec PDF, so the expensive
+    LLM analysis only needs to run once per (PDF, prompt version).
+    """
+    
+    __tablename__ = "decomposition_cache"
+    
+    # sha256(pdf bytes + prompt fingerprint)
+    cache_key: Mapped[str] = mapped_column(
+        String(64),
+        primary_key=True
+    )
+    # Prompt version that produced this entry (stale entries are purged)
+    prompt_fingerprint: Mapped[str] = mapped_column(
+        String(64),
+        nullable=False
+    )
+    decomposition: Mapped[dict] = mapped_column(
+        JSONB,
+        nullable=False
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        index=True
+    )
+    
+    def __repr__(self) -> str:
+        return f"<DecompositionCache {self.cache_key[:12]}>"
@@ -1,56 +1,68 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+
+
+# Shared config for the decomposition models parsed from LLM output.
+# defer_build postpones validator/schema construction until first use,
+# keeping it off the import path; unknown keys from the LLM are dropped and
+# numeric ids/names (e.g. "task_id": 1) are accepted as strings.
+DECOMPOSITION_MODEL_CONFIG = ConfigDict(defer_build=True, extra="ignore", coerce_numbers_to_str=True)
 
 
 class Task(BaseModel):
     """Individual task extracted from coursework specification."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     task_id: str = Field(..., description="Unique identifier for the task")
     title: str = Field(..., description="Clear, concise task title")
     description: str = Field(..., description="Detailed description of what needs to be done")
     estimated_time: str = Field(..., description="Estimated time to complete (e.g., '30 mins')")
     related_files: list[str] = Field(default_factory=list, description="Files to work on")
-    pdf_snippet: Optional[str] = Field(None, description="Relevant text from the PDF")
+    pdf_snippet: str | None = Field(None, description="Relevant text from the PDF")
     commands: list[str] = Field(default_factory=list, description="Terminal commands needed")
     prerequisites: list[str] = Field(default_factory=list, description="Task IDs that must be done first")
     status: str = Field(default="todo", description="Current status: todo, in_progress, done")
-    priority: Optional[int] = Field(None, description="Priority level (0 = highest)")
+    priority: int | None = Field(None, description="Priority level (0 = highest)")
 
 
 class Milestone(BaseModel):
     """Major deliverable containing multiple tasks."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     id: str = Field(..., description="Milestone identifier")
     title: str = Field(..., description="Milestone title")
-    description: Optional[str] = Field(None, description="Milestone description")
-    summary: Optional[str] = Field(None, description="Brief summary of what to accomplish")
+    description: str | None = Field(None, description="Milestone description")
+    summary: str | None = Field(None, description="Brief summary of what to accomplish")
     tasks: list[str] = Field(default_factory=list, description="Task IDs in this milestone")
 
 
 class TermDefinition(BaseModel):
     """Domain-specific term with explanation."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     term: str = Field(..., description="The technical term")
     definition: str = Field(..., description="Plain-English explanation for 2nd year CS students")
-    example: Optional[str] = Field(None, description="Concrete example if helpful")
+    example: str | None = Field(None, description="Concrete example if helpful")
 
 
 class MarkingCriterion(BaseModel):
     """Grading component from the specification."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     component: str = Field(..., description="Name of the graded component")
-    percentage: Optional[int] = Field(None, description="Percentage if specified, None if not found")
+    percentage: int | None = Field(None, description="Percentage if specified, None if not found")
     description: str = Field(..., description="What this component assesses")
     priority: str = Field(default="essential", description="Tier: 'essential', 'strong', or 'excellence'")
 
 
 class GetStartedStep(BaseModel):
     """Step in the getting started guide."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     step_number: int = Field(..., description="Step order number")
     title: str = Field(..., description="Brief step title")
     description: str = Field(..., description="Detailed explanation")
     commands: list[str] = Field(default_factory=list, description="Terminal commands to run")
-    expected_output: Optional[str] = Field(None, description="What user should see after running")
+    expected_output: str | None = Field(None, description="What user should see after running")
 
 
 class PrioritizationTier(BaseModel):
     """Task grouping by priority tier."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     tier: str = Field(..., description="Tier name: 'Essential', 'Strong', or 'Excellence'")
     description: str = Field(..., description="What this tier represents")
     time_estimate: str = Field(..., description="Estimated hours for this tier")
@@ -59,6 +71,7 @@ class PrioritizationTier(BaseModel):
 
 class WeeklySchedule(BaseModel):
     """Recommended work schedule entry."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     week: int = Field(..., description="Week number")
     title: str = Field(..., description="Week focus title")
     task_ids: list[str] = Field(default_factory=list, description="Task IDs to complete this week")
@@ -67,26 +80,28 @@ class WeeklySchedule(BaseModel):
 
 class DirectoryEntry(BaseModel):
     """Entry in the project directory structure."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     path: str = Field(..., description="File or folder path")
     type: str = Field(..., description="'file' or 'directory'")
-    description: Optional[str] = Field(None, description="What this file/folder contains")
+    description: str | None = Field(None, description="What this file/folder contains")
 
 
 class DecompositionResponse(BaseModel):
     """Response from the decomposition endpoint."""
+    model_config = DECOMPOSITION_MODEL_CONFIG
     # Core fields (existing)
     tasks: list[Task] = Field(..., description="List of atomic tasks")
     milestones: list[Milestone] = Field(default_factory=list, description="Major deliverables")
     setup_instructions: list[str] = Field(default_factory=list, description="Environment setup steps")
-    course_name: Optional[str] = Field(None, description="Detected course name")
-    total_estimated_time: Optional[str] = Field(None, description="Total time estimate")
-    summary_overview: Optional[str] = Field(None, description="Brief overview of the coursework")
+    course_name: str | None = Field(None, description="Detected course name")
+    total_estimated_time: str | None = Field(None, description="Total time estimate")
+    summary_overview: str | None = Field(None, description="Brief overview of the coursework")
     key_deliverables: list[str] = Field(default_factory=list, description="Main things to deliver")
-    what_you_need_to_do: Optional[str] = Field(None, description="Plain language explanation")
+    what_you_need_to_do: str | None = Field(None, description="Plain language explanation")
     
     # NEW: Implementation Guide fields
-    deadline: Optional[str] = Field(None, description="Deadline in ISO 8601 format (YYYY-MM-DDTHH:MM:SS)")
-    deadline_note: Optional[str] = Field(None, description="Additional deadline info, e.g., 'Friday noon'")
+    deadline: str | None = Field(None, description="Deadline in ISO 8601 format (YYYY-MM-DDTHH:MM:SS)")
+    deadline_note: str | None = Field(None, description="Additional deadline info, e.g., 'Friday noon'")
     
     get_started_steps: list[GetStartedStep] = Field(default_factory=list, description="Getting started guide")
     directory_structure: list[DirectoryEntry] = Field(default_factory=list, description="Expected project structure")
@@ -105,7 +120,7 @@ class DecompositionResponse(BaseModel):
 class ErrorResponse(BaseModel):
     """Error response model."""
     detail: str
-    error_code: Optional[str] = None
+    error_code: str | None = None
 
 
 # ============ Chat/RAG Models ============
@@ -128,7 +143,7 @@ class ChatSource(BaseModel):
     chunk_index: int = Field(..., description="Index of chunk in document")
     preview: str = Field(..., description="Preview of chunk content")
     source_type: str = Field(default="text", description="Type: 'text' or 'image'")
-    image_path: Optional[str] = Field(None, description="Path to image if source is an image")
+    image_path: str | None = Field(None, description="Path to image if source is an image")
 
 
 class ChatResponse(BaseModel):
@@ -137,3 +152,11 @@ class ChatResponse(BaseModel):
     sources: list[ChatSource] = Field(default_factory=list, description="Source chunks used")
     images: list[str] = Field(default_factory=list, description="Relevant image paths for display")
 
+
+# ============ Cached Type Adapters ============
+# Built once at import; use these for manual (de)serialization instead of
+# constructing a TypeAdapter (and its core schema) per call.
+
+TASK_LIST_ADAPTER = TypeAdapter(list[Task])
+DECOMPOSITION_ADAPTER = TypeAdapter(DecompositionResponse)
+DECOMPOSE_WITH_SESSION_ADAPTER = TypeAdapter(DecomposeResponseWithSession)
@@ -4,7 +4,7 @@ from datetime import datetime
 from sqlalchemy import String, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
 
-from database import Base
+from server.database import Base
 
 
 class TokenBlacklist(Base):
@@ -2,22 +2,24 @@
 
 import uuid
 from datetime import datetime
-from sqlalchemy import String, DateTime
+from sqlalchemy import String, DateTime, func
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
-from database import Base
+from server.database import Base, uuid7
 
 
 class User(Base):
     """User model for authentication."""
     
     __tablename__ = "users"
+    # Fetch server-generated timestamps via RETURNING (no lazy load in async)
+    __mapper_args__ = {"eager_defaults": True}
     
     id: Mapped[uuid.UUID] = mapped_column(
         UUID(as_uuid=True),
         primary_key=True,
-        default=uuid.uuid4
+        default=uuid7  # Time-ordered for index locality
     )
     email: Mapped[str] = mapped_column(
         String(255),
@@ -33,20 +35,30 @@ class User(Base):
         String(100),
         nullable=False
     )
+    # Timestamps are set by Postgres (server clock) rather than the worker
     created_at: Mapped[datetime] = mapped_column(
-        DateTime,
-        default=datetime.utcnow,
+        DateTime(timezone=True),
+        server_default=func.now(),
         nullable=False
     )
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime,
-        default=datetime.utcnow,
-        onupdate=datetime.utcnow,
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
         nullable=False
     )
     
-    # Relationship to courseworks
-    courseworks = relationship("Coursework", back_populates="user", cascade="all, delete-orphan")
+    # Relationship to courseworks.
+    # Never lazy-load in async sessions (use selectinload() explicitly); the
+    # user is fetched on every authenticated request, so eager loading here
+    # would pull every roadmap along with it. Deletes cascade in Postgres.
+    courseworks = relationship(
+        "Coursework",
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        lazy="raise",
+    )
     
     def __repr__(self) -> str:
         return f"<User {self.email}>"
@@ -1,6 +1,17 @@
 """System prompt for the AI decomposer - the 'Secret Sauce'."""
 
-DECOMPOSER_SYSTEM_PROMPT = """You are an expert Technical Project Manager for University Informatics students.
+import hashlib
+from typing import Final
+
+__all__ = [
+    "DECOMPOSER_SYSTEM_PROMPT",
+    "USER_PROMPT_TEMPLATE",
+    "USER_PROMPT_STATIC",
+    "USER_PROMPT_SUFFIX",
+    "PROMPT_FINGERPRINT",
+]
+
+DECOMPOSER_SYSTEM_PROMPT: Final[str] = """You are an expert Technical Project Manager for University Informatics students.
 Your goal is to break down a complex assignment specification into a comprehensive Implementation Guide.
 
 ## Rules
@@ -182,13 +193,10 @@ If the user asks you to solve something, respond with:
 Remember: Your job is to be a PROJECT MANAGER, not a PROGRAMMER. Help students organize their work, not do it for them."""
 
 
-USER_PROMPT_TEMPLATE = """Please analyze the following coursework specification and create a comprehensive Implementation Guide.
-
-## PDF Content
-
-{pdf_content}
-
----
+# NOTE: {pdf_content} must stay at the very end. Everything before it
+# (system prompt + these instructions) is a byte-identical prefix on every
+# call, which is what lets Gemini's implicit prompt caching reuse it.
+USER_PROMPT_TEMPLATE: Final[str] = """Please analyze the following coursework specification and create a comprehensive Implementation Guide.
 
 Create a complete Implementation Guide with:
 1. Summary overview and key deliverables
@@ -208,5 +216,26 @@ Focus on helping the student understand:
 - WHAT order to work in
 - HOW their work will be graded
 
-Remember: Guide their planning, don't solve their problems."""
+Remember: Guide their planning, don't solve their problems.
+
+---
+
+## PDF Content
+
+{pdf_content}"""
+
+
+# The instruction prose before {pdf_content} - identical on every call, so
+# it can be uploaded once as explicit cached content with the system prompt.
+# The prompt is built by joining STATIC + PDF + SUFFIX (no str.format pass
+# over the PDF text; the template has no other placeholders or braces).
+USER_PROMPT_STATIC: Final[str] = USER_PROMPT_TEMPLATE.partition("{pdf_content}")[0]
+USER_PROMPT_SUFFIX: Final[str] = USER_PROMPT_TEMPLATE.partition("{pdf_content}")[2]
+
 
+# Hash of the static prompt prefix. Logged at startup so deploys can confirm
+# every instance sends an identical prefix (any drift defeats prompt caching),
+# and usable as a version key for anything cached from decomposition output.
+PROMPT_FINGERPRINT: Final[str] = hashlib.sha256(
+    (DECOMPOSER_SYSTEM_PROMPT + USER_PROMPT_TEMPLATE).encode("utf-8")
+).hexdigest()
@@ -3,9 +3,11 @@
 from fastapi import APIRouter, Depends, HTTPException, Header, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
+from uuid import UUID
 
-from database import get_db
-from services.auth_service import (
+from server.database import get_db
+from server.models.user import User
+from server.services.auth_service import (
     UserCreate,
     UserLogin,
     UserResponse,
@@ -13,9 +15,11 @@ from services.auth_service import (
     AuthError,
     register_user,
     login_user,
-    get_current_user,
+    get_user_from_claims,
+    get_user_id_from_claims,
     decode_access_token,
     blacklist_token,
+    parse_bearer,
 )
 
 # Optional rate limiting (skip if slowapi not installed)
@@ -40,50 +44,83 @@ def rate_limit(limit: str):
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 
-def get_token_from_header(authorization: Optional[str] = Header(None)) -> Optional[str]:
-    """Extract JWT token from Authorization header."""
-    if not authorization:
-        return None
-    if not authorization.startswith("Bearer "):
-        return None
-    return authorization[7:]
+def get_token_claims(request: Request, token: str):
+    """Decode the JWT once per request; later callers reuse request.state."""
+    if getattr(request.state, "auth_token", None) == token:
+        return request.state.auth_claims
+    claims = decode_access_token(token)
+    request.state.auth_token = token
+    request.state.auth_claims = claims
+    return claims
+
+
+async def _resolve_user(request: Request, token: str, db: AsyncSession) -> User:
+    """Resolve the user for a token, memoized on request.state."""
+    user = getattr(request.state, "auth_user", None)
+    if user is not None:
+        return user
+    user = await get_user_from_claims(db, get_token_claims(request, token))
+    request.state.auth_user = user
+    return user
 
 
 async def require_auth(
+    request: Request,
     authorization: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
-):
+) -> User:
     """Dependency that requires authentication."""
-    token = get_token_from_header(authorization)
+    token = parse_bearer(authorization)
     if not token:
         raise HTTPException(status_code=401, detail="Authentication required")
     
     try:
-        user = await get_current_user(db, token)
-        return user
+        return await _resolve_user(request, token, db)
     except AuthError as e:
         raise HTTPException(status_code=e.status_code, detail=e.message)
 
 
 async def get_current_user_optional(
+    request: Request,
     authorization: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
-):
+) -> Optional[User]:
     """
     Dependency that optionally gets the current user.
     Returns None if not authenticated (instead of raising an error).
     """
-    token = get_token_from_header(authorization)
+    token = parse_bearer(authorization)
     if not token:
         return None
     
     try:
-        user = await get_current_user(db, token)
-        return user
+        return await _resolve_user(request, token, db)
     except AuthError:
         return None
 
 
+async def get_current_user_id_optional(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db)
+) -> Optional[UUID]:
+    """
+    Dependency that optionally gets the current user's id from the JWT.
+    Unlike get_current_user_optional, the User row is never loaded.
+    """
+    token = parse_bearer(authorization)
+    if not token:
+        return None
+    
+    user = getattr(request.state, "auth_user", None)
+    if user is not None:
+        return user.id
+    
+    try:
+        return await get_user_id_from_claims(db, get_token_claims(request, token))
+    except AuthError:
+        return None
+
 
 @router.post("/register", response_model=TokenResponse)
 @rate_limit("3/minute")
@@ -129,28 +166,18 @@ async def login(
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_me(
-    authorization: Optional[str] = Header(None),
-    db: AsyncSession = Depends(get_db)
-):
+async def get_me(user: User = Depends(require_auth)):
     """
     Get the current authenticated user's info.
     
     Requires Authorization header with Bearer token.
     """
-    token = get_token_from_header(authorization)
-    if not token:
-        raise HTTPException(status_code=401, detail="Authentication required")
-    
-    try:
-        user = await get_current_user(db, token)
-        return UserResponse.model_validate(user)
-    except AuthError as e:
-        raise HTTPException(status_code=e.status_code, detail=e.message)
+    return UserResponse.model_validate(user)
 
 
 @router.post("/logout", status_code=204)
 async def logout(
+    request: Request,
     authorization: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
@@ -159,11 +186,11 @@ async def logout(
 
     Adds the token to a blacklist so it can no longer be used.
     """
-    token = get_token_from_header(authorization)
+    token = parse_bearer(authorization)
     if not token:
         raise HTTPException(status_code=401, detail="Authentication required")
 
-    decoded = decode_access_token(token)
+    decoded = get_token_claims(request, token)
     if not decoded:
         raise HTTPException(status_code=401, detail="Invalid token")
 
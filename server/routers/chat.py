@@ -1,21 +1,27 @@
 """Chat API router for follow-up questions about coursework."""
 
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import os
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends
 from typing import Optional
+from uuid import UUID
 
-from services.agents.orchestrator import get_orchestrator
-from services.agents.qa_agent import ConversationMemory
-from models.schemas import ChatRequest, ChatResponse, ChatSource
-from routers.auth import get_current_user_optional
+from server.models.schemas import ChatRequest, ChatResponse, ChatSource
+from server.routers.auth import get_current_user_id_optional
 
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
+# Upper bound on a single chat turn, so a stuck upstream LLM can't hang the request
+CHAT_TIMEOUT_SECONDS = float(os.getenv("CHAT_TIMEOUT_SECONDS", "60"))
+
 
 @router.post("/", response_model=ChatResponse)
 async def chat_with_coursework(
     request: ChatRequest,
-    current_user = Depends(get_current_user_optional),
+    background_tasks: BackgroundTasks,
+    user_id: Optional[UUID] = Depends(get_current_user_id_optional),
 ):
     """
     Ask a follow-up question about your coursework.
@@ -26,22 +32,44 @@ async def chat_with_coursework(
     
     **Rate Limits**: Gemini free tier limits apply (15 requests/min)
     """
+    # Imported lazily - the agent stack pulls in LangChain and Qdrant
+    from server.services.agents.orchestrator import get_orchestrator
+    from server.services.agents.qa_agent import ConversationMemory
+    from server.services.chat_cache import lookup_chat_response, store_chat_response
     orchestrator = get_orchestrator()
     
     # Extract user ID for collection namespacing
-    user_id = str(current_user.id) if current_user else "anonymous"
-    collection_name = f"coursework_{user_id}"
+    collection_name = f"coursework_{user_id or 'anonymous'}"
+    
+    # Only standalone questions are served from the semantic cache -
+    # follow-ups depend on the conversation so far
+    vector, cached = None, None
+    if not await ConversationMemory.get_history(request.session_id, limit=1):
+        vector, cached = await lookup_chat_response(collection_name, request.question)
     
-    try:
-        result = await orchestrator.run_chat(
-            question=request.question,
-            session_id=request.session_id,
-            collection_name=collection_name,
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+    if cached is not None:
+        result = cached
+        await ConversationMemory.add_exchange(request.session_id, request.question, result["answer"])
+    else:
+        try:
+            result = await asyncio.wait_for(
+                orchestrator.run_chat(
+                    question=request.question,
+                    session_id=request.session_id,
+                    collection_name=collection_name,
+                ),
+                timeout=CHAT_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Chat timed out, please try again")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
+        
+        # Stored after the response is sent - the answer doesn't wait on Qdrant
+        if vector is not None:
+            background_tasks.add_task(store_chat_response, collection_name, request.question, vector, result)
     
     return ChatResponse(
         answer=result["answer"],
@@ -53,7 +81,7 @@ async def chat_with_coursework(
 @router.delete("/{session_id}")
 async def clear_chat_history(
     session_id: str,
-    current_user = Depends(get_current_user_optional),
+    user_id: Optional[UUID] = Depends(get_current_user_id_optional),
 ):
     """
     Clear chat history for a session.
@@ -61,11 +89,13 @@ async def clear_chat_history(
     Useful for starting a fresh conversation while keeping 
     the document embeddings intact.
     """
-    ConversationMemory.clear(session_id)
+    from server.services.agents.qa_agent import ConversationMemory
+    await ConversationMemory.clear(session_id)
     return {"status": "cleared", "session_id": session_id}
 
 
 @router.get("/sessions/count")
 async def get_session_count():
     """Get number of active chat sessions (for monitoring)."""
-    return {"active_sessions": ConversationMemory.get_session_count()}
+    from server.services.agents.qa_agent import ConversationMemory
+    return {"active_sessions": await ConversationMemory.get_session_count()}
@@ -4,17 +4,22 @@ from typing import Optional
 from uuid import UUID
 from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from sqlalchemy import select, delete
+from sqlalchemy import select, insert, update, delete, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import get_db
-from models.coursework import Coursework
-from models.user import User
-from services.auth_service import get_current_user, AuthError
+from server.database import get_db
+from server.models.coursework import Coursework
+from server.models.user import User
+from server.routers.auth import require_auth
 
-router = APIRouter(prefix="/api/courseworks", tags=["courseworks"])
+router = APIRouter(
+    prefix="/api/courseworks",
+    tags=["courseworks"],
+    default_response_class=ORJSONResponse,
+)
 
 
 # Request/Response schemas
@@ -61,40 +66,60 @@ class CourseworkDetail(BaseModel):
         from_attributes = True
 
 
-def extract_token(authorization: Optional[str] = Header(None)) -> Optional[str]:
-    """Extract JWT token from Authorization header."""
-    if not authorization or not authorization.startswith("Bearer "):
-        return None
-    return authorization[7:]
+def count_tasks(roadmap_data: dict) -> tuple[int, int]:
+    """Count total and completed tasks from roadmap data."""
+    tasks = roadmap_data.get("tasks") or []
+    total = len(tasks)
+    completed = sum(1 for t in tasks if isinstance(t, dict) and t.get("status") == "done")
+    return total, completed
 
 
-async def get_authenticated_user(
-    authorization: Optional[str] = Header(None),
-    db: AsyncSession = Depends(get_db)
-) -> User:
-    """Dependency that requires authentication and returns the user."""
-    token = extract_token(authorization)
-    if not token:
-        raise HTTPException(status_code=401, detail="Authentication required")
+def _invalidate_chat_cache(background_tasks: BackgroundTasks, user: User) -> None:
+    """Drop cached chat answers for the user once the response is sent."""
+    # Imported lazily - pulls in Qdrant and LangChain
+    from server.services.chat_cache import invalidate_chat_responses
+    background_tasks.add_task(invalidate_chat_responses, f"coursework_{user.id}")
+
+
+def _row_response(row, status_code: int = 200) -> ORJSONResponse:
+    """
+    Serialize a selected row directly with orjson.
     
-    try:
-        return await get_current_user(db, token)
-    except AuthError as e:
-        raise HTTPException(status_code=e.status_code, detail=e.message)
+    Rows come straight from our own table, so the schemas above only
+    document the responses (no response_model re-validation per request).
+    """
+    return ORJSONResponse(dict(row._mapping), status_code=status_code)
 
 
-def count_tasks(roadmap_data: dict) -> tuple[int, int]:
-    """Count total and completed tasks from roadmap data."""
-    tasks = roadmap_data.get("tasks", [])
-    total = len(tasks)
-    completed = sum(1 for t in tasks if t.get("status") == "done")
-    return total, completed
+# Columns for the dashboard listing - deliberately excludes roadmap_data,
+# which can be a large TOASTed JSONB value
+SUMMARY_COLUMNS = (
+    Coursework.id,
+    Coursework.course_name,
+    Coursework.deadline,
+    Coursework.deadline_note,
+    Coursework.created_at,
+    Coursework.updated_at,
+    Coursework.total_tasks,
+    Coursework.completed_tasks,
+)
+
+# Columns backing CourseworkDetail
+DETAIL_COLUMNS = (
+    Coursework.id,
+    Coursework.course_name,
+    Coursework.deadline,
+    Coursework.deadline_note,
+    Coursework.roadmap_data,
+    Coursework.created_at,
+    Coursework.updated_at,
+)
 
 
-@router.post("", response_model=CourseworkDetail, status_code=201)
+@router.post("", status_code=201, responses={201: {"model": CourseworkDetail}})
 async def create_coursework(
     data: CourseworkCreate,
-    user: User = Depends(get_authenticated_user),
+    user: User = Depends(require_auth),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -103,24 +128,31 @@ async def create_coursework(
     Stores the complete DecompositionResponse including all tasks,
     milestones, guides, terminology, and other extracted data.
     """
-    coursework = Coursework(
-        user_id=user.id,
-        course_name=data.course_name or "Untitled Coursework",
-        deadline=data.deadline,
-        deadline_note=data.deadline_note,
-        roadmap_data=data.roadmap_data,
-    )
+    total_tasks, completed_tasks = count_tasks(data.roadmap_data)
     
-    db.add(coursework)
+    # INSERT ... RETURNING - one round trip, server defaults included
+    result = await db.execute(
+        insert(Coursework)
+        .values(
+            user_id=user.id,
+            course_name=data.course_name or "Untitled Coursework",
+            deadline=data.deadline,
+            deadline_note=data.deadline_note,
+            roadmap_data=data.roadmap_data,
+            total_tasks=total_tasks,
+            completed_tasks=completed_tasks,
+        )
+        .returning(*DETAIL_COLUMNS)
+    )
+    row = result.one()
     await db.commit()
-    await db.refresh(coursework)
     
-    return CourseworkDetail.model_validate(coursework)
+    return _row_response(row, status_code=201)
 
 
-@router.get("", response_model=list[CourseworkSummary])
+@router.get("", responses={200: {"model": list[CourseworkSummary]}})
 async def list_courseworks(
-    user: User = Depends(get_authenticated_user),
+    user: User = Depends(require_auth),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -129,33 +161,18 @@ async def list_courseworks(
     Returns summary info for each coursework suitable for dashboard display.
     """
     result = await db.execute(
-        select(Coursework)
+        select(*SUMMARY_COLUMNS)
         .where(Coursework.user_id == user.id)
         .order_by(Coursework.updated_at.desc())
     )
-    courseworks = result.scalars().all()
-    
-    summaries = []
-    for cw in courseworks:
-        total, completed = count_tasks(cw.roadmap_data)
-        summaries.append(CourseworkSummary(
-            id=cw.id,
-            course_name=cw.course_name,
-            deadline=cw.deadline,
-            deadline_note=cw.deadline_note,
-            created_at=cw.created_at,
-            updated_at=cw.updated_at,
-            total_tasks=total,
-            completed_tasks=completed,
-        ))
-    
-    return summaries
-
-
-@router.get("/{coursework_id}", response_model=CourseworkDetail)
+    
+    return ORJSONResponse([dict(row._mapping) for row in result])
+
+
+@router.get("/{coursework_id}", responses={200: {"model": CourseworkDetail}})
 async def get_coursework(
     coursework_id: UUID,
-    user: User = Depends(get_authenticated_user),
+    user: User = Depends(require_auth),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -164,22 +181,23 @@ async def get_coursework(
     Returns the full roadmap data including all guides and tasks.
     """
     result = await db.execute(
-        select(Coursework)
+        select(*DETAIL_COLUMNS)
         .where(Coursework.id == coursework_id, Coursework.user_id == user.id)
     )
-    coursework = result.scalar_one_or_none()
+    row = result.one_or_none()
     
-    if not coursework:
+    if row is None:
         raise HTTPException(status_code=404, detail="Coursework not found")
     
-    return CourseworkDetail.model_validate(coursework)
+    return _row_response(row)
 
 
-@router.put("/{coursework_id}", response_model=CourseworkDetail)
+@router.put("/{coursework_id}", responses={200: {"model": CourseworkDetail}})
 async def update_coursework(
     coursework_id: UUID,
     data: CourseworkUpdate,
-    user: User = Depends(get_authenticated_user),
+    background_tasks: BackgroundTasks,
+    user: User = Depends(require_auth),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -187,36 +205,50 @@ async def update_coursework(
     
     Can update course name and/or roadmap data (e.g., task statuses).
     """
+    # Always bump the timestamp, even if no other column changed
+    values = {"updated_at": func.now()}
+    
+    if data.course_name is not None:
+        values["course_name"] = data.course_name
+    
+    if data.roadmap_data is not None:
+        total_tasks, completed_tasks = count_tasks(data.roadmap_data)
+        values.update(
+            roadmap_data=data.roadmap_data,
+            # Also update deadline from roadmap if present
+            deadline=data.roadmap_data.get("deadline"),
+            deadline_note=data.roadmap_data.get("deadline_note"),
+            # Keep denormalized counts in sync for the dashboard listing
+            total_tasks=total_tasks,
+            completed_tasks=completed_tasks,
+        )
+    
+    # Ownership check and UPDATE ... RETURNING in a single statement
     result = await db.execute(
-        select(Coursework)
+        update(Coursework)
         .where(Coursework.id == coursework_id, Coursework.user_id == user.id)
+        .values(**values)
+        .returning(*DETAIL_COLUMNS)
+        .execution_options(synchronize_session=False)
     )
-    coursework = result.scalar_one_or_none()
+    row = result.one_or_none()
     
-    if not coursework:
+    if row is None:
         raise HTTPException(status_code=404, detail="Coursework not found")
     
-    if data.course_name is not None:
-        coursework.course_name = data.course_name
+    await db.commit()
     
     if data.roadmap_data is not None:
-        coursework.roadmap_data = data.roadmap_data
-        # Also update deadline from roadmap if present
-        coursework.deadline = data.roadmap_data.get("deadline")
-        coursework.deadline_note = data.roadmap_data.get("deadline_note")
-    
-    coursework.updated_at = datetime.utcnow()
+        _invalidate_chat_cache(background_tasks, user)
     
-    await db.commit()
-    await db.refresh(coursework)
-    
-    return CourseworkDetail.model_validate(coursework)
+    return _row_response(row)
 
 
 @router.delete("/{coursework_id}", status_code=204)
 async def delete_coursework(
     coursework_id: UUID,
-    user: User = Depends(get_authenticated_user),
+    background_tasks: BackgroundTasks,
+    user: User = Depends(require_auth),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -224,16 +256,18 @@ async def delete_coursework(
     
     Permanently removes the coursework and all its data.
     """
+    # Ownership check and DELETE in a single statement
     result = await db.execute(
-        select(Coursework)
+        delete(Coursework)
         .where(Coursework.id == coursework_id, Coursework.user_id == user.id)
+        .returning(Coursework.id)
     )
-    coursework = result.scalar_one_or_none()
     
-    if not coursework:
+    if result.scalar_one_or_none() is None:
         raise HTTPException(status_code=404, detail="Coursework not found")
     
-    await db.delete(coursework)
     await db.commit()
     
+    _invalidate_chat_cache(background_tasks, user)
+    
     return None
@@ -1,23 +1,111 @@
 """Decomposition API router with Multi-Agent RAG."""
 
-from fastapi import APIRouter, File, Form, UploadFile, HTTPException, Depends
-from typing import Optional
+import asyncio
+import hashlib
+import traceback
 
-from services.agents.orchestrator import get_orchestrator
-from models.schemas import DecomposeResponseWithSession
-from routers.auth import get_current_user_optional
+import orjson
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from typing import Any, AsyncIterator, BinaryIO, Dict, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+from server.models.schemas import (
+    DecompositionResponse,
+    DecomposeResponseWithSession,
+    DECOMPOSE_WITH_SESSION_ADAPTER,
+)
+from server.routers.auth import get_current_user_id_optional
+from server.services.decomposition_cache import (
+    decomposition_cache_key,
+    get_cached_decomposition,
+    store_decomposition,
+    is_cacheable,
+)
 
 router = APIRouter(prefix="/api", tags=["decomposition"])
 
 # Maximum file size in bytes (20MB)
 MAX_FILE_SIZE = 20 * 1024 * 1024
 
+# Allowance for multipart boundaries/headers and the course_url field
+MAX_REQUEST_SIZE = MAX_FILE_SIZE + 64 * 1024
+
+# The form is parsed by hand (see _read_upload_form), so describe it for the docs
+DECOMPOSE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {
+                            "type": "string",
+                            "format": "binary",
+                            "description": "PDF specification file",
+                        },
+                        "course_url": {
+                            "type": "string",
+                            "description": "Optional course URL for context",
+                        },
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"
+    )
+
+
+async def _read_upload_form(request: Request) -> FormData:
+    """
+    Parse the multipart body as it streams in.
+    
+    Unlike File()/Form() parameters, which make FastAPI buffer the whole
+    body before the handler runs, this rejects oversized uploads with 413
+    as soon as the byte count passes the limit.
+    """
+    if "multipart/form-data" not in request.headers.get("content-type", ""):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+    
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_REQUEST_SIZE:
+        raise _too_large()
+    
+    async def limited_stream():
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_REQUEST_SIZE:
+                raise _too_large()
+            yield chunk
+    
+    try:
+        return await MultiPartParser(request.headers, limited_stream()).parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
 
-@router.post("/decompose", response_model=DecomposeResponseWithSession)
+
+@router.post(
+    "/decompose",
+    response_model=DecomposeResponseWithSession,
+    response_class=ORJSONResponse,
+    openapi_extra=DECOMPOSE_REQUEST_BODY,
+)
 async def decompose_pdf(
-    file: UploadFile = File(..., description="PDF specification file"),
-    course_url: Optional[str] = Form(None, description="Optional course URL for context"),
-    current_user = Depends(get_current_user_optional),
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user_id: Optional[UUID] = Depends(get_current_user_id_optional),
 ):
     """
     Decompose a coursework PDF specification into actionable tasks.
@@ -38,48 +126,178 @@ async def decompose_pdf(
     
     **Rate Limits**: Gemini free tier limits apply (15 requests/min)
     """
-    # Validate file type
-    if not file.filename or not file.filename.lower().endswith('.pdf'):
-        raise HTTPException(
-            status_code=400,
-            detail="Only PDF files are accepted"
-        )
-    
-    # Read file content
-    content = await file.read()
-    
-    # Validate file size
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024)}MB"
-        )
+    upload = await _read_pdf_upload(request)
     
     # Run multi-agent decomposition pipeline
+    # (imported lazily - pulls in LangChain, Qdrant and PyMuPDF)
+    from server.services.agents.orchestrator import get_orchestrator
     orchestrator = get_orchestrator()
-    user_id = str(current_user.id) if current_user else "anonymous"
+    
+    # Identical PDFs (same prompt version) reuse the previous LLM analysis
+    cached = await get_cached_decomposition(upload.cache_key)
     
     try:
         result = await orchestrator.run_decomposition(
-            pdf_content=content,
-            user_id=user_id,
-            metadata={"course_url": course_url} if course_url else None,
+            pdf_content=upload.content,
+            user_id=str(user_id) if user_id else "anonymous",
+            metadata=upload.metadata,
+            cached_decomposition=cached,
         )
     except ValueError as e:
         # Validation errors from agents
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         # Log the full error for debugging
-        import traceback
         print(f"Decomposition error: {traceback.format_exc()}")
         raise HTTPException(
             status_code=500,
             detail=f"Processing failed: {str(e)}"
         )
     
-    # Build response with session info for follow-up chat
+    await _after_decomposition(result, cached, upload.cache_key, background_tasks, user_id)
+    
+    # Already validated - serialize directly instead of FastAPI re-validating
+    # the whole nested response against response_model. pydantic-core writes
+    # JSON straight from the models, which beats model_dump() + orjson.
+    return Response(
+        content=DECOMPOSE_WITH_SESSION_ADAPTER.dump_json(_with_session(result)),
+        media_type="application/json",
+    )
+
+
+@router.post("/decompose/stream", openapi_extra=DECOMPOSE_REQUEST_BODY)
+async def decompose_pdf_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    user_id: Optional[UUID] = Depends(get_current_user_id_optional),
+):
+    """
+    Streaming variant of /decompose, returning newline-delimited JSON.
+    
+    Same input as /decompose. One JSON object per line:
+    - `{"event": "ingestion", "document_id", "text_chunk_count", "image_count"}`
+      once the PDF is embedded (embedding overlaps the analysis, so this
+      can arrive between task events)
+    - `{"event": "task", "data": Task}` for each task as the model writes it
+    - `{"event": "done", "data": DecomposeResponseWithSession}` - the final,
+      authoritative result (same body /decompose returns)
+    - `{"event": "error", "status", "detail"}` if the pipeline fails after
+      streaming has started
+    
+    Upload validation errors are still returned as normal HTTP errors.
+    """
+    upload = await _read_pdf_upload(request)
+    
+    from server.services.agents.orchestrator import get_orchestrator
+    orchestrator = get_orchestrator()
+    
+    cached = await get_cached_decomposition(upload.cache_key)
+    
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            async for event in orchestrator.stream_decomposition(
+                pdf_content=upload.content,
+                user_id=str(user_id) if user_id else "anonymous",
+                metadata=upload.metadata,
+                cached_decomposition=cached,
+            ):
+                if event["event"] == "ingestion":
+                    yield orjson.dumps(event) + b"\n"
+                elif event["event"] == "task":
+                    yield orjson.dumps({"event": "task", "data": event["data"].model_dump(mode="json")}) + b"\n"
+                else:
+                    result = event["result"]
+                    await _after_decomposition(result, cached, upload.cache_key, background_tasks, user_id)
+                    body = DECOMPOSE_WITH_SESSION_ADAPTER.dump_json(_with_session(result))
+                    yield b'{"event":"done","data":' + body + b"}\n"
+        except ValueError as e:
+            yield orjson.dumps({"event": "error", "status": 422, "detail": str(e)}) + b"\n"
+        except Exception as e:
+            print(f"Decomposition error: {traceback.format_exc()}")
+            yield orjson.dumps(
+                {"event": "error", "status": 500, "detail": f"Processing failed: {str(e)}"}
+            ) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+class PdfUpload(NamedTuple):
+    content: bytes
+    # Stored on every chunk (content_hash, course_url); the hash lets a
+    # re-upload reuse existing embeddings
+    metadata: Dict[str, Any]
+    cache_key: str
+
+
+def _hash_upload(fileobj: BinaryIO) -> Tuple[str, str]:
+    """
+    (content_hash, decomposition cache key) for a spooled upload.
+    
+    hashlib.file_digest feeds the file to the C hash in fixed-size
+    chunks rather than hashing one big bytes object.
+    """
+    fileobj.seek(0)
+    content_hash = hashlib.file_digest(fileobj, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+    fileobj.seek(0)
+    cache_key = decomposition_cache_key(fileobj)
+    fileobj.seek(0)
+    return content_hash, cache_key
+
+
+async def _read_pdf_upload(request: Request) -> PdfUpload:
+    """Read and validate the uploaded PDF."""
+    form = await _read_upload_form(request)
+    try:
+        file = form.get("file")
+        course_url = form.get("course_url") or None
+        
+        # Validate file type
+        if not isinstance(file, UploadFile) or not file.filename or not file.filename.lower().endswith('.pdf'):
+            raise HTTPException(
+                status_code=400,
+                detail="Only PDF files are accepted"
+            )
+        
+        # Validate file size
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            raise _too_large()
+        
+        # Both hashes in one worker-thread hop, off the event loop
+        content_hash, cache_key = await asyncio.to_thread(_hash_upload, file.file)
+        
+        # PyMuPDF needs the bytes
+        content = await file.read()
+    finally:
+        await form.close()
+    
+    metadata = {"content_hash": content_hash}
+    if course_url:
+        metadata["course_url"] = course_url
+    return PdfUpload(content, metadata, cache_key)
+
+
+async def _after_decomposition(
+    result: Dict[str, Any],
+    cached: Optional[DecompositionResponse],
+    cache_key: str,
+    background_tasks: BackgroundTasks,
+    user_id: Optional[UUID],
+) -> None:
+    """Cache a fresh decomposition and invalidate stale chat answers."""
     decomposition = result["decomposition"]
     
+    if cached is None and is_cacheable(decomposition):
+        await store_decomposition(cache_key, decomposition)
+    
+    # New material in the user's collection - cached chat answers may be stale
+    if result.get("ingested", True):
+        from server.services.chat_cache import invalidate_chat_responses
+        background_tasks.add_task(invalidate_chat_responses, f"coursework_{user_id or 'anonymous'}")
+
+
+def _with_session(result: Dict[str, Any]) -> DecomposeResponseWithSession:
+    """Build response with session info for follow-up chat."""
+    decomposition = result["decomposition"]
     return DecomposeResponseWithSession(
         # Core fields from decomposition
         tasks=decomposition.tasks,
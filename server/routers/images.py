@@ -1,18 +1,97 @@
 """Image serving router for extracted PDF images."""
 
+import asyncio
+import functools
+import hashlib
+import os
 import urllib.parse
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from types import MappingProxyType
+from typing import Mapping, Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 
 router = APIRouter(prefix="/api/images", tags=["images"])
 
 # Image cache directory (relative to server directory)
 IMAGE_CACHE_DIR = Path(__file__).parent.parent / "image_cache"
 
+# Resolved once; requested paths must fall under this prefix
+_CACHE_ROOT_PREFIX = str(IMAGE_CACHE_DIR.resolve()) + os.sep
+
+# Read-only: built once at import and shared by every request
+MEDIA_TYPES: Mapping[str, str] = MappingProxyType({
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+})
+
+# Extracted images are usually well under this. They're read in a single
+# threadpool hop instead of FileResponse's open/read-per-64KB/close hops.
+SMALL_IMAGE_BYTES = 512 * 1024
+
+# Images are written once at ingestion and never modified in place
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _content_disposition(filename: str) -> str:
+    """Same header FileResponse builds for a filename."""
+    quoted = urllib.parse.quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+@functools.lru_cache(maxsize=4096)
+def _resolve_image(path: str) -> Optional[Path]:
+    """
+    Resolve a requested image path, or None if it escapes the cache directory.
+    
+    resolve() stats every path component, so results are memoized - hot
+    images are requested over and over. Only the resolution is cached;
+    existence is still checked per request.
+    """
+    resolved = Path(path).resolve()
+    if not str(resolved).startswith(_CACHE_ROOT_PREFIX):
+        return None
+    return resolved
+
+
+def _etag(key: str) -> str:
+    return '"' + hashlib.blake2b(key.encode(), digest_size=16).hexdigest() + '"'
+
+
+async def _send_image(
+    request: Request,
+    image_path: Path,
+    etag: str,
+    filename: Optional[str] = None,
+) -> Response:
+    """
+    Send an image file with long-lived cache headers.
+    
+    Answers 304 when the client already holds this ETag; small files are
+    sent from memory.
+    """
+    headers = {"Cache-Control": IMAGE_CACHE_CONTROL, "ETag": etag}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = MEDIA_TYPES.get(image_path.suffix.lower(), "application/octet-stream")
+    
+    if image_path.stat().st_size > SMALL_IMAGE_BYTES:
+        return FileResponse(path=image_path, media_type=media_type, filename=filename, headers=headers)
+    
+    content = await asyncio.to_thread(image_path.read_bytes)
+    if filename:
+        headers["Content-Disposition"] = _content_disposition(filename)
+    return Response(content=content, media_type=media_type, headers=headers)
+
 
 @router.get("/{document_id}/{filename}")
-async def get_image(document_id: str, filename: str):
+async def get_image(request: Request, document_id: str, filename: str):
     """
     Serve an extracted image from a processed document.
     
@@ -27,17 +106,13 @@ async def get_image(document_id: str, filename: str):
     document_id = urllib.parse.unquote(document_id)
     filename = urllib.parse.unquote(filename)
     
-    # Construct full path
-    image_path = IMAGE_CACHE_DIR / document_id / filename
-    
     # Security: Ensure path is within cache directory
     try:
-        image_path = image_path.resolve()
-        IMAGE_CACHE_DIR.resolve()
-        if not str(image_path).startswith(str(IMAGE_CACHE_DIR.resolve())):
-            raise HTTPException(status_code=403, detail="Access denied")
+        image_path = _resolve_image(str(IMAGE_CACHE_DIR / document_id / filename))
     except Exception:
         raise HTTPException(status_code=403, detail="Invalid path")
+    if image_path is None:
+        raise HTTPException(status_code=403, detail="Access denied")
     
     # Check if file exists
     if not image_path.exists():
@@ -46,25 +121,16 @@ async def get_image(document_id: str, filename: str):
     if not image_path.is_file():
         raise HTTPException(status_code=404, detail="Not a file")
     
-    # Determine media type from extension
-    suffix = image_path.suffix.lower()
-    media_type = {
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".gif": "image/gif",
-        ".webp": "image/webp",
-    }.get(suffix, "application/octet-stream")
-    
-    return FileResponse(
-        path=image_path,
-        media_type=media_type,
+    return await _send_image(
+        request,
+        image_path,
+        etag=_etag(f"{document_id}/{filename}"),
         filename=filename,
     )
 
 
 @router.get("/raw")
-async def get_image_by_path(path: str):
+async def get_image_by_path(request: Request, path: str):
     """
     Serve an image by its full path (URL encoded).
     
@@ -73,29 +139,18 @@ async def get_image_by_path(path: str):
     """
     # Decode the path
     decoded_path = urllib.parse.unquote(path)
-    image_path = Path(decoded_path)
     
     # Security: Ensure path is within cache directory
     try:
-        image_path = image_path.resolve()
-        if not str(image_path).startswith(str(IMAGE_CACHE_DIR.resolve())):
-            raise HTTPException(status_code=403, detail="Access denied")
+        image_path = _resolve_image(decoded_path)
     except Exception:
         raise HTTPException(status_code=403, detail="Invalid path")
+    if image_path is None:
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    if not image_path.exists():
+    if not image_path.is_file():
         raise HTTPException(status_code=404, detail="Image not found")
     
-    suffix = image_path.suffix.lower()
-    media_type = {
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".gif": "image/gif",
-        ".webp": "image/webp",
-    }.get(suffix, "application/octet-stream")
-    
-    return FileResponse(
-        path=image_path,
-        media_type=media_type,
-    )
+    # Arbitrary paths may collide across rewrites, so include the mtime
+    etag = _etag(f"{image_path}:{image_path.stat().st_mtime_ns}")
+    return await _send_image(request, image_path, etag=etag)
@@ -0,0 +1,110 @@
+"""
+Re-embed Qdrant collections at the current EMBEDDING_DIMENSIONS.
+
+The API refuses a collection whose vector size no longer matches
+EMBEDDING_DIMENSIONS. Run this once after changing it, with the backend
+stopped so nothing writes to a collection while it is being copied:
+
+    python -m server.scripts.reembed_collections [collection ...]
+
+Without arguments every coursework_* collection is checked. Chunks are
+re-embedded from the text kept in their payload into a staging collection;
+the original is only replaced once staging is complete, so an interrupted
+run can simply be started again. Points without text are not carried over.
+"""
+
+import sys
+from typing import Iterator, List
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import PointStruct, Record
+
+from server.services.vector_store import EMBED_BATCH_SIZE, VectorStoreService, get_vector_store
+
+STAGING_SUFFIX = "__reembed"
+
+
+def _scroll(client: QdrantClient, collection_name: str, with_vectors: bool) -> Iterator[List[Record]]:
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=collection_name,
+            limit=EMBED_BATCH_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=with_vectors,
+        )
+        if batch:
+            yield batch
+        if offset is None:
+            return
+
+
+def reembed_collection(store: VectorStoreService, collection_name: str) -> bool:
+    """
+    Bring one collection to the current embedding size.
+    
+    Args:
+        store: Vector store service (provides the client and embeddings)
+        collection_name: Collection to migrate
+    
+    Returns:
+        True if the collection was rebuilt, False if it was already current
+    """
+    client = store.client
+    staging = f"{collection_name}{STAGING_SUFFIX}"
+    
+    if (
+        client.collection_exists(collection_name)
+        and client.get_collection(collection_name).config.params.vectors.size != store._embedding_dim
+    ):
+        # Embed into a fresh staging copy; the source is only read
+        if client.collection_exists(staging):
+            client.delete_collection(staging)
+        store._create_collection(staging)
+        for batch in _scroll(client, collection_name, with_vectors=False):
+            points = [point for point in batch if (point.payload or {}).get("page_content")]
+            if not points:
+                continue
+            vectors = store._embeddings.embed_documents([point.payload["page_content"] for point in points])
+            client.upsert(
+                collection_name=staging,
+                points=[
+                    PointStruct(id=point.id, vector=vector, payload=point.payload)
+                    for point, vector in zip(points, vectors)
+                ],
+            )
+        client.delete_collection(collection_name)
+    elif not client.collection_exists(staging):
+        return False
+    
+    # Move the staged points into place (also resumes an interrupted move)
+    if not client.collection_exists(collection_name):
+        store._create_collection(collection_name)
+    for batch in _scroll(client, staging, with_vectors=True):
+        client.upsert(
+            collection_name=collection_name,
+            points=[PointStruct(id=point.id, vector=point.vector, payload=point.payload) for point in batch],
+        )
+    client.delete_collection(staging)
+    return True
+
+
+def main(collection_names: List[str]) -> None:
+    store = get_vector_store()
+    if not collection_names:
+        collection_names = sorted({
+            collection.name.removesuffix(STAGING_SUFFIX)
+            for collection in store.client.get_collections().collections
+            if collection.name.startswith("coursework_")
+        })
+    
+    for collection_name in collection_names:
+        if reembed_collection(store, collection_name):
+            print(f"Re-embedded '{collection_name}' at {store._embedding_dim} dims")
+        else:
+            print(f"'{collection_name}' already at {store._embedding_dim} dims")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
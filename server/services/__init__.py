@@ -14,12 +14,31 @@ Legacy services (kept for fallback):
 - pdf_parser: PyMuPDF text extraction
 """
 
-from .langchain_service import get_langchain_service, LangChainService
-from .document_processor import DocumentProcessor
-from .vector_store import get_vector_store, VectorStoreService
-from .rag_chain import RAGChain
-from .pdf_parser import extract_text_from_pdf, get_pdf_metadata
-from .ai_decomposer import decompose_coursework
+from importlib import import_module
+
+# Re-exports are resolved lazily (PEP 562) so that importing a light
+# submodule such as services.auth_service doesn't pull in LangChain,
+# Qdrant and PyMuPDF through this package __init__.
+_EXPORTS = {
+    "get_langchain_service": ".langchain_service",
+    "LangChainService": ".langchain_service",
+    "DocumentProcessor": ".document_processor",
+    "get_vector_store": ".vector_store",
+    "VectorStoreService": ".vector_store",
+    "RAGChain": ".rag_chain",
+    "get_rag_chain": ".rag_chain",
+    "PDFDocument": ".pdf_parser",
+    "extract_text_from_pdf": ".pdf_parser",
+    "get_pdf_metadata": ".pdf_parser",
+    "decompose_coursework": ".ai_decomposer",
+}
+
+
+def __getattr__(name: str):
+    if name in _EXPORTS:
+        return getattr(import_module(_EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
     # New LangChain services
@@ -29,7 +48,9 @@ __all__ = [
     "get_vector_store",
     "VectorStoreService",
     "RAGChain",
+    "get_rag_chain",
     # Legacy services
+    "PDFDocument",
     "extract_text_from_pdf",
     "get_pdf_metadata",
     "decompose_coursework",
@@ -1,16 +1,139 @@
 """Analysis Agent - performs coursework decomposition with RAG."""
 
-import json
-from typing import Any, Dict
+import asyncio
+import os
+import re
+from typing import Any, AsyncIterator, Dict, List, Tuple
 
+import orjson
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
+from pydantic import ValidationError
 
-from services.agents.base import BaseAgent
-from services.langchain_service import get_langchain_service
-from services.rag_chain import RAGChain
-from models.schemas import DecompositionResponse
-from prompts.decomposer import DECOMPOSER_SYSTEM_PROMPT
+from server.services.agents.base import BaseAgent
+from server.services.langchain_service import gemini_slot, get_langchain_service
+from server.models.schemas import DecompositionResponse, Task
+from server.services.decomposition_parser import loads_llm_json, prepare_row, validate_decomposition
+from server.prompts.decomposer import DECOMPOSER_SYSTEM_PROMPT
+
+
+# Hard cap on PDF text handed to the analysis agent; the full text is only
+# needed for chunking, which happens at ingestion
+ANALYSIS_MAX_CHARS = 100000
+
+# Token budget for the PDF text in the analysis prompt. Dense specs (tables,
+# code) tokenize at ~2 chars/token and prose at ~4+, so a fixed char cap
+# either overflows one or wastes context on the other
+ANALYSIS_MAX_TOKENS = int(os.getenv("ANALYSIS_MAX_TOKENS", "12500"))
+
+# Below this many chars the text is sent as is, without a count_tokens call:
+# even the densest text (~2 chars/token) can't exceed ANALYSIS_MAX_TOKENS
+TOKEN_COUNT_MIN_CHARS = ANALYSIS_MAX_TOKENS * 2
+
+# Char cap used when count_tokens fails (the old fixed heuristic)
+FALLBACK_MAX_CHARS = 50000
+
+# Static instructions first, PDF last - keeps the cacheable prefix identical
+_HUMAN_TEMPLATE = """Analyze this coursework specification and create a comprehensive Implementation Guide.
+Create a complete Implementation Guide with all required fields.
+Return valid JSON only.
+
+---
+
+## PDF Content
+
+{pdf_content}"""
+
+# Built once - the template is static
+_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", DECOMPOSER_SYSTEM_PROMPT),
+    ("human", _HUMAN_TEMPLATE),
+])
+
+
+class _ArrayItemScanner:
+    """
+    Incrementally pull complete objects out of one JSON array in a token stream.
+    
+    Tracks string/escape state and nesting depth so each object in the array
+    named `key` is returned as soon as its closing brace arrives, long before
+    the whole response is valid JSON. Only `key` as a member of the root
+    object counts - nested arrays of the same name (a milestone's "tasks"
+    ID list) are skipped.
+    """
+    
+    def __init__(self, key: str):
+        self._key = re.compile(rf'"{key}"\s*:\s*')
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Start of the last string closed directly inside the root object
+        self._key_start: int | None = None
+        self._in_array = False
+        self._item_start: int | None = None
+        self.done = False
+    
+    def feed(self, chunk: str) -> List[Any]:
+        """Add streamed text; return the objects completed by it."""
+        self._buffer += chunk
+        items: List[Any] = []
+        if self.done:
+            return items
+        
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif not self._in_array and self._depth == 0:
+                # Anything before the root object (prose, code fences)
+                if c == "{":
+                    self._depth = 1
+            elif c == '"':
+                self._in_string = True
+                if not self._in_array and self._depth == 1:
+                    self._key_start = i
+            elif not self._in_array:
+                if (
+                    c == "["
+                    and self._depth == 1
+                    and self._key_start is not None
+                    and self._key.fullmatch(buf, self._key_start, i)
+                ):
+                    # The array's items are tracked from depth 0
+                    self._in_array = True
+                    self._depth = 0
+                elif c in "{[":
+                    self._depth += 1
+                elif c in "}]":
+                    self._depth -= 1
+            elif c in "{[":
+                if self._depth == 0 and c == "{":
+                    self._item_start = i
+                self._depth += 1
+            elif c in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self.done = True
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    try:
+                        items.append(orjson.loads(buf[self._item_start:i + 1]))
+                    except ValueError:
+                        pass
+                    self._item_start = None
+            i += 1
+        self._pos = i
+        return items
 
 
 class AnalysisAgent(BaseAgent):
@@ -22,6 +145,7 @@ class AnalysisAgent(BaseAgent):
             description="Analyzes coursework specifications and creates comprehensive implementation guides",
         )
         self.langchain = get_langchain_service()
+        self._chain = _PROMPT | self.langchain.get_llm()
     
     async def execute(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -29,6 +153,9 @@ class AnalysisAgent(BaseAgent):
         
         Input:
             - pdf_text: str - Extracted PDF text
+            - pdf_text_truncated: bool - pdf_text was already cut to
+              ANALYSIS_MAX_CHARS by the ingestion agent (optional); the
+              text is further cut to ANALYSIS_MAX_TOKENS here
             - collection_name: str - Vector store collection for RAG
             - document_id: str - Document identifier
         
@@ -36,41 +163,12 @@ class AnalysisAgent(BaseAgent):
             - decomposition: DecompositionResponse
             - session_id: str - For follow-up chat
         """
-        pdf_text = input_data.get("pdf_text")
-        collection_name = input_data.get("collection_name")
-        document_id = input_data.get("document_id")
-        
-        if not pdf_text:
-            raise ValueError("pdf_text is required")
-        
-        # Truncate for initial analysis
-        # Full content is available in vector store for Q&A
-        max_chars = 50000
-        truncated_text = pdf_text[:max_chars]
-        if len(pdf_text) > max_chars:
-            truncated_text += "\n\n[Text truncated - full content available for Q&A via chat]"
-        
-        # Build the prompt
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", DECOMPOSER_SYSTEM_PROMPT),
-            ("human", """Analyze this coursework specification and create a comprehensive Implementation Guide.
-
-## PDF Content
-
-{pdf_content}
-
----
-
-Create a complete Implementation Guide with all required fields.
-Return valid JSON only."""),
-        ])
-        
-        # Create chain with structured output
-        chain = prompt | self.langchain.get_llm()
+        truncated_text = await self._analysis_text(input_data)
         
         try:
             # Get raw response
-            response = chain.invoke({"pdf_content": truncated_text})
+            async with gemini_slot():
+                response = await self._chain.ainvoke({"pdf_content": truncated_text})
             response_text = response.content if hasattr(response, 'content') else str(response)
             
             # Parse JSON response
@@ -79,226 +177,117 @@ Return valid JSON only."""),
         except Exception as e:
             print(f"Analysis agent error: {e}")
             # Fallback to legacy decomposer if LangChain fails
-            from services.ai_decomposer import decompose_coursework
-            result = decompose_coursework(pdf_text)
-        
-        # Create session ID for follow-up chat
-        session_id = f"{document_id}:chat"
+            from server.services.ai_decomposer import decompose_coursework_async
+            result = await decompose_coursework_async(input_data["pdf_text"])
         
-        return {
-            "decomposition": result,
-            "session_id": session_id,
-            "document_id": document_id,
-            "collection_name": collection_name,
-        }
+        return self._result(input_data, result)
     
-    def _parse_priority(self, priority_value) -> int | None:
+    async def execute_stream(self, input_data: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
         """
-        Parse priority value - handles both integers and strings.
+        Streaming variant of execute.
         
-        Strings like 'essential', 'strong', 'excellence' are converted to priority levels:
-        - 'essential' / 'high' / 'critical' -> 0 (highest)
-        - 'strong' / 'medium' / 'important' -> 1
-        - 'excellence' / 'low' / 'optional' / 'bonus' -> 2
+        Yields ("task", Task) as each task object completes in the LLM
+        output, then ("result", <execute() output>). The final decomposition
+        is authoritative - it is parsed from the full response and may
+        differ from the streamed tasks (e.g. after the legacy fallback).
         """
-        if priority_value is None:
-            return None
-        
-        # If already an integer, return it
-        if isinstance(priority_value, int):
-            return priority_value
+        truncated_text = await self._analysis_text(input_data)
+        scanner = _ArrayItemScanner("tasks")
+        parts: List[str] = []
+        streamed = 0
         
-        # Try to convert string to int first
         try:
-            return int(priority_value)
-        except (ValueError, TypeError):
-            pass
+            async with gemini_slot():
+                async for chunk in self._chain.astream({"pdf_content": truncated_text}):
+                    text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                    parts.append(text)
+                    for row in scanner.feed(text):
+                        task = self._stream_task(streamed, row)
+                        streamed += 1
+                        if task is not None:
+                            yield "task", task
+            
+            result = self._parse_response("".join(parts))
+            
+        except Exception as e:
+            print(f"Analysis agent error: {e}")
+            from server.services.ai_decomposer import decompose_coursework_async
+            result = await decompose_coursework_async(input_data["pdf_text"])
         
-        # Map string values to priority levels
-        priority_str = str(priority_value).lower().strip()
-        priority_map = {
-            'essential': 0,
-            'critical': 0,
-            'high': 0,
-            'must': 0,
-            'strong': 1,
-            'important': 1,
-            'medium': 1,
-            'should': 1,
-            'excellence': 2,
-            'bonus': 2,
-            'optional': 2,
-            'low': 2,
-            'nice': 2,
-        }
+        yield "result", self._result(input_data, result)
+    
+    async def _analysis_text(self, input_data: Dict[str, Any]) -> str:
+        """Validate input and build the (truncated) text sent to the LLM."""
+        pdf_text = input_data.get("pdf_text")
+        if not pdf_text:
+            raise ValueError("pdf_text is required")
+        
+        # Truncate for initial analysis
+        # Full content is available in vector store for Q&A
+        truncated_text = await self._fit_token_budget(pdf_text[:ANALYSIS_MAX_CHARS])
+        if len(truncated_text) < len(pdf_text) or input_data.get("pdf_text_truncated"):
+            truncated_text += "\n\n[Text truncated - full content available for Q&A via chat]"
+        return truncated_text
+    
+    async def _fit_token_budget(self, text: str) -> str:
+        """Cut text to roughly ANALYSIS_MAX_TOKENS using Gemini's tokenizer."""
+        if len(text) <= TOKEN_COUNT_MIN_CHARS:
+            return text
         
-        for key, value in priority_map.items():
-            if key in priority_str:
-                return value
+        try:
+            # count_tokens is a blocking RPC in the sync client
+            tokens = await asyncio.to_thread(self.langchain.get_llm().get_num_tokens, text)
+        except Exception as e:
+            print(f"Token count failed, using char cap: {e}")
+            return text[:FALLBACK_MAX_CHARS]
         
-        # Default to medium priority
-        return 1
+        if tokens <= ANALYSIS_MAX_TOKENS:
+            return text
+        # Chars per token is roughly uniform within one document; keep a 5%
+        # margin rather than paying for a second count
+        return text[:int(len(text) * ANALYSIS_MAX_TOKENS / tokens * 0.95)]
+    
+    def _result(self, input_data: Dict[str, Any], result: DecompositionResponse) -> Dict[str, Any]:
+        document_id = input_data.get("document_id")
+        return {
+            "decomposition": result,
+            # Session ID for follow-up chat
+            "session_id": f"{document_id}:chat",
+            "document_id": document_id,
+            "collection_name": input_data.get("collection_name"),
+        }
+    
+    def _stream_task(self, index: int, row: Any) -> Task | None:
+        """Validate one streamed task row; invalid rows are skipped."""
+        prepared = prepare_row("tasks", index, row)
+        if prepared is None:
+            return None
+        try:
+            return Task.model_validate(prepared)
+        except ValidationError:
+            return None
     
     def _parse_response(self, response_text: str) -> DecompositionResponse:
         """Parse LLM response into DecompositionResponse."""
-        from services.ai_decomposer import repair_json
-        
-        # Clean and repair JSON
-        cleaned = repair_json(response_text)
-        data = json.loads(cleaned)
-        
-        # Use existing parsing logic from ai_decomposer
-        from services.ai_decomposer import (
-            Task, Milestone, TermDefinition, MarkingCriterion,
-            GetStartedStep, PrioritizationTier, WeeklySchedule, DirectoryEntry
-        )
-        
-        # Parse tasks
-        tasks = []
-        for task_data in data.get("tasks", []):
-            try:
-                tasks.append(Task(
-                    task_id=str(task_data.get("task_id", f"t{len(tasks)+1}")),
-                    title=str(task_data.get("title", "Untitled Task")),
-                    description=str(task_data.get("description", "")),
-                    estimated_time=str(task_data.get("estimated_time", "Unknown")),
-                    related_files=list(task_data.get("related_files", [])) if task_data.get("related_files") else [],
-                    pdf_snippet=str(task_data.get("pdf_snippet", "")) if task_data.get("pdf_snippet") else None,
-                    commands=list(task_data.get("commands", [])) if task_data.get("commands") else [],
-                    prerequisites=list(task_data.get("prerequisites", [])) if task_data.get("prerequisites") else [],
-                    status=str(task_data.get("status", "todo")),
-                    priority=self._parse_priority(task_data.get("priority")),
-                ))
-            except Exception as e:
-                print(f"Error parsing task: {e}")
-                continue
-        
-        # Parse milestones
-        milestones = []
-        for milestone_data in data.get("milestones", []):
-            try:
-                milestones.append(Milestone(
-                    id=str(milestone_data.get("id", f"m{len(milestones)+1}")),
-                    title=str(milestone_data.get("title", "Untitled Milestone")),
-                    description=str(milestone_data.get("description", "")) if milestone_data.get("description") else None,
-                    summary=str(milestone_data.get("summary", "")) if milestone_data.get("summary") else None,
-                    tasks=list(milestone_data.get("tasks", [])) if milestone_data.get("tasks") else [],
-                ))
-            except Exception as e:
-                print(f"Error parsing milestone: {e}")
-                continue
-        
-        # Parse terminology
-        terminology = []
-        for term_data in data.get("terminology", []):
-            try:
-                terminology.append(TermDefinition(
-                    term=str(term_data.get("term", "")),
-                    definition=str(term_data.get("definition", "")),
-                    example=str(term_data.get("example", "")) if term_data.get("example") else None,
-                ))
-            except Exception:
-                continue
-        
-        # Parse marking criteria
-        marking_criteria = []
-        for mc_data in data.get("marking_criteria", []):
-            try:
-                marking_criteria.append(MarkingCriterion(
-                    component=str(mc_data.get("component", "")),
-                    percentage=int(mc_data.get("percentage")) if mc_data.get("percentage") is not None else None,
-                    description=str(mc_data.get("description", "")),
-                    priority=str(mc_data.get("priority", "essential")),
-                ))
-            except Exception:
-                continue
-        
-        # Parse get started steps
-        get_started_steps = []
-        for step_data in data.get("get_started_steps", []):
-            try:
-                get_started_steps.append(GetStartedStep(
-                    step_number=int(step_data.get("step_number", len(get_started_steps)+1)),
-                    title=str(step_data.get("title", "")),
-                    description=str(step_data.get("description", "")),
-                    commands=list(step_data.get("commands", [])) if step_data.get("commands") else [],
-                    expected_output=str(step_data.get("expected_output", "")) if step_data.get("expected_output") else None,
-                ))
-            except Exception:
-                continue
-        
-        # Parse prioritization tiers
-        prioritization_tiers = []
-        for tier_data in data.get("prioritization_tiers", []):
-            try:
-                prioritization_tiers.append(PrioritizationTier(
-                    tier=str(tier_data.get("tier", "")),
-                    description=str(tier_data.get("description", "")),
-                    time_estimate=str(tier_data.get("time_estimate", "")),
-                    task_ids=list(tier_data.get("task_ids", [])) if tier_data.get("task_ids") else [],
-                ))
-            except Exception:
-                continue
-        
-        # Parse recommended schedule
-        recommended_schedule = []
-        for week_data in data.get("recommended_schedule", []):
-            try:
-                recommended_schedule.append(WeeklySchedule(
-                    week=int(week_data.get("week", len(recommended_schedule)+1)),
-                    title=str(week_data.get("title", "")),
-                    task_ids=list(week_data.get("task_ids", [])) if week_data.get("task_ids") else [],
-                    hours_estimate=int(week_data.get("hours_estimate", 0)),
-                ))
-            except Exception:
-                continue
-        
-        # Parse directory structure
-        directory_structure = []
-        for dir_data in data.get("directory_structure", []):
-            try:
-                directory_structure.append(DirectoryEntry(
-                    path=str(dir_data.get("path", "")),
-                    type=str(dir_data.get("type", "file")),
-                    description=str(dir_data.get("description", "")) if dir_data.get("description") else None,
-                ))
-            except Exception:
-                continue
+        # Parse, repairing the JSON only if it's malformed
+        result = validate_decomposition(loads_llm_json(response_text))
         
         # Track extraction warnings
         extraction_warnings = []
-        if not tasks:
+        update: Dict[str, Any] = {}
+        if not result.tasks:
             extraction_warnings.append("tasks")
-            tasks = [Task(
+            update["tasks"] = [Task(
                 task_id="fallback-1",
                 title="Review Specifications Manually",
                 description="Could not extract specific tasks. Please review your coursework specifications directly.",
                 estimated_time="Varies",
                 status="todo"
             )]
-        if not marking_criteria:
+        if not result.marking_criteria:
             extraction_warnings.append("marking_criteria")
-        if not data.get("deadline"):
+        if not result.deadline:
             extraction_warnings.append("deadline")
+        update["extraction_warnings"] = extraction_warnings
         
-        return DecompositionResponse(
-            tasks=tasks,
-            milestones=milestones,
-            setup_instructions=list(data.get("setup_instructions", [])) if data.get("setup_instructions") else [],
-            course_name=str(data.get("course_name", "")) if data.get("course_name") else None,
-            total_estimated_time=str(data.get("total_estimated_time", "")) if data.get("total_estimated_time") else None,
-            summary_overview=str(data.get("summary_overview", "")) if data.get("summary_overview") else None,
-            key_deliverables=list(data.get("key_deliverables", [])) if data.get("key_deliverables") else [],
-            what_you_need_to_do=str(data.get("what_you_need_to_do", "")) if data.get("what_you_need_to_do") else None,
-            deadline=str(data.get("deadline", "")) if data.get("deadline") else None,
-            deadline_note=str(data.get("deadline_note", "")) if data.get("deadline_note") else None,
-            get_started_steps=get_started_steps,
-            directory_structure=directory_structure,
-            terminology=terminology,
-            marking_criteria=marking_criteria,
-            prioritization_tiers=prioritization_tiers,
-            recommended_schedule=recommended_schedule,
-            constraints=list(data.get("constraints", [])) if data.get("constraints") else [],
-            debugging_tips=list(data.get("debugging_tips", [])) if data.get("debugging_tips") else [],
-            extraction_warnings=extraction_warnings,
-        )
+        return result.model_copy(update=update)
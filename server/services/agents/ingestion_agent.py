@@ -1,11 +1,15 @@
 """Ingestion Agent - handles multimodal document processing and embedding."""
 
+import asyncio
 import uuid
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-from services.agents.base import BaseAgent
-from services.document_processor import MultimodalDocumentProcessor
-from services.vector_store import get_vector_store
+from server.services.agents.analysis_agent import ANALYSIS_MAX_CHARS
+from server.services.agents.base import BaseAgent
+from server.services.document_processor import MultimodalDocumentProcessor
+from server.services.pdf_parser import extract_pdf_content_async
+from server.services.rag_chain import invalidate_retrieval_cache
+from server.services.vector_store import get_vector_store
 
 
 class IngestionAgent(BaseAgent):
@@ -13,7 +17,7 @@ class IngestionAgent(BaseAgent):
     Agent responsible for multimodal document ingestion.
     
     Extracts text and images from PDFs, generates AI descriptions 
-    for images, and stores all embeddings in ChromaDB.
+    for images, and stores all embeddings in Qdrant.
     """
     
     def __init__(self, max_images: int = 10):
@@ -41,47 +45,81 @@ class IngestionAgent(BaseAgent):
             - document_id: str - Unique document identifier
             - text_chunk_count: int - Number of text chunks created
             - image_count: int - Number of images processed
-            - collection_name: str - ChromaDB collection name
-            - pdf_text: str - Extracted text (for analysis agent)
+            - collection_name: str - Qdrant collection name
+            - pdf_text: str - Extracted text for the analysis agent, capped
+              at ANALYSIS_MAX_CHARS (the full text only feeds chunking)
+            - pdf_text_truncated: bool - Whether pdf_text was capped
             - images: list - Info about extracted images
         """
         pdf_content = input_data.get("pdf_content")
-        user_id = input_data.get("user_id", "anonymous")
-        metadata = input_data.get("metadata", {})
-        
         if not pdf_content:
             raise ValueError("pdf_content is required")
         
         # Generate unique document ID
         document_id = str(uuid.uuid4())
+        extracted = await self.extract(pdf_content, document_id)
+        return await self.index(
+            pdf_content,
+            extracted,
+            document_id,
+            user_id=input_data.get("user_id", "anonymous"),
+            metadata=input_data.get("metadata", {}),
+        )
+    
+    async def extract(self, pdf_content: bytes, document_id: str) -> Tuple[str, List[dict]]:
+        """
+        Extract (full text, image info) from a PDF.
+        
+        This is all the analysis agent needs, so the orchestrator can start
+        the LLM call while index() is still chunking and embedding.
+        """
+        # PyMuPDF extraction is CPU-bound and holds the GIL, so it runs in
+        # the worker process pool rather than a thread
+        return await extract_pdf_content_async(
+            pdf_content,
+            str(self.doc_processor.image_dir(document_id)),
+            self.doc_processor.max_images,
+        )
+    
+    async def index(
+        self,
+        pdf_content: bytes,
+        extracted: Tuple[str, List[dict]],
+        document_id: str,
+        user_id: str = "anonymous",
+        metadata: Optional[Dict] = None,
+    ) -> Dict[str, Any]:
+        """
+        Chunk, describe images and embed an extracted PDF.
+        
+        Returns the execute() output.
+        """
         collection_name = f"coursework_{user_id}"
         
-        # Process PDF with multimodal processor (text + images)
-        text_docs, image_docs, image_info = self.doc_processor.process_pdf(
+        # Chunking and the (blocking, I/O-bound) vision calls stay on a thread
+        text_docs, image_docs, image_info, pdf_text = await asyncio.to_thread(
+            self.doc_processor.parse_pdf,
             pdf_content=pdf_content,
             document_id=document_id,
             metadata={
                 "user_id": user_id,
-                **metadata,
+                **(metadata or {}),
             },
+            extracted=extracted,
         )
         
-        # Store text embeddings
-        if text_docs:
-            self.vector_store.add_documents(collection_name, text_docs)
-        
-        # Store image description embeddings
-        if image_docs:
-            self.vector_store.add_documents(collection_name, image_docs)
-        
-        # Extract full text for analysis agent
-        pdf_text = self.doc_processor.get_full_text(pdf_content)
+        # Embed text and image descriptions together, so a typical PDF
+        # needs one or two full embedding batches instead of a partial
+        # batch per modality
+        await self.vector_store.add_documents_async(collection_name, text_docs + image_docs)
+        invalidate_retrieval_cache(collection_name)
         
         return {
             "document_id": document_id,
             "text_chunk_count": len(text_docs),
             "image_count": len(image_docs),
             "collection_name": collection_name,
-            "pdf_text": pdf_text,
+            "pdf_text": pdf_text[:ANALYSIS_MAX_CHARS],
+            "pdf_text_truncated": len(pdf_text) > ANALYSIS_MAX_CHARS,
             "images": image_info,
         }
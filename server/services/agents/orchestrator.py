@@ -1,11 +1,24 @@
 """Agent Orchestrator - coordinates the multi-agent workflow."""
 
-from typing import Any, Dict, Optional
+import asyncio
+import threading
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, TypedDict
 from enum import Enum
 
-from services.agents.ingestion_agent import IngestionAgent
-from services.agents.analysis_agent import AnalysisAgent
-from services.agents.qa_agent import QAAgent
+from server.services.agents.ingestion_agent import IngestionAgent
+from server.services.agents.analysis_agent import ANALYSIS_MAX_CHARS, AnalysisAgent
+from server.services.agents.qa_agent import QAAgent
+from server.models.schemas import DecompositionResponse
+from server.services.decomposition_cache import (
+    find_similar_decomposition,
+    get_cached_decomposition,
+    is_cacheable,
+    remember_fingerprint,
+    store_decomposition,
+    text_cache_key,
+)
+from server.services.vector_store import get_vector_store
 
 
 class TaskType(str, Enum):
@@ -14,13 +27,24 @@ class TaskType(str, Enum):
     CHAT = "chat"
 
 
+class DecompositionOutput(TypedDict):
+    """run_decomposition() result, also the payload of the final stream event."""
+    decomposition: DecompositionResponse
+    session_id: str
+    document_id: str
+    text_chunk_count: int
+    image_count: int
+    ingested: bool
+
+
 class AgentOrchestrator:
     """
     Orchestrates the multi-agent workflow for CourseworkBuddy.
     
     Workflow for DECOMPOSE (PDF → Implementation Guide):
-        1. IngestionAgent: Process PDF → chunks → embeddings
-        2. AnalysisAgent: Analyze content → generate decomposition
+        1. IngestionAgent: Extract PDF text and images
+        2. IngestionAgent: chunks → embeddings, concurrently with
+        3. AnalysisAgent: Analyze content → generate decomposition
     
     Workflow for CHAT (Follow-up Q&A):
         1. QAAgent: Answer question using RAG + conversation history
@@ -31,13 +55,17 @@ class AgentOrchestrator:
         self.ingestion_agent = IngestionAgent()
         self.analysis_agent = AnalysisAgent()
         self.qa_agent = QAAgent()
+        # content_hash -> running analysis, so concurrent uploads of the same
+        # PDF (e.g. a whole class at once) share one LLM call
+        self._inflight_analyses: Dict[str, asyncio.Future] = {}
     
     async def run_decomposition(
         self,
         pdf_content: bytes,
         user_id: str = "anonymous",
         metadata: Optional[Dict] = None,
-    ) -> Dict[str, Any]:
+        cached_decomposition: Optional[DecompositionResponse] = None,
+    ) -> DecompositionOutput:
         """
         Run the full decomposition pipeline.
         
@@ -45,37 +73,206 @@ class AgentOrchestrator:
             pdf_content: Raw PDF file bytes
             user_id: User identifier for collection namespacing
             metadata: Optional additional metadata
+            cached_decomposition: Previously computed result for this PDF;
+                when given, the LLM analysis step is skipped, and so is
+                ingestion if this collection already holds the PDF
+                (matched on metadata["content_hash"]). Without it, the
+                cache is still checked for the extracted text.
         
         Returns:
-            Dict containing:
+            DecompositionOutput:
                 - decomposition: DecompositionResponse object
                 - session_id: ID for follow-up chat
                 - document_id: Unique document identifier
                 - text_chunk_count: Number of text chunks created
                 - image_count: Number of images processed
+                - ingested: False if existing embeddings were reused
         """
-        # Step 1: Ingest document (extract, chunk, embed)
-        ingestion_result = await self.ingestion_agent.execute({
-            "pdf_content": pdf_content,
-            "user_id": user_id,
-            "metadata": metadata or {},
-        })
+        async for event in self.stream_decomposition(
+            pdf_content,
+            user_id=user_id,
+            metadata=metadata,
+            cached_decomposition=cached_decomposition,
+            stream_tasks=False,
+        ):
+            if event["event"] == "result":
+                return event["result"]
+        raise RuntimeError("Decomposition pipeline ended without a result")
+    
+    async def stream_decomposition(
+        self,
+        pdf_content: bytes,
+        user_id: str = "anonymous",
+        metadata: Optional[Dict] = None,
+        cached_decomposition: Optional[DecompositionResponse] = None,
+        stream_tasks: bool = True,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the decomposition pipeline, yielding progress events.
         
-        # Step 2: Analyze and decompose
-        analysis_result = await self.analysis_agent.execute({
-            "pdf_text": ingestion_result["pdf_text"],
-            "collection_name": ingestion_result["collection_name"],
-            "document_id": ingestion_result["document_id"],
-        })
+        Events (dicts keyed by "event"):
+            - ingestion: document_id, text_chunk_count, image_count - once
+              the PDF is embedded (or found already embedded); embedding runs
+              alongside the analysis, so this may follow some task events
+            - task: data (Task) - each task as the LLM finishes writing it,
+              only when stream_tasks is set
+            - result: result (the run_decomposition() return value) - last
+        """
+        content_hash = (metadata or {}).get("content_hash")
+        if cached_decomposition is not None and content_hash:
+            # Same user re-uploading the same PDF - embeddings already exist
+            existing = await asyncio.to_thread(
+                get_vector_store().find_document,
+                f"coursework_{user_id}",
+                content_hash,
+            )
+            if existing is not None:
+                yield self._ingestion_event({
+                    "document_id": existing["document_id"],
+                    "text_chunk_count": existing["chunk_count"],
+                    "image_count": 0,
+                })
+                yield self._result_event(
+                    cached_decomposition,
+                    existing["document_id"],
+                    existing["chunk_count"],
+                    0,
+                    ingested=False,
+                )
+                return
+        
+        # Step 1: Extract text and images
+        document_id = str(uuid.uuid4())
+        extracted = await self.ingestion_agent.extract(pdf_content, document_id)
         
+        # Step 2: Chunk + embed, overlapped with the analysis below - the
+        # LLM only needs the extracted text
+        index_task = asyncio.create_task(self.ingestion_agent.index(
+            pdf_content,
+            extracted,
+            document_id,
+            user_id=user_id,
+            metadata=metadata,
+        ))
+        try:
+            # Different bytes, same text (e.g. a re-exported PDF) - the LLM
+            # would see an identical prompt, so reuse its answer
+            text_key = None
+            if cached_decomposition is None:
+                text_key = text_cache_key(extracted[0])
+                cached_decomposition = (
+                    await get_cached_decomposition(text_key)
+                    or await find_similar_decomposition(extracted[0])
+                )
+            
+            if cached_decomposition is not None:
+                ingestion_result = await index_task
+                yield self._ingestion_event(ingestion_result)
+                yield self._result_event(
+                    cached_decomposition,
+                    document_id,
+                    ingestion_result["text_chunk_count"],
+                    ingestion_result.get("image_count", 0),
+                    ingested=True,
+                )
+                return
+            
+            # Step 3: Analyze and decompose
+            pdf_text = extracted[0]
+            analysis_input = {
+                "pdf_text": pdf_text[:ANALYSIS_MAX_CHARS],
+                "pdf_text_truncated": len(pdf_text) > ANALYSIS_MAX_CHARS,
+                "collection_name": f"coursework_{user_id}",
+                "document_id": document_id,
+            }
+            ingestion_sent = False
+            inflight = self._inflight_analyses.get(content_hash) if content_hash else None
+            if stream_tasks and inflight is None:
+                async for kind, payload in self.analysis_agent.execute_stream(analysis_input):
+                    # Report ingestion as soon as it lands, between tasks
+                    if not ingestion_sent and index_task.done():
+                        yield self._ingestion_event(index_task.result())
+                        ingestion_sent = True
+                    if kind == "task":
+                        yield {"event": "task", "data": payload}
+                    else:
+                        analysis_result = payload
+            else:
+                analysis_result = await self._shared_analysis(content_hash, analysis_input)
+            
+            if is_cacheable(analysis_result["decomposition"]):
+                await asyncio.gather(
+                    store_decomposition(text_key, analysis_result["decomposition"]),
+                    remember_fingerprint(pdf_text, text_key),
+                )
+            
+            ingestion_result = await index_task
+            if not ingestion_sent:
+                yield self._ingestion_event(ingestion_result)
+        finally:
+            # Generator closed early (client gone) or analysis failed
+            if not index_task.done():
+                index_task.cancel()
+        
+        # The analysis may have been run for another upload's document
+        yield self._result_event(
+            analysis_result["decomposition"],
+            document_id,
+            ingestion_result["text_chunk_count"],
+            ingestion_result.get("image_count", 0),
+            ingested=True,
+        )
+    
+    async def _shared_analysis(
+        self,
+        content_hash: Optional[str],
+        analysis_input: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Run the analysis, or join one already running for the same PDF.
+        
+        Streaming requests join in-flight analyses but never lead one, so
+        no other request depends on a stream its client may abandon.
+        """
+        if not content_hash:
+            return await self.analysis_agent.execute(analysis_input)
+        
+        future = self._inflight_analyses.get(content_hash)
+        if future is None:
+            future = asyncio.ensure_future(self.analysis_agent.execute(analysis_input))
+            self._inflight_analyses[content_hash] = future
+            future.add_done_callback(lambda _: self._inflight_analyses.pop(content_hash, None))
+        
+        # Shielded: one caller disconnecting must not cancel the others' result
+        return await asyncio.shield(future)
+    
+    @staticmethod
+    def _ingestion_event(ingestion_result: Dict[str, Any]) -> Dict[str, Any]:
         return {
-            "decomposition": analysis_result["decomposition"],
-            "session_id": analysis_result["session_id"],
-            "document_id": analysis_result["document_id"],
+            "event": "ingestion",
+            "document_id": ingestion_result["document_id"],
             "text_chunk_count": ingestion_result["text_chunk_count"],
             "image_count": ingestion_result.get("image_count", 0),
         }
     
+    @staticmethod
+    def _result_event(
+        decomposition: DecompositionResponse,
+        document_id: str,
+        text_chunk_count: int,
+        image_count: int,
+        ingested: bool,
+    ) -> Dict[str, Any]:
+        result: DecompositionOutput = {
+            "decomposition": decomposition,
+            "session_id": f"{document_id}:chat",
+            "document_id": document_id,
+            "text_chunk_count": text_chunk_count,
+            "image_count": image_count,
+            "ingested": ingested,
+        }
+        return {"event": "result", "result": result}
+    
     async def run_chat(
         self,
         question: str,
@@ -104,11 +301,16 @@ class AgentOrchestrator:
 
 # Singleton instance
 _orchestrator: Optional[AgentOrchestrator] = None
+_orchestrator_lock = threading.Lock()
 
 
 def get_orchestrator() -> AgentOrchestrator:
     """Get singleton orchestrator instance."""
     global _orchestrator
     if _orchestrator is None:
-        _orchestrator = AgentOrchestrator()
+        # Startup builds this in a worker thread while requests may already
+        # be asking for it; only one of them may construct the agents
+        with _orchestrator_lock:
+            if _orchestrator is None:
+                _orchestrator = AgentOrchestrator()
     return _orchestrator
@@ -1,65 +1,157 @@
 """Q&A Agent - handles follow-up questions with conversation memory."""
 
+import os
 from typing import Any, Dict, List, Optional
+
+import orjson
+from cachetools import TTLCache
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
+from langchain_core.messages import (
+    HumanMessage,
+    AIMessage,
+    BaseMessage,
+    messages_from_dict,
+    messages_to_dict,
+)
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
+
+from server.services.agents.base import BaseAgent
+from server.services.langchain_service import gemini_slot, get_langchain_service
+from server.services.rag_chain import get_batching_retriever
+
+
+# Optional Redis backend - shares chat history across workers and restarts
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    aioredis = None
+    REDIS_AVAILABLE = False
+
+REDIS_URL = os.getenv("REDIS_URL")
+CHAT_HISTORY_TTL_SECONDS = int(os.getenv("CHAT_HISTORY_TTL_SECONDS", str(24 * 60 * 60)))
+# Sessions kept by the in-process fallback; least recently updated are evicted first
+MAX_LOCAL_SESSIONS = int(os.getenv("CHAT_MAX_LOCAL_SESSIONS", "1000"))
+
+# Singleton client (holds its own connection pool)
+_redis = None
+
 
-from services.agents.base import BaseAgent
-from services.langchain_service import get_langchain_service
-from services.rag_chain import RAGChain
+def get_redis():
+    """Get the shared Redis client, or None if Redis isn't configured."""
+    global _redis
+    if _redis is None and REDIS_AVAILABLE and REDIS_URL:
+        _redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
 
 
 class ConversationMemory:
     """
-    Simple in-memory conversation storage.
+    Conversation storage keyed by session id.
     
-    For production, this should be persisted to PostgreSQL.
+    Backed by Redis lists (``chat:{session_id}``) when REDIS_URL is set,
+    so every worker sees the same history; otherwise falls back to a
+    process-local cache bounded by MAX_LOCAL_SESSIONS and expiring after
+    CHAT_HISTORY_TTL_SECONDS, like the Redis keys.
     """
     
-    _sessions: Dict[str, List[BaseMessage]] = {}
+    _sessions: TTLCache = TTLCache(maxsize=MAX_LOCAL_SESSIONS, ttl=CHAT_HISTORY_TTL_SECONDS)
     _max_history: int = 20  # Keep last 20 messages per session
+    _key_prefix: str = "chat:"
     
     @classmethod
-    def get_history(cls, session_id: str, limit: int = 10) -> List[BaseMessage]:
+    async def get_history(cls, session_id: str, limit: int = 10) -> List[BaseMessage]:
         """Get conversation history for a session."""
-        history = cls._sessions.get(session_id, [])
-        return history[-limit:] if limit else history
+        client = get_redis()
+        if client is None:
+            history = cls._sessions.get(session_id, [])
+            return history[-limit:] if limit else history
+        
+        raw = await client.lrange(cls._key_prefix + session_id, -limit if limit else 0, -1)
+        return messages_from_dict([orjson.loads(item) for item in raw])
     
     @classmethod
     def add_message(cls, session_id: str, message: BaseMessage):
-        """Add a message to session history."""
-        if session_id not in cls._sessions:
-            cls._sessions[session_id] = []
-        
-        cls._sessions[session_id].append(message)
+        """Add a message to the in-process session history."""
+        history = cls._sessions.get(session_id, [])
+        history.append(message)
         
-        # Trim to max history
-        if len(cls._sessions[session_id]) > cls._max_history:
-            cls._sessions[session_id] = cls._sessions[session_id][-cls._max_history:]
+        # Trim to max history; reassigning also refreshes the TTL
+        cls._sessions[session_id] = history[-cls._max_history:]
     
     @classmethod
-    def add_exchange(cls, session_id: str, user_message: str, assistant_message: str):
+    async def add_exchange(cls, session_id: str, user_message: str, assistant_message: str):
         """Add a user-assistant exchange to history."""
-        cls.add_message(session_id, HumanMessage(content=user_message))
-        cls.add_message(session_id, AIMessage(content=assistant_message))
+        messages = [HumanMessage(content=user_message), AIMessage(content=assistant_message)]
+        
+        client = get_redis()
+        if client is None:
+            for message in messages:
+                cls.add_message(session_id, message)
+            return
+        
+        # Append, trim and refresh the TTL in a single round trip
+        key = cls._key_prefix + session_id
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.rpush(key, *(orjson.dumps(m) for m in messages_to_dict(messages)))
+            pipe.ltrim(key, -cls._max_history, -1)
+            pipe.expire(key, CHAT_HISTORY_TTL_SECONDS)
+            await pipe.execute()
     
     @classmethod
-    def clear(cls, session_id: str):
+    async def clear(cls, session_id: str):
         """Clear history for a session."""
-        cls._sessions.pop(session_id, None)
+        client = get_redis()
+        if client is None:
+            cls._sessions.pop(session_id, None)
+            return
+        await client.delete(cls._key_prefix + session_id)
     
     @classmethod
-    def get_session_count(cls) -> int:
+    async def get_session_count(cls) -> int:
         """Get number of active sessions."""
-        return len(cls._sessions)
-    
-    @classmethod
-    def cleanup_empty_sessions(cls):
-        """Remove empty sessions."""
-        empty = [k for k, v in cls._sessions.items() if not v]
-        for k in empty:
-            del cls._sessions[k]
+        client = get_redis()
+        if client is None:
+            cls._sessions.expire()
+            return len(cls._sessions)
+        
+        count = 0
+        async for _ in client.scan_iter(match=cls._key_prefix + "*", count=1000):
+            count += 1
+        return count
+
+
+# Built once - history, context and question are filled in per turn
+_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a helpful assistant for university students working on their coursework.
+Use the following context from their coursework specification to answer questions.
+The context may include both text and descriptions of diagrams/images from the PDF.
+Be concise but thorough. If you cannot find the answer in the context, say so.
+
+IMPORTANT RULES:
+1. Guide their thinking, DO NOT write code or solutions for them
+2. If asked to solve something, explain the approach conceptually but don't implement it
+3. If asked about specific requirements, cite the relevant section from context
+4. If referencing a diagram, mention which page it's from
+5. Be encouraging and supportive - coursework can be stressful!
+
+Context from coursework specification:
+{context}"""),
+    MessagesPlaceholder(variable_name="history"),
+    ("human", "{question}"),
+])
+
+
+def _format_context_doc(i: int, doc: Document) -> str:
+    """Header + content for one retrieved chunk, in a single f-string."""
+    metadata = doc.metadata
+    if metadata.get("source_type", "text") == "image":
+        return (
+            f"[Image from Page {metadata.get('page_number', '?')} - "
+            f"Chunk {metadata.get('chunk_index', i)}]\n{doc.page_content}"
+        )
+    return f"[Text Chunk {metadata.get('chunk_index', i)}]\n{doc.page_content}"
 
 
 class QAAgent(BaseAgent):
@@ -71,6 +163,7 @@ class QAAgent(BaseAgent):
             description="Answers student questions about their coursework using RAG with conversation memory",
         )
         self.langchain = get_langchain_service()
+        self._chain = _PROMPT | self.langchain.get_llm(fast=True) | StrOutputParser()
     
     async def execute(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -94,68 +187,47 @@ class QAAgent(BaseAgent):
             raise ValueError("question, session_id, and collection_name are required")
         
         # Get conversation history
-        history = ConversationMemory.get_history(session_id, limit=10)
+        history = await ConversationMemory.get_history(session_id, limit=10)
         
-        # Retrieve relevant context from vector store (text + image descriptions)
-        rag = RAGChain(collection_name)
-        context_docs = rag.retrieve_context(question, k=6)  # Increased for multimodal
+        # Retrieve relevant context from vector store (text + image descriptions),
+        # batched with other in-flight chat turns
+        context_docs = await get_batching_retriever().aretrieve_multimodal(
+            collection_name, question, k_text=4, k_image=2,
+        )
         
         # Format context, noting image sources
-        context_parts = []
-        for i, doc in enumerate(context_docs):
-            source_type = doc.metadata.get("source_type", "text")
-            chunk_idx = doc.metadata.get("chunk_index", i)
-            
-            if source_type == "image":
-                page_num = doc.metadata.get("page_number", "?")
-                context_parts.append(
-                    f"[Image from Page {page_num} - Chunk {chunk_idx}]\n{doc.page_content}"
-                )
-            else:
-                context_parts.append(f"[Text Chunk {chunk_idx}]\n{doc.page_content}")
-        
-        context = "\n\n---\n\n".join(context_parts)
-        
-        # Build prompt with history and context
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a helpful assistant for university students working on their coursework.
-Use the following context from their coursework specification to answer questions.
-The context may include both text and descriptions of diagrams/images from the PDF.
-Be concise but thorough. If you cannot find the answer in the context, say so.
-
-IMPORTANT RULES:
-1. Guide their thinking, DO NOT write code or solutions for them
-2. If asked to solve something, explain the approach conceptually but don't implement it
-3. If asked about specific requirements, cite the relevant section from context
-4. If referencing a diagram, mention which page it's from
-5. Be encouraging and supportive - coursework can be stressful!
-
-Context from coursework specification:
-{context}"""),
-            MessagesPlaceholder(variable_name="history"),
-            ("human", "{question}"),
-        ])
-        
-        chain = prompt | self.langchain.get_llm(fast=True) | StrOutputParser()
+        context = "\n\n---\n\n".join(
+            _format_context_doc(i, doc) for i, doc in enumerate(context_docs)
+        )
         
-        answer = chain.invoke({
-            "context": context,
-            "history": history,
-            "question": question,
-        })
+        async with gemini_slot(fast=True):
+            answer = await self._chain.ainvoke({
+                "context": context,
+                "history": history,
+                "question": question,
+            })
         
         # Save to conversation memory
-        ConversationMemory.add_exchange(session_id, question, answer)
+        await ConversationMemory.add_exchange(session_id, question, answer)
         
         # Prepare source references and collect images
         sources = []
         images = []
+        seen_chunks: set[str] = set()
+        seen_images: set[str] = set()
         
         for i, doc in enumerate(context_docs):
             source_type = doc.metadata.get("source_type", "text")
             
+            # Skip chunks the retriever returned more than once
+            chunk_id = doc.metadata.get("chunk_id", "")
+            if chunk_id:
+                if chunk_id in seen_chunks:
+                    continue
+                seen_chunks.add(chunk_id)
+            
             source_info = {
-                "chunk_id": doc.metadata.get("chunk_id", ""),
+                "chunk_id": chunk_id,
                 "chunk_index": doc.metadata.get("chunk_index", i),
                 "preview": doc.page_content[:200] + ("..." if len(doc.page_content) > 200 else ""),
                 "source_type": source_type,
@@ -167,7 +239,8 @@ Context from coursework specification:
                 if image_path:
                     source_info["image_path"] = image_path
                     # Only include unique images
-                    if image_path not in images:
+                    if image_path not in seen_images:
+                        seen_images.add(image_path)
                         images.append(image_path)
             
             sources.append(source_info)
@@ -1,14 +1,23 @@
 """AI Decomposer service using Google Gemini API."""
 
-import json
+import asyncio
 import os
-import re
+import threading
+import time
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
 import google.generativeai as genai
-from prompts.decomposer import DECOMPOSER_SYSTEM_PROMPT, USER_PROMPT_TEMPLATE
-from models.schemas import (
-    DecompositionResponse, Task, Milestone,
-    TermDefinition, MarkingCriterion, GetStartedStep,
-    PrioritizationTier, WeeklySchedule, DirectoryEntry
+from google.generativeai import caching
+from server.prompts.decomposer import DECOMPOSER_SYSTEM_PROMPT, USER_PROMPT_STATIC, USER_PROMPT_SUFFIX
+from server.models.schemas import DecompositionResponse, Task
+from server.services.langchain_service import gemini_slot
+# repair_json/loads_llm_json are re-exported for existing importers
+from server.services.decomposition_parser import (
+    loads_llm_json,
+    loads_truncated_json,
+    repair_json,
+    validate_decomposition,
 )
 
 
@@ -17,209 +26,138 @@ class DecomposerError(Exception):
     pass
 
 
+# Upload the system prompt and the static user instructions once as Gemini
+# cached content and reference them by name, so each request only sends
+# the PDF text. Opt-in: the API has a minimum cacheable size and needs a
+# versioned model name (e.g. gemini-2.0-flash-001), so on any failure the
+# prompt is sent inline.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+CONTEXT_CACHE_TTL = timedelta(hours=6)
+
+_GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0.3,
+    max_output_tokens=16384,  # Increased for larger output
+    response_mime_type="application/json",
+)
+
+# (model_name, api_key, model, expires_at) for the cached-content model
+_cached_model = None
+_context_cache_failed = False
+_cached_model_lock = threading.Lock()
+
+
 def get_gemini_model():
     """Get configured Gemini model."""
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise DecomposerError("GEMINI_API_KEY environment variable not set")
     
-    genai.configure(api_key=api_key)
     model_name = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+    if CONTEXT_CACHE_ENABLED and not _context_cache_failed:
+        model = _get_cached_model(model_name, api_key)
+        if model is not None:
+            return model
+    return _build_model(model_name, api_key)
+
+
+@lru_cache(maxsize=4)
+def _build_model(model_name: str, api_key: str):
+    """Configure the SDK and build a model once per (model, key)."""
+    genai.configure(api_key=api_key)
     
     return genai.GenerativeModel(
         model_name=model_name,
-        generation_config=genai.GenerationConfig(
-            temperature=0.3,
-            max_output_tokens=16384,  # Increased for larger output
-            response_mime_type="application/json",
-        ),
+        generation_config=_GENERATION_CONFIG,
         system_instruction=DECOMPOSER_SYSTEM_PROMPT,
     )
 
 
-def repair_json(text: str) -> str:
+def _get_cached_model(model_name: str, api_key: str):
     """
-    Repair malformed JSON from AI responses.
-    Handles: unterminated strings, missing brackets, truncation, markdown fences.
-    Uses a state machine to properly track string boundaries.
+    Get a model bound to the cached system prompt, recreating it shortly
+    before the cache expires. Returns None if caching isn't available.
     """
-    if not text:
-        return "{}"
-
-    text = text.strip()
-
-    # Remove markdown fences
-    if text.startswith("```"):
-        first_nl = text.find('\n')
-        if first_nl > 0:
-            text = text[first_nl + 1:]
-        if "```" in text:
-            text = text[:text.rfind("```")]
-        text = text.strip()
-
-    # Find JSON start
-    start = text.find('{')
-    if start == -1:
-        return "{}"
-    text = text[start:]
-
-    # State machine to track JSON structure
-    result = []
-    i = 0
-    stack = []  # Track open brackets: '{' or '['
-    in_string = False
-    escape_next = False
-
-    while i < len(text):
-        char = text[i]
-
-        if escape_next:
-            result.append(char)
-            escape_next = False
-            i += 1
-            continue
-
-        if char == '\\' and in_string:
-            result.append(char)
-            escape_next = True
-            i += 1
-            continue
+    global _cached_model, _context_cache_failed
+    
+    with _cached_model_lock:
+        if _cached_model is not None:
+            cached_name, cached_key, model, expires_at = _cached_model
+            # Refresh a minute early so no request races the expiry
+            if (cached_name, cached_key) == (model_name, api_key) and time.monotonic() < expires_at - 60:
+                return model
+        
+        genai.configure(api_key=api_key)
+        try:
+            cached = caching.CachedContent.create(
+                model=model_name,
+                display_name="courseworkbuddy-decomposer",
+                system_instruction=DECOMPOSER_SYSTEM_PROMPT,
+                contents=[{"role": "user", "parts": [USER_PROMPT_STATIC]}],
+                ttl=CONTEXT_CACHE_TTL,
+            )
+        except Exception as e:
+            print(f"Context cache unavailable, sending system prompt inline: {e}")
+            _context_cache_failed = True
+            return None
+        
+        model = genai.GenerativeModel.from_cached_content(cached, generation_config=_GENERATION_CONFIG)
+        _cached_model = (model_name, api_key, model, time.monotonic() + CONTEXT_CACHE_TTL.total_seconds())
+        return model
 
-        if char == '"' and not escape_next:
-            in_string = not in_string
-            result.append(char)
-            i += 1
-            continue
 
-        if in_string:
-            # Handle problematic characters in strings
-            if char in '\n\r\t':
-                # Replace literal newlines/tabs with escaped versions
-                if char == '\n':
-                    result.append('\\n')
-                elif char == '\r':
-                    result.append('\\r')
-                elif char == '\t':
-                    result.append('\\t')
-            else:
-                result.append(char)
-            i += 1
-            continue
+# Opt-in: split the legacy decomposition into independent sub-prompts run
+# concurrently, so latency is the slowest part rather than the whole guide.
+# Costs one request (and one copy of the PDF in input tokens) per part.
+DECOMPOSE_PARALLEL = os.getenv("DECOMPOSE_PARALLEL", "0") == "1"
 
-        # Outside string - track structure
-        if char == '{':
-            stack.append('{')
-            result.append(char)
-        elif char == '[':
-            stack.append('[')
-            result.append(char)
-        elif char == '}':
-            if stack and stack[-1] == '{':
-                stack.pop()
-            result.append(char)
-        elif char == ']':
-            if stack and stack[-1] == '[':
-                stack.pop()
-            result.append(char)
-        else:
-            result.append(char)
-
-        i += 1
-
-        # Stop if we've closed the root object
-        if not stack and result and result[0] == '{':
-            break
-
-    json_str = ''.join(result)
-
-    # Fix unterminated string
-    if in_string:
-        json_str += '"'
-
-    # Close any remaining open brackets (in reverse order)
-    while stack:
-        bracket = stack.pop()
-        if bracket == '{':
-            json_str += '}'
-        else:
-            json_str += ']'
-
-    # Validate and attempt parse
-    try:
-        json.loads(json_str)
-        return json_str
-    except json.JSONDecodeError:
-        # Try to fix common issues
-        # Remove trailing comma before closing bracket
-        json_str = re.sub(r',\s*([}\]])', r'\1', json_str)
-        # Remove any content after the last valid closing brace
-        last_brace = json_str.rfind('}')
-        if last_brace > 0:
-            json_str = json_str[:last_brace + 1]
-        # Try again
-        try:
-            json.loads(json_str)
-            return json_str
-        except json.JSONDecodeError:
-            # Ultimate fallback - return empty object
-            print(f"JSON repair failed. Length: {len(json_str)}, First 200: {json_str[:200]}")
-            return "{}"
+# Top-level keys per sub-prompt. Everything that references task ids stays
+# with the tasks, so ids are consistent within each response.
+PARALLEL_FIELD_GROUPS = (
+    ("tasks", "milestones", "prioritization_tiers", "recommended_schedule", "total_estimated_time"),
+    ("course_name", "summary_overview", "what_you_need_to_do", "key_deliverables", "deadline",
+     "deadline_note", "marking_criteria", "constraints", "terminology"),
+    ("setup_instructions", "get_started_steps", "directory_structure", "debugging_tips"),
+)
 
 
-def _parse_priority(priority_value) -> int | None:
+def decompose_coursework(pdf_text: str) -> DecompositionResponse:
     """
-    Parse priority value - handles both integers and strings.
+    Use AI to decompose coursework specification into an Implementation Guide.
     
-    Strings like 'essential', 'strong', 'excellence' are converted to priority levels:
-    - 'essential' / 'high' / 'critical' -> 0 (highest)
-    - 'strong' / 'medium' / 'important' -> 1
-    - 'excellence' / 'low' / 'optional' / 'bonus' -> 2
+    Args:
+        pdf_text: Extracted text from the PDF
+        
+    Returns:
+        DecompositionResponse with tasks, milestones, and implementation guide fields
+        
+    Raises:
+        DecomposerError: If AI fails to process the content
     """
-    if priority_value is None:
-        return None
-    
-    # If already an integer, return it
-    if isinstance(priority_value, int):
-        return priority_value
+    model = get_gemini_model()
+    user_prompt = _user_prompt(pdf_text, cached=model.cached_content is not None)
     
-    # Try to convert string to int first
     try:
-        return int(priority_value)
-    except (ValueError, TypeError):
-        pass
-    
-    # Map string values to priority levels
-    priority_str = str(priority_value).lower().strip()
-    priority_map = {
-        'essential': 0,
-        'critical': 0,
-        'high': 0,
-        'must': 0,
-        'strong': 1,
-        'important': 1,
-        'medium': 1,
-        'should': 1,
-        'excellence': 2,
-        'bonus': 2,
-        'optional': 2,
-        'low': 2,
-        'nice': 2,
-    }
-    
-    for key, value in priority_map.items():
-        if key in priority_str:
-            return value
-    
-    # Default to medium priority
-    return 1
+        # Stream so a response cut off at max_output_tokens still yields
+        # whatever arrived before the limit
+        response = model.generate_content(user_prompt, stream=True)
+        content = "".join(chunk.text for chunk in response if chunk.parts)
+        truncated = _is_truncated(response)
+        return _build_result(_parse_content(content, truncated), truncated)
+        
+    except Exception as e:
+        if isinstance(e, DecomposerError):
+            raise
+        raise DecomposerError(f"AI processing failed: {e}")
 
 
-def decompose_coursework(pdf_text: str) -> DecompositionResponse:
+async def decompose_coursework_async(pdf_text: str, parallel: bool | None = None) -> DecompositionResponse:
     """
-    Use AI to decompose coursework specification into an Implementation Guide.
+    Async decompose_coursework, optionally as concurrent sub-prompts.
     
     Args:
         pdf_text: Extracted text from the PDF
+        parallel: Split into PARALLEL_FIELD_GROUPS requests run with
+            asyncio.gather; defaults to DECOMPOSE_PARALLEL
         
     Returns:
         DecompositionResponse with tasks, milestones, and implementation guide fields
@@ -227,210 +165,218 @@ def decompose_coursework(pdf_text: str) -> DecompositionResponse:
     Raises:
         DecomposerError: If AI fails to process the content
     """
-    model = get_gemini_model()
-    
-    # Truncate very long PDFs to avoid token limits
-    max_chars = 50000  # ~12.5k tokens
-    if len(pdf_text) > max_chars:
-        pdf_text = pdf_text[:max_chars] + "\n\n[PDF text truncated for processing...]"
-    
-    # Prepare the user prompt
-    user_prompt = USER_PROMPT_TEMPLATE.format(pdf_content=pdf_text)
+    if parallel is None:
+        parallel = DECOMPOSE_PARALLEL
+    # May create the context cache - a blocking RPC
+    model = await asyncio.to_thread(get_gemini_model)
+    user_prompt = _user_prompt(pdf_text, cached=model.cached_content is not None)
     
     try:
-        response = model.generate_content(user_prompt)
-        
-        # Get the response text
-        if not response.text:
-            raise DecomposerError("Empty response from AI")
-        
-        # Clean and parse the response
-        content = repair_json(response.text)
-        
-        try:
-            data = json.loads(content)
-        except json.JSONDecodeError as e:
-            # Log the problematic response for debugging
-            print(f"Failed to parse JSON. Response length: {len(content)}")
-            print(f"First 500 chars: {content[:500]}")
-            print(f"Last 500 chars: {content[-500:]}")
-            raise DecomposerError(f"Invalid JSON response: {str(e)[:100]}")
-        
-        # Parse tasks
-        tasks = []
-        for task_data in data.get("tasks", []):
-            try:
-                tasks.append(Task(
-                    task_id=str(task_data.get("task_id", f"t{len(tasks)+1}")),
-                    title=str(task_data.get("title", "Untitled Task")),
-                    description=str(task_data.get("description", "")),
-                    estimated_time=str(task_data.get("estimated_time", "Unknown")),
-                    related_files=list(task_data.get("related_files", [])) if task_data.get("related_files") else [],
-                    pdf_snippet=str(task_data.get("pdf_snippet", "")) if task_data.get("pdf_snippet") else None,
-                    commands=list(task_data.get("commands", [])) if task_data.get("commands") else [],
-                    prerequisites=list(task_data.get("prerequisites", [])) if task_data.get("prerequisites") else [],
-                    status=str(task_data.get("status", "todo")),
-                    priority=_parse_priority(task_data.get("priority")),
-                ))
-            except Exception as e:
-                print(f"Error parsing task: {e}")
-                continue
-        
-        # Parse milestones
-        milestones = []
-        for milestone_data in data.get("milestones", []):
-            try:
-                milestones.append(Milestone(
-                    id=str(milestone_data.get("id", f"m{len(milestones)+1}")),
-                    title=str(milestone_data.get("title", "Untitled Milestone")),
-                    description=str(milestone_data.get("description", "")) if milestone_data.get("description") else None,
-                    summary=str(milestone_data.get("summary", "")) if milestone_data.get("summary") else None,
-                    tasks=list(milestone_data.get("tasks", [])) if milestone_data.get("tasks") else [],
-                ))
-            except Exception as e:
-                print(f"Error parsing milestone: {e}")
-                continue
-        
-        # Parse terminology
-        terminology = []
-        for term_data in data.get("terminology", []):
-            try:
-                terminology.append(TermDefinition(
-                    term=str(term_data.get("term", "")),
-                    definition=str(term_data.get("definition", "")),
-                    example=str(term_data.get("example", "")) if term_data.get("example") else None,
-                ))
-            except Exception as e:
-                print(f"Error parsing term: {e}")
-                continue
+        parts = await asyncio.gather(*(
+            _generate_part(model, user_prompt, fields)
+            for fields in (PARALLEL_FIELD_GROUPS if parallel else (None,))
+        ))
+        data: Dict[str, Any] = {}
+        truncated = False
+        for part_data, part_truncated in parts:
+            data.update(part_data)
+            truncated = truncated or part_truncated
+        return _build_result(data, truncated)
         
-        # Parse marking criteria
-        marking_criteria = []
-        for mc_data in data.get("marking_criteria", []):
-            try:
-                marking_criteria.append(MarkingCriterion(
-                    component=str(mc_data.get("component", "")),
-                    percentage=int(mc_data.get("percentage")) if mc_data.get("percentage") is not None else None,
-                    description=str(mc_data.get("description", "")),
-                    priority=str(mc_data.get("priority", "essential")),
-                ))
-            except Exception as e:
-                print(f"Error parsing marking criterion: {e}")
-                continue
-        
-        # Parse get started steps
-        get_started_steps = []
-        for step_data in data.get("get_started_steps", []):
-            try:
-                get_started_steps.append(GetStartedStep(
-                    step_number=int(step_data.get("step_number", len(get_started_steps)+1)),
-                    title=str(step_data.get("title", "")),
-                    description=str(step_data.get("description", "")),
-                    commands=list(step_data.get("commands", [])) if step_data.get("commands") else [],
-                    expected_output=str(step_data.get("expected_output", "")) if step_data.get("expected_output") else None,
-                ))
-            except Exception as e:
-                print(f"Error parsing get started step: {e}")
-                continue
-        
-        # Parse prioritization tiers
-        prioritization_tiers = []
-        for tier_data in data.get("prioritization_tiers", []):
-            try:
-                prioritization_tiers.append(PrioritizationTier(
-                    tier=str(tier_data.get("tier", "")),
-                    description=str(tier_data.get("description", "")),
-                    time_estimate=str(tier_data.get("time_estimate", "")),
-                    task_ids=list(tier_data.get("task_ids", [])) if tier_data.get("task_ids") else [],
-                ))
-            except Exception as e:
-                print(f"Error parsing prioritization tier: {e}")
-                continue
-        
-        # Parse recommended schedule
-        recommended_schedule = []
-        for week_data in data.get("recommended_schedule", []):
-            try:
-                recommended_schedule.append(WeeklySchedule(
-                    week=int(week_data.get("week", len(recommended_schedule)+1)),
-                    title=str(week_data.get("title", "")),
-                    task_ids=list(week_data.get("task_ids", [])) if week_data.get("task_ids") else [],
-                    hours_estimate=int(week_data.get("hours_estimate", 0)),
-                ))
-            except Exception as e:
-                print(f"Error parsing schedule week: {e}")
-                continue
-        
-        # Parse directory structure
-        directory_structure = []
-        for dir_data in data.get("directory_structure", []):
-            try:
-                directory_structure.append(DirectoryEntry(
-                    path=str(dir_data.get("path", "")),
-                    type=str(dir_data.get("type", "file")),
-                    description=str(dir_data.get("description", "")) if dir_data.get("description") else None,
-                ))
-            except Exception as e:
-                print(f"Error parsing directory entry: {e}")
-                continue
-        
-        # Track extraction warnings
-        extraction_warnings = []
-
-        # Failsafe: if no tasks extracted, create a fallback
-        if not tasks:
-            extraction_warnings.append("tasks")
-            tasks = [Task(
-                task_id="fallback-1",
-                title="Review Specifications Manually",
-                description="Could not extract specific tasks from your PDF. Please review your coursework specifications directly and create your own task breakdown.",
-                estimated_time="Varies",
-                status="todo"
-            )]
-
-        # Track other missing fields
-        if not marking_criteria:
-            extraction_warnings.append("marking_criteria")
-        if not data.get("deadline"):
-            extraction_warnings.append("deadline")
-        if not data.get("key_deliverables"):
-            extraction_warnings.append("key_deliverables")
-        if not prioritization_tiers:
-            extraction_warnings.append("prioritization_tiers")
-        if not get_started_steps:
-            extraction_warnings.append("get_started_steps")
-        if not milestones:
-            extraction_warnings.append("milestones")
-
-        return DecompositionResponse(
-            # Core fields
-            tasks=tasks,
-            milestones=milestones,
-            setup_instructions=list(data.get("setup_instructions", [])) if data.get("setup_instructions") else [],
-            course_name=str(data.get("course_name", "")) if data.get("course_name") else None,
-            total_estimated_time=str(data.get("total_estimated_time", "")) if data.get("total_estimated_time") else None,
-            summary_overview=str(data.get("summary_overview", "")) if data.get("summary_overview") else None,
-            key_deliverables=list(data.get("key_deliverables", [])) if data.get("key_deliverables") else [],
-            what_you_need_to_do=str(data.get("what_you_need_to_do", "")) if data.get("what_you_need_to_do") else None,
-            
-            # NEW: Implementation Guide fields
-            deadline=str(data.get("deadline", "")) if data.get("deadline") else None,
-            deadline_note=str(data.get("deadline_note", "")) if data.get("deadline_note") else None,
-            get_started_steps=get_started_steps,
-            directory_structure=directory_structure,
-            terminology=terminology,
-            marking_criteria=marking_criteria,
-            prioritization_tiers=prioritization_tiers,
-            recommended_schedule=recommended_schedule,
-            constraints=list(data.get("constraints", [])) if data.get("constraints") else [],
-            debugging_tips=list(data.get("debugging_tips", [])) if data.get("debugging_tips") else [],
-            extraction_warnings=extraction_warnings,
-        )
-        
-    except json.JSONDecodeError as e:
-        raise DecomposerError(f"Failed to parse AI response as JSON: {e}")
     except Exception as e:
         if isinstance(e, DecomposerError):
             raise
         raise DecomposerError(f"AI processing failed: {e}")
 
+
+def decompose_coursework_batch(
+    pdf_texts: List[str],
+    poll_interval: float = 30,
+    timeout: float = 24 * 60 * 60,
+) -> List[Union[DecompositionResponse, DecomposerError]]:
+    """
+    Decompose many PDFs through the Gemini Batch API.
+    
+    Batch jobs are billed at half price and don't count against the
+    interactive rate limit, but can take minutes to hours - use this for
+    offline bulk jobs (e.g. a lecturer's whole module), not request paths.
+    
+    Args:
+        pdf_texts: Extracted text of each PDF
+        poll_interval: Seconds between job status checks
+        timeout: Give up (and cancel the job) after this many seconds
+        
+    Returns:
+        One DecompositionResponse per PDF, in input order, or the
+        DecomposerError for PDFs whose request failed
+        
+    Raises:
+        DecomposerError: If the job itself fails, expires or times out
+    """
+    from google import genai as google_genai
+    from google.genai import types
+    
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise DecomposerError("GEMINI_API_KEY environment variable not set")
+    if not pdf_texts:
+        return []
+    
+    client = google_genai.Client(api_key=api_key)
+    config = types.GenerateContentConfig(
+        system_instruction=DECOMPOSER_SYSTEM_PROMPT,
+        temperature=_GENERATION_CONFIG.temperature,
+        max_output_tokens=_GENERATION_CONFIG.max_output_tokens,
+        response_mime_type=_GENERATION_CONFIG.response_mime_type,
+    )
+    # Inline requests: even 50 PDFs at the 50k-char cap are well under the
+    # 20MB inline limit, so no JSONL upload is needed
+    job = client.batches.create(
+        model=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+        src=[
+            types.InlinedRequest(
+                contents=_user_prompt(pdf_text),
+                metadata={"key": f"pdf_{i}"},
+                config=config,
+            )
+            for i, pdf_text in enumerate(pdf_texts)
+        ],
+        config=types.CreateBatchJobConfig(display_name="courseworkbuddy-decompose"),
+    )
+    
+    pending = {
+        types.JobState.JOB_STATE_QUEUED,
+        types.JobState.JOB_STATE_PENDING,
+        types.JobState.JOB_STATE_RUNNING,
+        types.JobState.JOB_STATE_UPDATING,
+    }
+    deadline = time.monotonic() + timeout
+    while job.state in pending:
+        if time.monotonic() > deadline:
+            client.batches.cancel(name=job.name)
+            raise DecomposerError(f"Batch job {job.name} timed out")
+        time.sleep(poll_interval)
+        job = client.batches.get(name=job.name)
+    
+    if job.state not in (types.JobState.JOB_STATE_SUCCEEDED, types.JobState.JOB_STATE_PARTIALLY_SUCCEEDED):
+        raise DecomposerError(f"Batch job {job.name} ended in {job.state}: {job.error}")
+    
+    # Responses aren't guaranteed to come back in request order; match
+    # them through the key each request was tagged with
+    by_key: Dict[str, Union[DecompositionResponse, DecomposerError]] = {}
+    for inlined in job.dest.inlined_responses or []:
+        key = (inlined.metadata or {}).get("key")
+        if inlined.error is not None or inlined.response is None:
+            by_key[key] = DecomposerError(f"Batch request failed: {inlined.error}")
+            continue
+        response = inlined.response
+        candidates = response.candidates or []
+        truncated = bool(candidates) and candidates[0].finish_reason == types.FinishReason.MAX_TOKENS
+        try:
+            by_key[key] = _build_result(_parse_content(response.text or "", truncated), truncated)
+        except DecomposerError as e:
+            by_key[key] = e
+    
+    return [
+        by_key.get(f"pdf_{i}", DecomposerError(f"Batch job {job.name} returned no response for PDF {i}"))
+        for i in range(len(pdf_texts))
+    ]
+
+
+async def _generate_part(
+    model,
+    user_prompt: str,
+    fields: Optional[Tuple[str, ...]],
+) -> Tuple[Dict[str, Any], bool]:
+    """Run one (sub-)prompt; returns (parsed JSON, truncated)."""
+    if fields:
+        user_prompt += (
+            "\n\nFor this request, return ONLY these top-level keys: "
+            f"{', '.join(fields)}. Omit every other key."
+        )
+    # Each part is its own request against the shared Gemini quota
+    async with gemini_slot():
+        response = await model.generate_content_async(user_prompt, stream=True)
+        content = "".join([chunk.text async for chunk in response if chunk.parts])
+    truncated = _is_truncated(response)
+    data = _parse_content(content, truncated)
+    if fields:
+        data = {key: value for key, value in data.items() if key in fields}
+    return data, truncated
+
+
+def _user_prompt(pdf_text: str, cached: bool = False) -> str:
+    """
+    Build the user prompt, truncating very long PDFs.
+    
+    With cached=True the static instructions are already in the model's
+    cached content, so only the PDF text is sent.
+    """
+    # Truncate very long PDFs to avoid token limits
+    max_chars = 50000  # ~12.5k tokens
+    if len(pdf_text) > max_chars:
+        pdf_parts: Tuple[str, ...] = (pdf_text[:max_chars], "\n\n[PDF text truncated for processing...]")
+    else:
+        pdf_parts = (pdf_text,)
+    
+    # One join - no intermediate truncated copy, no str.format pass
+    if cached:
+        return "".join(pdf_parts)
+    return "".join((USER_PROMPT_STATIC, *pdf_parts, USER_PROMPT_SUFFIX))
+
+
+def _is_truncated(response) -> bool:
+    """Whether generation stopped at max_output_tokens."""
+    return bool(response.candidates) and response.candidates[0].finish_reason.name == "MAX_TOKENS"
+
+
+def _parse_content(content: str, truncated: bool) -> Dict[str, Any]:
+    """Parse a (possibly truncated) JSON response."""
+    if not content:
+        raise DecomposerError("Empty response from AI")
+    
+    try:
+        return loads_truncated_json(content) if truncated else loads_llm_json(content)
+    except ValueError as e:  # json/orjson JSONDecodeError
+        # Log the problematic response for debugging
+        print(f"Failed to parse JSON. Response length: {len(content)}")
+        print(f"First 500 chars: {content[:500]}")
+        print(f"Last 500 chars: {content[-500:]}")
+        raise DecomposerError(f"Invalid JSON response: {str(e)[:100]}")
+
+
+def _build_result(data: Dict[str, Any], truncated: bool) -> DecompositionResponse:
+    """Validate parsed JSON and attach extraction warnings/fallbacks."""
+    result = validate_decomposition(data)
+    
+    # Track extraction warnings
+    extraction_warnings = ["truncated_response"] if truncated else []
+    update = {}
+
+    # Failsafe: if no tasks extracted, create a fallback
+    if not result.tasks:
+        extraction_warnings.append("tasks")
+        update["tasks"] = [Task(
+            task_id="fallback-1",
+            title="Review Specifications Manually",
+            description="Could not extract specific tasks from your PDF. Please review your coursework specifications directly and create your own task breakdown.",
+            estimated_time="Varies",
+            status="todo"
+        )]
+
+    # Track other missing fields
+    if not result.marking_criteria:
+        extraction_warnings.append("marking_criteria")
+    if not result.deadline:
+        extraction_warnings.append("deadline")
+    if not result.key_deliverables:
+        extraction_warnings.append("key_deliverables")
+    if not result.prioritization_tiers:
+        extraction_warnings.append("prioritization_tiers")
+    if not result.get_started_steps:
+        extraction_warnings.append("get_started_steps")
+    if not result.milestones:
+        extraction_warnings.append("milestones")
+    update["extraction_warnings"] = extraction_warnings
+
+    return result.model_copy(update=update)
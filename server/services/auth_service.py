@@ -1,21 +1,25 @@
 """Authentication service for user registration, login, and JWT management."""
 
+import asyncio
 import os
 import re
+import time
 import uuid as uuid_module
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
 from uuid import UUID
 
 import bcrypt
+from cachetools import TTLCache
 from jose import JWTError, jwt
 from pydantic import BaseModel, field_validator
-from sqlalchemy import select
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
-from models.user import User
-from models.token_blacklist import TokenBlacklist
+from server.models.user import User
+from server.models.token_blacklist import TokenBlacklist
 
 load_dotenv()
 
@@ -26,10 +30,27 @@ if not JWT_SECRET:
 
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_DAYS = 7  # Tokens valid for 7 days
+MAX_AUTH_HEADER_LENGTH = 4096  # Real tokens are a few hundred bytes
 
+# "Bearer <jwt>" - the token charset is base64url plus dots, so malformed
+# values are rejected here instead of costing a signature check
+_BEARER = re.compile(r"^Bearer\s+([A-Za-z0-9\-_.=]+)\s*$", re.IGNORECASE).match
 
-# Email validation regex
-EMAIL_REGEX = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+
+# argon2id for new hashes; existing bcrypt hashes still verify and are
+# upgraded on the next successful login (skip if argon2-cffi not installed)
+try:
+    from argon2 import PasswordHasher
+    _password_hasher = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=2)
+except ImportError:
+    _password_hasher = None
+
+
+# Email validation regex (used with fullmatch - "$" would also accept a
+# trailing newline). Inputs are length-capped first, so the backtracking
+# engine only ever sees short strings.
+EMAIL_REGEX = re.compile(r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}')
+MAX_EMAIL_LENGTH = 254  # RFC 5321 path limit
 
 
 # Pydantic schemas for auth
@@ -42,7 +63,7 @@ class UserCreate(BaseModel):
     @field_validator('email')
     @classmethod
     def validate_email(cls, v: str) -> str:
-        if not EMAIL_REGEX.match(v):
+        if len(v) > MAX_EMAIL_LENGTH or not EMAIL_REGEX.fullmatch(v):
             raise ValueError('Invalid email format')
         return v.lower()
 
@@ -79,17 +100,31 @@ class AuthError(Exception):
         super().__init__(self.message)
 
 
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
+async def hash_password(password: str) -> str:
+    """Hash a password in a worker thread, keeping the event loop free."""
+    return await asyncio.to_thread(_hash_password, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password in a worker thread, keeping the event loop free."""
+    return await asyncio.to_thread(_verify_password, plain_password, hashed_password)
+
+
+def _hash_password(password: str) -> str:
+    """Hash a password using argon2id (bcrypt if argon2-cffi is missing)."""
+    if _password_hasher is not None:
+        return _password_hasher.hash(password)
     # Encode password and generate salt
     password_bytes = password.encode('utf-8')
     salt = bcrypt.gensalt()
     return bcrypt.hashpw(password_bytes, salt).decode('utf-8')
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
+def _verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its argon2id or legacy bcrypt hash."""
     try:
+        if hashed_password.startswith("$argon2"):
+            return _password_hasher is not None and _password_hasher.verify(hashed_password, plain_password)
         password_bytes = plain_password.encode('utf-8')
         hashed_bytes = hashed_password.encode('utf-8')
         return bcrypt.checkpw(password_bytes, hashed_bytes)
@@ -97,6 +132,15 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Whether a verified hash should be replaced (bcrypt or outdated argon2 parameters)."""
+    if _password_hasher is None:
+        return False
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return _password_hasher.check_needs_rehash(hashed_password)
+
+
 def create_access_token(user_id: UUID) -> Tuple[str, str, datetime]:
     """Create a JWT access token for a user.
 
@@ -115,11 +159,45 @@ def create_access_token(user_id: UUID) -> Tuple[str, str, datetime]:
     return token, jti, expire
 
 
+def parse_bearer(header: Optional[str]) -> Optional[str]:
+    """Extract the token from an ``Authorization: Bearer <token>`` header.
+
+    The scheme is matched case-insensitively. Oversized or malformed
+    headers are rejected before they reach the JWT library.
+    """
+    if not header or len(header) > MAX_AUTH_HEADER_LENGTH:
+        return None
+    m = _BEARER(header)
+    return m.group(1) if m else None
+
+
+# In-process cache of verified tokens (token -> claims), so repeat requests
+# from an active client skip the signature check. Only valid tokens are
+# cached; expiry is rechecked on every hit and revocation is still checked
+# against the blacklist by the caller.
+_claims_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+
 def decode_access_token(token: str) -> Optional[Tuple[UUID, str, datetime]]:
     """Decode and validate a JWT token.
 
     Returns: (user_id, jti, expires_at) or None if invalid.
     """
+    claims = _claims_cache.get(token)
+    if claims is not None:
+        if claims[2] > datetime.now(timezone.utc):
+            return claims
+        _claims_cache.pop(token, None)
+        return None
+
+    claims = _decode_access_token(token)
+    if claims is not None:
+        _claims_cache[token] = claims
+    return claims
+
+
+def _decode_access_token(token: str) -> Optional[Tuple[UUID, str, datetime]]:
+    """Verify a JWT's signature and expiry and extract its claims."""
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("sub")
@@ -147,32 +225,39 @@ async def get_user_by_id(db: AsyncSession, user_id: UUID) -> Optional[User]:
 
 async def register_user(db: AsyncSession, user_data: UserCreate) -> TokenResponse:
     """Register a new user and return a JWT token."""
-    # Check if email already exists
-    existing_user = await get_user_by_email(db, user_data.email)
-    if existing_user:
-        raise AuthError("Email already registered", status_code=400)
-
     # Validate password length
     if len(user_data.password) < 8:
         raise AuthError("Password must be at least 8 characters", status_code=400)
 
-    # Create new user
-    user = User(
-        email=user_data.email.lower(),
-        password_hash=hash_password(user_data.password),
-        name=user_data.name.strip(),
-    )
+    # Cheap indexed check first, so repeat sign-ups for a taken email don't
+    # each pay for an argon2id hash
+    existing = await db.execute(select(User.id).where(User.email == user_data.email).limit(1))
+    if existing.first() is not None:
+        raise AuthError("Email already registered", status_code=400)
 
-    db.add(user)
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING - the unique email index
+    # still decides concurrent sign-ups that both pass the check above
+    result = await db.execute(
+        insert(User)
+        .values(
+            email=user_data.email,  # Lowercased by UserCreate
+            password_hash=await hash_password(user_data.password),
+            name=user_data.name.strip(),
+        )
+        .on_conflict_do_nothing(index_elements=[User.email])
+        .returning(User.id, User.email, User.name, User.created_at)
+    )
+    row = result.one_or_none()
+    if row is None:
+        raise AuthError("Email already registered", status_code=400)
     await db.commit()
-    await db.refresh(user)
 
     # Generate token
-    token, _, _ = create_access_token(user.id)
+    token, _, _ = create_access_token(row.id)
 
     return TokenResponse(
         access_token=token,
-        user=UserResponse.model_validate(user)
+        user=UserResponse.model_validate(row)
     )
 
 
@@ -180,9 +265,14 @@ async def login_user(db: AsyncSession, credentials: UserLogin) -> TokenResponse:
     """Authenticate a user and return a JWT token."""
     user = await get_user_by_email(db, credentials.email)
 
-    if not user or not verify_password(credentials.password, user.password_hash):
+    if not user or not await verify_password(credentials.password, user.password_hash):
         raise AuthError("Invalid email or password", status_code=401)
 
+    # Upgrade legacy bcrypt hashes while we have the plain password
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await hash_password(credentials.password)
+        await db.commit()
+
     # Generate token
     token, _, _ = create_access_token(user.id)
 
@@ -192,12 +282,63 @@ async def login_user(db: AsyncSession, credentials: UserLogin) -> TokenResponse:
     )
 
 
+# In-process cache of blacklist lookups (jti -> revoked). Revocations made by
+# this worker are visible immediately; other workers see them within the TTL.
+_blacklist_cache: TTLCache = TTLCache(maxsize=10_000, ttl=60)
+
+
+# Every unexpired revoked jti, reloaded by a background task (see
+# refresh_revoked_jtis). While the snapshot is fresh, blacklist checks are
+# a set lookup with no DB round trip; if refreshing stops (e.g. the DB is
+# down) lookups fall back to the cached per-jti query.
+REVOKED_JTIS_REFRESH_SECONDS = 60
+_revoked_jtis: set = set()
+_revoked_jtis_loaded_at: Optional[float] = None
+
+
+async def refresh_revoked_jtis(db: AsyncSession) -> int:
+    """Reload the in-process snapshot of revoked jtis.
+
+    Returns: number of revoked, unexpired tokens.
+    """
+    global _revoked_jtis, _revoked_jtis_loaded_at
+    loaded_at = time.monotonic()
+    previous = set(_revoked_jtis)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    result = await db.execute(
+        select(TokenBlacklist.jti).where(TokenBlacklist.expires_at >= now)
+    )
+    revoked = set(result.scalars().all())
+    # Keep tokens this worker revoked while the query was running
+    revoked.update(_revoked_jtis - previous)
+    _revoked_jtis = revoked
+    _revoked_jtis_loaded_at = loaded_at
+    return len(_revoked_jtis)
+
+
+def _revoked_jtis_fresh() -> bool:
+    # Allow one missed refresh before distrusting the snapshot
+    return (
+        _revoked_jtis_loaded_at is not None
+        and time.monotonic() - _revoked_jtis_loaded_at < 2 * REVOKED_JTIS_REFRESH_SECONDS
+    )
+
+
 async def is_token_blacklisted(db: AsyncSession, jti: str) -> bool:
     """Check if a token is blacklisted."""
+    if _revoked_jtis_fresh():
+        return jti in _revoked_jtis
+    
+    cached = _blacklist_cache.get(jti)
+    if cached is not None:
+        return cached
+    
     result = await db.execute(
-        select(TokenBlacklist).where(TokenBlacklist.jti == jti)
+        select(TokenBlacklist.jti).where(TokenBlacklist.jti == jti)
     )
-    return result.scalar_one_or_none() is not None
+    revoked = result.scalar_one_or_none() is not None
+    _blacklist_cache[jti] = revoked
+    return revoked
 
 
 async def blacklist_token(db: AsyncSession, jti: str, expires_at: datetime) -> None:
@@ -214,22 +355,60 @@ async def blacklist_token(db: AsyncSession, jti: str, expires_at: datetime) -> N
         await db.commit()
     except Exception:
         await db.rollback()  # Already exists, ignore
+    _blacklist_cache[jti] = True
+    _revoked_jtis.add(jti)
+    for token in [token for token, claims in _claims_cache.items() if claims[1] == jti]:
+        _claims_cache.pop(token, None)
 
 
-async def get_current_user(db: AsyncSession, token: str) -> User:
-    """Get the current user from a JWT token."""
-    decoded = decode_access_token(token)
-    if not decoded:
+async def purge_expired_tokens(db: AsyncSession) -> int:
+    """Delete blacklist entries whose tokens have expired anyway.
+
+    Returns: number of rows removed.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    result = await db.execute(
+        delete(TokenBlacklist).where(TokenBlacklist.expires_at < now)
+    )
+    await db.commit()
+    return result.rowcount or 0
+
+
+async def get_user_id_from_claims(
+    db: AsyncSession,
+    claims: Optional[Tuple[UUID, str, datetime]],
+) -> UUID:
+    """Validate decoded token claims and return the user id.
+
+    Only the (cached) blacklist is consulted - the users table is not
+    touched, for callers that just need the id.
+    """
+    if not claims:
         raise AuthError("Invalid or expired token", status_code=401)
 
-    user_id, jti, _ = decoded
+    user_id, jti, _ = claims
 
     # Check blacklist
     if await is_token_blacklisted(db, jti):
         raise AuthError("Token has been revoked", status_code=401)
 
+    return user_id
+
+
+async def get_user_from_claims(
+    db: AsyncSession,
+    claims: Optional[Tuple[UUID, str, datetime]],
+) -> User:
+    """Get the user for already-decoded token claims (see decode_access_token)."""
+    user_id = await get_user_id_from_claims(db, claims)
+
     user = await get_user_by_id(db, user_id)
     if not user:
         raise AuthError("User not found", status_code=401)
 
     return user
+
+
+async def get_current_user(db: AsyncSession, token: str) -> User:
+    """Get the current user from a JWT token."""
+    return await get_user_from_claims(db, decode_access_token(token))
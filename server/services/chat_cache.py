@@ -0,0 +1,181 @@
+"""Semantic response cache for follow-up chat questions.
+
+Students working on the same coursework ask near-identical questions
+("what's the deadline?", "which language can I use?"). Answers are stored
+in a dedicated Qdrant collection keyed by the question embedding and
+scoped by the RAG collection name:
+
+    similarity >= CHAT_CACHE_HIT_THRESHOLD     -> reuse the cached answer
+    CHAT_CACHE_VERIFY_THRESHOLD .. HIT         -> ask the fast LLM whether the
+                                                  cached answer still fits
+    below CHAT_CACHE_VERIFY_THRESHOLD          -> miss, run the full pipeline
+
+Entries for a collection are dropped whenever its source material
+changes (new upload, roadmap edit, coursework deletion). The Qdrant
+client is synchronous, so calls are pushed onto a worker thread. All
+helpers swallow errors - a cache failure must never fail a chat turn.
+"""
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PayloadSchemaType,
+    PointStruct,
+    VectorParams,
+)
+
+from server.services.langchain_service import gemini_slot, get_langchain_service
+from server.services.vector_store import aembed_queries, get_vector_store
+
+CACHE_COLLECTION = "chat_response_cache"
+HIT_THRESHOLD = float(os.getenv("CHAT_CACHE_HIT_THRESHOLD", "0.92"))
+VERIFY_THRESHOLD = float(os.getenv("CHAT_CACHE_VERIFY_THRESHOLD", "0.80"))
+
+VERIFIER_PROMPT = """Does the answer below fully and correctly address the question?
+Reply with only "yes" or "no".
+
+Question: {question}
+
+Answer: {answer}"""
+
+_collection_ready = False
+
+
+def _scope_filter(collection_name: str) -> Filter:
+    return Filter(
+        must=[FieldCondition(key="collection_name", match=MatchValue(value=collection_name))]
+    )
+
+
+def _ensure_cache_collection(vector_size: int) -> None:
+    """Create the cache collection (and its payload index) on first use."""
+    global _collection_ready
+    if _collection_ready:
+        return
+
+    client = get_vector_store().client
+    if client.collection_exists(CACHE_COLLECTION):
+        # Entries embedded at another size (EMBEDDING_DIMENSIONS changed)
+        # can't be searched; cached answers are disposable, so start over
+        if client.get_collection(CACHE_COLLECTION).config.params.vectors.size != vector_size:
+            client.delete_collection(CACHE_COLLECTION)
+    if not client.collection_exists(CACHE_COLLECTION):
+        client.create_collection(
+            collection_name=CACHE_COLLECTION,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+        )
+        client.create_payload_index(
+            collection_name=CACHE_COLLECTION,
+            field_name="collection_name",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+    _collection_ready = True
+
+
+def _search(collection_name: str, vector: List[float]) -> Optional[Tuple[float, Dict[str, Any]]]:
+    _ensure_cache_collection(len(vector))
+    points = get_vector_store().client.query_points(
+        collection_name=CACHE_COLLECTION,
+        query=vector,
+        query_filter=_scope_filter(collection_name),
+        limit=1,
+        with_payload=True,
+    ).points
+    if not points:
+        return None
+    return points[0].score, points[0].payload
+
+
+async def _verify(question: str, answer: str) -> bool:
+    """Cheap yes/no check for gray-zone matches."""
+    llm = get_langchain_service().get_llm(fast=True)
+    async with gemini_slot(fast=True):
+        reply = await llm.ainvoke(VERIFIER_PROMPT.format(question=question, answer=answer))
+    return str(reply.content).strip().lower().startswith("yes")
+
+
+async def lookup_chat_response(
+    collection_name: str,
+    question: str,
+) -> Tuple[Optional[List[float]], Optional[Dict[str, Any]]]:
+    """
+    Look up a cached answer for a question.
+
+    Args:
+        collection_name: RAG collection the question is scoped to
+        question: The user's question
+
+    Returns:
+        (question embedding, cached result or None). The embedding is
+        returned so a miss can be stored without embedding twice; it is
+        None if embedding failed.
+    """
+    try:
+        vector = (await aembed_queries([question]))[question]
+    except Exception as e:
+        print(f"Chat cache embedding failed: {e}")
+        return None, None
+
+    try:
+        match = await asyncio.to_thread(_search, collection_name, vector)
+        if match is None:
+            return vector, None
+
+        score, payload = match
+        if score >= HIT_THRESHOLD:
+            return vector, payload["result"]
+        if score >= VERIFY_THRESHOLD and await _verify(question, payload["result"]["answer"]):
+            return vector, payload["result"]
+    except Exception as e:
+        print(f"Chat cache lookup failed: {e}")
+
+    return vector, None
+
+
+async def store_chat_response(
+    collection_name: str,
+    question: str,
+    vector: List[float],
+    result: Dict[str, Any],
+) -> None:
+    """Store an answer (answer, sources, images) for later reuse."""
+    point = PointStruct(
+        id=str(uuid.uuid4()),
+        vector=vector,
+        payload={
+            "collection_name": collection_name,
+            "question": question,
+            "result": result,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        },
+    )
+    try:
+        await asyncio.to_thread(
+            get_vector_store().client.upsert,
+            collection_name=CACHE_COLLECTION,
+            points=[point],
+        )
+    except Exception as e:
+        print(f"Chat cache store failed: {e}")
+
+
+async def invalidate_chat_responses(collection_name: str) -> None:
+    """Drop every cached answer for a collection."""
+    client = get_vector_store().client
+    try:
+        if await asyncio.to_thread(client.collection_exists, CACHE_COLLECTION):
+            await asyncio.to_thread(
+                client.delete,
+                collection_name=CACHE_COLLECTION,
+                points_selector=_scope_filter(collection_name),
+            )
+    except Exception as e:
+        print(f"Chat cache invalidation failed: {e}")
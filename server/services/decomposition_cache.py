@@ -0,0 +1,222 @@
+"""Response-level cache for coursework decompositions.
+
+Keyed by a hash of the raw PDF bytes plus the decomposer prompt
+fingerprint, so a prompt change automatically invalidates old entries.
+A second key over the extracted text (text_cache_key) shares the table.
+Each helper opens its own short-lived session so no pooled connection is
+held open across the (slow) LLM call.
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Optional, Union
+
+from sqlalchemy import select, delete, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from server.database import async_session_maker
+from server.models.decomposition_cache import DecompositionCache
+from server.models.schemas import DecompositionResponse, DECOMPOSITION_ADAPTER
+from server.prompts.decomposer import PROMPT_FINGERPRINT
+
+# How long a cached decomposition stays valid
+CACHE_TTL_DAYS = int(os.getenv("DECOMPOSITION_CACHE_TTL_DAYS", "30"))
+
+# Semantic layer: near-duplicate specs (whitespace edits, renumbered pages)
+# reuse a cached decomposition when their text fingerprints embed close
+# enough. Opt-in - a false hit hands a student another spec's guide, so the
+# threshold is strict and lengths must also agree.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_CACHE_COLLECTION = "decomposition_fingerprints"
+# Allowed relative difference in normalized text length for a semantic hit
+SEMANTIC_CACHE_MAX_LENGTH_DELTA = 0.05
+_FINGERPRINT_EDGE_CHARS = 2048
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def decomposition_cache_key(pdf_content: Union[bytes, BinaryIO]) -> str:
+    """
+    Cache key for a PDF under the current prompt version.
+    
+    Accepts the bytes or a binary file positioned at the start (hashed
+    in chunks with hashlib.file_digest).
+    """
+    if isinstance(pdf_content, bytes):
+        digest = hashlib.sha256(pdf_content)
+    else:
+        digest = hashlib.file_digest(pdf_content, "sha256")
+    digest.update(PROMPT_FINGERPRINT.encode("ascii"))
+    return digest.hexdigest()
+
+
+def text_cache_key(pdf_text: str) -> str:
+    """
+    Cache key for extracted PDF text under the current prompt and model.
+    
+    Catches re-exports of the same spec whose bytes differ (new metadata,
+    re-saved from another viewer) but whose text - all the LLM sees - doesn't.
+    Fits the same 64-char column as decomposition_cache_key.
+    """
+    digest = hashlib.sha256(b"text\0")
+    digest.update(os.getenv("GEMINI_MODEL", "gemini-2.0-flash").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(PROMPT_FINGERPRINT.encode("ascii"))
+    digest.update(pdf_text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def is_cacheable(decomposition: DecompositionResponse) -> bool:
+    """Don't cache fallback results where task extraction failed."""
+    return "tasks" not in decomposition.extraction_warnings
+
+
+async def get_cached_decomposition(cache_key: str) -> Optional[DecompositionResponse]:
+    """Return a cached decomposition, or None on miss/expiry/error."""
+    try:
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(DecompositionCache.decomposition).where(
+                    DecompositionCache.cache_key == cache_key,
+                    DecompositionCache.expires_at > _utcnow(),
+                )
+            )
+            data = result.scalar_one_or_none()
+    except Exception as e:
+        print(f"Decomposition cache lookup failed: {e}")
+        return None
+    
+    if data is None:
+        return None
+    return DECOMPOSITION_ADAPTER.validate_python(data)
+
+
+async def store_decomposition(cache_key: str, decomposition: DecompositionResponse) -> None:
+    """Store a decomposition; concurrent writers for the same key are ignored."""
+    try:
+        async with async_session_maker() as session:
+            await session.execute(
+                insert(DecompositionCache)
+                .values(
+                    cache_key=cache_key,
+                    prompt_fingerprint=PROMPT_FINGERPRINT,
+                    decomposition=decomposition.model_dump(mode="json"),
+                    expires_at=_utcnow() + timedelta(days=CACHE_TTL_DAYS),
+                )
+                .on_conflict_do_nothing(index_elements=[DecompositionCache.cache_key])
+            )
+            await session.commit()
+    except Exception as e:
+        print(f"Decomposition cache store failed: {e}")
+
+
+async def purge_stale_decompositions() -> int:
+    """Delete expired entries and entries produced by an older prompt.
+
+    Returns: number of rows removed.
+    """
+    async with async_session_maker() as session:
+        result = await session.execute(
+            delete(DecompositionCache).where(
+                or_(
+                    DecompositionCache.expires_at < _utcnow(),
+                    DecompositionCache.prompt_fingerprint != PROMPT_FINGERPRINT,
+                )
+            )
+        )
+        await session.commit()
+        return result.rowcount or 0
+
+
+def _fingerprint(pdf_text: str) -> tuple[str, int]:
+    """Whitespace-normalized (first/last 2KB + length) text to embed, and the length."""
+    text = " ".join(pdf_text.split())
+    edge = _FINGERPRINT_EDGE_CHARS
+    return f"{len(text)}\n{text[:edge]}\n...\n{text[-edge:]}", len(text)
+
+
+async def find_similar_decomposition(pdf_text: str) -> Optional[DecompositionResponse]:
+    """
+    Look up a cached decomposition for a near-duplicate of this text.
+    
+    Returns None when the semantic cache is disabled, on miss, or on error.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    
+    from qdrant_client.models import FieldCondition, Filter, MatchValue
+    from server.services.langchain_service import get_langchain_service
+    from server.services.vector_store import get_vector_store
+    
+    fingerprint, length = _fingerprint(pdf_text)
+    try:
+        vector = await get_langchain_service().get_embeddings().aembed_query(
+            fingerprint, task_type="SEMANTIC_SIMILARITY",
+        )
+        store = get_vector_store()
+        if not await asyncio.to_thread(store.client.collection_exists, SEMANTIC_CACHE_COLLECTION):
+            return None
+        response = await asyncio.to_thread(
+            store.client.query_points,
+            collection_name=SEMANTIC_CACHE_COLLECTION,
+            query=vector,
+            limit=1,
+            score_threshold=SEMANTIC_CACHE_THRESHOLD,
+            query_filter=Filter(must=[
+                FieldCondition(key="prompt_fingerprint", match=MatchValue(value=PROMPT_FINGERPRINT)),
+            ]),
+            with_payload=True,
+        )
+    except Exception as e:
+        print(f"Semantic cache lookup failed: {e}")
+        return None
+    
+    if not response.points:
+        return None
+    payload = response.points[0].payload or {}
+    cached_length = payload.get("length", 0)
+    if abs(cached_length - length) > SEMANTIC_CACHE_MAX_LENGTH_DELTA * max(cached_length, length):
+        return None
+    # Expired or purged entries miss here as well
+    return await get_cached_decomposition(payload["cache_key"])
+
+
+async def remember_fingerprint(pdf_text: str, cache_key: str) -> None:
+    """Index a stored decomposition's text fingerprint for semantic lookups."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return
+    
+    from qdrant_client.models import PointStruct
+    from server.services.langchain_service import get_langchain_service
+    from server.services.vector_store import get_vector_store
+    
+    fingerprint, length = _fingerprint(pdf_text)
+    try:
+        vector = await get_langchain_service().get_embeddings().aembed_query(
+            fingerprint, task_type="SEMANTIC_SIMILARITY",
+        )
+        store = get_vector_store()
+        # Creates the collection on first use
+        await asyncio.to_thread(store.get_or_create_collection, SEMANTIC_CACHE_COLLECTION)
+        await asyncio.to_thread(
+            store.client.upsert,
+            collection_name=SEMANTIC_CACHE_COLLECTION,
+            points=[PointStruct(
+                # Same key, same point - re-storing overwrites
+                id=str(uuid.UUID(cache_key[:32])),
+                vector=vector,
+                payload={
+                    "cache_key": cache_key,
+                    "length": length,
+                    "prompt_fingerprint": PROMPT_FINGERPRINT,
+                },
+            )],
+        )
+    except Exception as e:
+        print(f"Semantic cache store failed: {e}")
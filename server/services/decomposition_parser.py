@@ -0,0 +1,342 @@
+"""Parsing and validation of LLM decomposition output.
+
+Shared by the analysis agent and the legacy decomposer. JSON is parsed
+with orjson and only repaired when malformed. Rows are normalized (empty
+values dropped, per-field defaults filled in, task priorities mapped to
+levels) and then validated in a single pydantic-core pass instead of one
+model constructor per row.
+"""
+
+import json
+import re
+from typing import Any, Dict, List
+
+import orjson
+from pydantic import ValidationError
+
+from server.models.schemas import DecompositionResponse, DECOMPOSITION_ADAPTER
+
+
+# A string literal (closing quote optional - the response may be truncated).
+# Splitting on it separates string contents from structure in one C-level
+# pass, so repair_json never walks the text char by char.
+_JSON_STRING = re.compile(r'("(?:[^"\\]|\\.)*\\?"?)', re.DOTALL)
+_CLOSED_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_BRACKET = re.compile(r'[{}\[\]]')
+_CLOSERS = {"{": "}", "[": "]"}
+_STRING_ESCAPES = str.maketrans({"\n": "\\n", "\r": "\\r", "\t": "\\t"})
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def _loads(text: str) -> Any:
+    """
+    Parse JSON with orjson.
+    
+    Falls back to the stdlib parser, which also accepts NaN/Infinity, so
+    a response orjson rejects for those alone still parses. Both raise
+    json.JSONDecodeError subclasses.
+    """
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        return json.loads(text)
+
+
+def _escape_strings(strings: List[str]) -> List[str]:
+    """Escape control characters in string tokens with a single translate call."""
+    joined = "\0".join(strings)
+    if joined.count("\0") != len(strings) - 1:
+        # A string contains NUL itself - can't use it as the separator
+        return [string.translate(_STRING_ESCAPES) for string in strings]
+    return joined.translate(_STRING_ESCAPES).split("\0")
+
+
+def repair_json(text: str) -> str:
+    """
+    Repair malformed JSON from AI responses.
+    Handles: unterminated strings, missing brackets, truncation, markdown fences.
+    Splits on string literals with a regex to properly track string boundaries.
+    """
+    if not text:
+        return "{}"
+
+    text = text.strip()
+
+    # Already valid - nothing to repair
+    try:
+        if isinstance(orjson.loads(text), dict):
+            return text
+    except orjson.JSONDecodeError:
+        pass
+
+    # Remove markdown fences
+    if text.startswith("```"):
+        first_nl = text.find('\n')
+        if first_nl > 0:
+            text = text[first_nl + 1:]
+        if "```" in text:
+            text = text[:text.rfind("```")]
+        text = text.strip()
+
+    # Find JSON start
+    start = text.find('{')
+    if start == -1:
+        return "{}"
+    text = text[start:]
+
+    # Alternating [outside, string, outside, ..., outside] segments
+    parts = _JSON_STRING.split(text)
+    
+    # Track brackets outside strings. Quotes only occur inside string
+    # tokens, so they can delimit the segments in one joined string.
+    outside = '"'.join(parts[0::2])
+    stack = []  # Track open brackets: '{' or '['
+    root_end = None
+    for match in _BRACKET.finditer(outside):
+        token = match.group()
+        if token == '{' or token == '[':
+            stack.append(token)
+        elif stack and _CLOSERS[stack[-1]] == token:
+            stack.pop()
+        
+        # Stop if we've closed the root object
+        if not stack:
+            root_end = match.end()
+            break
+    
+    in_string = False
+    if root_end is not None:
+        # Drop everything after the root object
+        segment = outside.count('"', 0, root_end)
+        parts = parts[:2 * segment + 1]
+        parts[-1] = parts[-1][:root_end - (outside.rfind('"', 0, root_end) + 1)]
+    elif len(parts) > 1:
+        # No closing quote means the text was cut off mid-string
+        in_string = not _CLOSED_STRING.fullmatch(parts[-2])
+    
+    # Replace literal newlines/tabs in strings with escaped versions
+    if len(parts) > 1:
+        parts[1::2] = _escape_strings(parts[1::2])
+    json_str = ''.join(parts)
+
+    # Fix unterminated string
+    if in_string:
+        json_str += '"'
+
+    # Close any remaining open brackets (in reverse order)
+    while stack:
+        json_str += _CLOSERS[stack.pop()]
+
+    # Validate and attempt parse
+    try:
+        _loads(json_str)
+        return json_str
+    except json.JSONDecodeError:
+        # Try to fix common issues
+        # Remove trailing comma before closing bracket
+        json_str = _TRAILING_COMMA.sub(r'\1', json_str)
+        # Remove any content after the last valid closing brace
+        last_brace = json_str.rfind('}')
+        if last_brace > 0:
+            json_str = json_str[:last_brace + 1]
+        # Try again
+        try:
+            _loads(json_str)
+            return json_str
+        except json.JSONDecodeError:
+            # Ultimate fallback - return empty object
+            print(f"JSON repair failed. Length: {len(json_str)}, First 200: {json_str[:200]}")
+            return "{}"
+
+
+def loads_llm_json(text: str) -> dict:
+    """
+    Parse the JSON object in an AI response.
+    
+    Well-formed output (the common case) goes straight to orjson; only
+    responses that fail to parse pay for repair_json's full scan.
+    
+    Raises:
+        json.JSONDecodeError: If even the repaired text doesn't parse
+    """
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try:
+        data = orjson.loads(stripped)
+        if isinstance(data, dict):
+            return data
+    except orjson.JSONDecodeError:
+        pass
+    
+    return _loads(repair_json(text))
+
+
+def loads_truncated_json(text: str, max_attempts: int = 50) -> dict:
+    """
+    Recover the complete part of a response cut off mid-generation.
+    
+    repair_json can close open brackets but not a dangling key or half a
+    value, so retry from each of the last closing brackets until one
+    prefix repairs into a non-empty object.
+    """
+    end = len(text)
+    for _ in range(max_attempts):
+        end = max(text.rfind("}", 0, end), text.rfind("]", 0, end))
+        if end <= 0:
+            break
+        try:
+            data = loads_llm_json(text[:end + 1])
+        except json.JSONDecodeError:
+            continue
+        if data:
+            return data
+    return {}
+
+
+# Defaults for required fields the LLM sometimes omits, per list field
+ROW_DEFAULTS = {
+    "tasks": lambda i: {
+        "task_id": f"t{i+1}",
+        "title": "Untitled Task",
+        "description": "",
+        "estimated_time": "Unknown",
+    },
+    "milestones": lambda i: {"id": f"m{i+1}", "title": "Untitled Milestone"},
+    "terminology": lambda i: {"term": "", "definition": ""},
+    "marking_criteria": lambda i: {"component": "", "description": ""},
+    "get_started_steps": lambda i: {"step_number": i + 1, "title": "", "description": ""},
+    "prioritization_tiers": lambda i: {"tier": "", "description": "", "time_estimate": ""},
+    "recommended_schedule": lambda i: {"week": i + 1, "title": "", "hours_estimate": 0},
+    "directory_structure": lambda i: {"path": "", "type": "file"},
+}
+
+# Substrings of textual priorities and the level they map to
+PRIORITY_MAP = {
+    'essential': 0,
+    'critical': 0,
+    'high': 0,
+    'must': 0,
+    'strong': 1,
+    'important': 1,
+    'medium': 1,
+    'should': 1,
+    'excellence': 2,
+    'bonus': 2,
+    'optional': 2,
+    'low': 2,
+    'nice': 2,
+}
+
+# All keywords in one pass. The lookahead also finds overlapping matches, and
+# since levels only increase through PRIORITY_MAP, the lowest matched level is
+# the one the old first-key-wins loop picked.
+_PRIORITY_KEYWORDS = re.compile(
+    "(?=(" + "|".join(map(re.escape, PRIORITY_MAP)) + "))"
+)
+
+
+def is_empty(value: Any) -> bool:
+    """Nulls, empty strings and empty lists are treated as missing."""
+    return value is None or value == "" or value == []
+
+
+def parse_priority(priority_value) -> int | None:
+    """
+    Parse priority value - handles both integers and strings.
+    
+    Strings like 'essential', 'strong', 'excellence' are converted to priority levels:
+    - 'essential' / 'high' / 'critical' -> 0 (highest)
+    - 'strong' / 'medium' / 'important' -> 1
+    - 'excellence' / 'low' / 'optional' / 'bonus' -> 2
+    """
+    if priority_value is None:
+        return None
+    
+    # If already an integer, return it
+    if isinstance(priority_value, int):
+        return priority_value
+    
+    # Try to convert string to int first
+    try:
+        return int(priority_value)
+    except (ValueError, TypeError):
+        pass
+    
+    # Map string values to priority levels - usually a bare keyword
+    priority_str = str(priority_value).lower().strip()
+    level = PRIORITY_MAP.get(priority_str)
+    if level is not None:
+        return level
+    
+    # Otherwise the highest level it mentions; default to medium priority
+    return min(
+        (PRIORITY_MAP[match.group(1)] for match in _PRIORITY_KEYWORDS.finditer(priority_str)),
+        default=1,
+    )
+
+
+def prepare_row(field: str, index: int, row: Any) -> Dict[str, Any] | None:
+    """Drop empty values from an LLM row and fill in per-field defaults."""
+    if not isinstance(row, dict):
+        return None
+    prepared = {**ROW_DEFAULTS[field](index), **{k: v for k, v in row.items() if not is_empty(v)}}
+    if field == "tasks":
+        prepared["priority"] = parse_priority(prepared.get("priority"))
+    return prepared
+
+
+def validate_decomposition(data: Dict[str, Any]) -> DecompositionResponse:
+    """
+    Validate parsed LLM JSON into a DecompositionResponse.
+    
+    Invalid rows and fields are dropped rather than failing the whole
+    response. Extraction warnings and fallbacks are left to the caller.
+    """
+    # Empty top-level values fall back to the model defaults
+    prepared = {k: v for k, v in data.items() if not is_empty(v)}
+    for field in ROW_DEFAULTS:
+        rows = prepared.get(field)
+        if isinstance(rows, list):
+            rows = (prepare_row(field, i, row) for i, row in enumerate(rows))
+            prepared[field] = [row for row in rows if row is not None]
+    prepared.setdefault("tasks", [])
+    
+    # Validate everything in one pydantic-core pass. Rows that fail are
+    # dropped (matching the old per-row try/except) and the rest revalidated.
+    dropped: List[str] = []
+    while True:
+        try:
+            result = DECOMPOSITION_ADAPTER.validate_python(prepared)
+            break
+        except ValidationError as e:
+            prepared = _drop_invalid(prepared, e, dropped)
+    
+    # One line per response, however many rows were dropped
+    if dropped:
+        print(f"Dropped {len(dropped)} invalid entries from LLM output: {', '.join(dropped[:10])}")
+    return result
+
+
+def _drop_invalid(prepared: Dict[str, Any], error: ValidationError, dropped: List[str]) -> Dict[str, Any]:
+    """Remove the rows/fields a ValidationError points at, recording them in dropped."""
+    bad_rows: Dict[str, set] = {}
+    bad_fields = set()
+    for err in error.errors():
+        loc = err["loc"]
+        if len(loc) > 1 and isinstance(loc[1], int) and loc[0] in ROW_DEFAULTS:
+            bad_rows.setdefault(loc[0], set()).add(loc[1])
+        elif loc and loc[0] != "tasks":
+            bad_fields.add(loc[0])
+        else:
+            # "tasks" itself is malformed (e.g. not a list) - fall back
+            prepared["tasks"] = []
+            dropped.append("tasks")
+    
+    for field, indices in bad_rows.items():
+        dropped.extend(f"{field}[{i}]" for i in sorted(indices))
+        prepared[field] = [row for i, row in enumerate(prepared[field]) if i not in indices]
+    for field in bad_fields:
+        dropped.append(str(field))
+        prepared.pop(field, None)
+    return prepared
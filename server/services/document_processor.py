@@ -1,10 +1,34 @@
 """Document processing service with semantic chunking."""
 
-from typing import List, Dict, Optional
+import os
+from bisect import bisect_right
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
 import hashlib
+import re
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+from server.services.pdf_parser import extract_pdf_content, extract_text_from_pdf
+from server.services.vision_service import get_vision_service
+
+
+# Concurrent Gemini Vision calls per document
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "4"))
+
+# Page markers inserted by pdf_parser ("[Page 3]")
+_PAGE_REF_RE = re.compile(r'\[Page (\d+)\]')
+
+
+def _chunk_id_hasher(prefix: str = ""):
+    """Hasher for chunk IDs; copy() it to hash many keys sharing a prefix."""
+    return hashlib.blake2b(prefix.encode(), digest_size=6)
+
+
+def _chunk_id(key: str) -> str:
+    """Stable 12-hex-char chunk ID (not security relevant - blake2b is just cheaper than md5)."""
+    return _chunk_id_hasher(key).hexdigest()
+
 
 class DocumentProcessor:
     """Process and chunk documents for vector storage."""
@@ -21,6 +45,7 @@ class DocumentProcessor:
             chunk_size: Target size of each chunk in characters
             chunk_overlap: Overlap between chunks for context continuity
         """
+        self.chunk_overlap = chunk_overlap
         self.splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
@@ -53,22 +78,35 @@ class DocumentProcessor:
         
         # Split into chunks
         chunks = self.splitter.split_text(text)
+        positions, pages = self.precompute_page_index(self.extract_page_references(text))
         
         documents = []
+        total_chunks = len(chunks)
+        # Hash the "<document_id>:" prefix once; each ID only adds its index
+        id_prefix = _chunk_id_hasher(f"{document_id}:")
+        index = 0
+        previous_chunk_len = 0
         for i, chunk in enumerate(chunks):
-            # Generate unique chunk ID
-            chunk_id = hashlib.md5(f"{document_id}:{i}".encode()).hexdigest()[:12]
+            # Generate unique chunk ID (same as _chunk_id(f"{document_id}:{i}"))
+            hasher = id_prefix.copy()
+            hasher.update(b"%d" % i)
+            chunk_id = hasher.hexdigest()
             
-            doc = Document(
-                page_content=chunk,
-                metadata={
-                    **base_metadata,
-                    "chunk_index": i,
-                    "chunk_id": chunk_id,
-                    "total_chunks": len(chunks),
-                },
-            )
-            documents.append(doc)
+            # Locate the chunk in the text (as LangChain's add_start_index
+            # does): chunks are in order, overlapping by at most chunk_overlap
+            found = text.find(chunk, max(0, index + previous_chunk_len - self.chunk_overlap))
+            if found != -1:
+                index = found
+            previous_chunk_len = len(chunk)
+            
+            # dict.copy() is a C-level copy; cheaper than ** unpacking
+            chunk_metadata = base_metadata.copy()
+            chunk_metadata["chunk_index"] = i
+            chunk_metadata["chunk_id"] = chunk_id
+            chunk_metadata["total_chunks"] = total_chunks
+            chunk_metadata["page_number"] = self.get_chunk_page(index, positions, pages)
+            
+            documents.append(Document(page_content=chunk, metadata=chunk_metadata))
         
         return documents
     
@@ -78,24 +116,23 @@ class DocumentProcessor:
         
         Returns dict mapping page number to character position.
         """
-        import re
         pages = {}
         
-        for match in re.finditer(r'\[Page (\d+)\]', text):
+        for match in _PAGE_REF_RE.finditer(text):
             page_num = int(match.group(1))
             pages[page_num] = match.start()
         
         return pages
     
-    def get_chunk_page(self, chunk_start: int, page_refs: Dict[int, int]) -> int:
+    def precompute_page_index(self, page_refs: Dict[int, int]) -> Tuple[List[int], List[int]]:
+        """Sort page references into parallel (positions, page numbers) lists."""
+        ordered = sorted((position, page_num) for page_num, position in page_refs.items())
+        return [position for position, _ in ordered], [page_num for _, page_num in ordered]
+    
+    def get_chunk_page(self, chunk_start: int, positions: List[int], pages: List[int]) -> int:
         """Determine which page a chunk belongs to based on position."""
-        current_page = 1
-        for page_num, position in sorted(page_refs.items()):
-            if position <= chunk_start:
-                current_page = page_num
-            else:
-                break
-        return current_page
+        i = bisect_right(positions, chunk_start) - 1
+        return pages[i] if i >= 0 else 1
 
 
 class MultimodalDocumentProcessor:
@@ -122,14 +159,16 @@ class MultimodalDocumentProcessor:
             max_images: Maximum images to process per document
             image_cache_dir: Directory to store extracted images
         """
-        from pathlib import Path
-        
         self.text_processor = DocumentProcessor(chunk_size, chunk_overlap)
         self.max_images = max_images
         self.image_cache_dir = Path(image_cache_dir) if image_cache_dir else (
             Path(__file__).parent.parent / "image_cache"
         )
     
+    def image_dir(self, document_id: str):
+        """Directory extracted images for a document are saved to."""
+        return self.image_cache_dir / document_id
+    
     def process_pdf(
         self,
         pdf_content: bytes,
@@ -147,33 +186,48 @@ class MultimodalDocumentProcessor:
         Returns:
             Tuple of (text_documents, image_documents, image_info)
         """
-        from pathlib import Path
-        from services.pdf_parser import extract_text_from_pdf, extract_images_from_pdf
-        from services.vision_service import get_vision_service
+        text_docs, image_docs, image_info, _ = self.parse_pdf(pdf_content, document_id, metadata)
+        return text_docs, image_docs, image_info
+    
+    def parse_pdf(
+        self,
+        pdf_content: bytes,
+        document_id: str,
+        metadata: Optional[Dict] = None,
+        extracted: Optional[tuple[str, List[dict]]] = None,
+    ) -> tuple[List[Document], List[Document], List[dict], str]:
+        """
+        Process PDF into text and image documents, also returning the full text.
+        
+        The text is extracted once and shared between chunking and the
+        analysis agent, instead of re-parsing via get_full_text().
+        
+        Args:
+            pdf_content: Raw PDF bytes
+            document_id: Unique document identifier
+            metadata: Additional metadata
+            extracted: (text, images) already produced by extract_pdf_content,
+                e.g. in the PDF worker pool; extracted here if omitted
         
-        # Create document-specific image directory
-        doc_image_dir = self.image_cache_dir / document_id
-        doc_image_dir.mkdir(parents=True, exist_ok=True)
+        Returns:
+            Tuple of (text_documents, image_documents, image_info, full_text)
+        """
+        # 1. Extract text and images (one PyMuPDF open)
+        if extracted is None:
+            extracted = extract_pdf_content(
+                pdf_content,
+                output_dir=str(self.image_dir(document_id)),
+                max_images=self.max_images,
+            )
+        pdf_text, images = extracted
         
-        # 1. Extract and process text
-        pdf_text = extract_text_from_pdf(pdf_content)
+        # 2. Chunk text
         text_docs = self.text_processor.process_pdf_text(
             text=pdf_text,
             document_id=document_id,
             metadata={**(metadata or {}), "content_type": "text"},
         )
         
-        # 2. Extract images
-        try:
-            images = extract_images_from_pdf(
-                pdf_content,
-                output_dir=doc_image_dir,
-                max_images=self.max_images,
-            )
-        except Exception as e:
-            print(f"Image extraction failed: {e}")
-            images = []
-        
         # 3. Generate descriptions for images using Gemini Vision
         image_docs = []
         image_info = []
@@ -181,35 +235,43 @@ class MultimodalDocumentProcessor:
         if images:
             vision = get_vision_service()
             context = metadata.get("course_name", "") if metadata else ""
+            extra_metadata = metadata or {}
+            # Image chunks are numbered after the text chunks
+            chunk_index = len(text_docs)
+            
+            # Vision calls are network-bound: describe images concurrently
+            # (repeated images once), then build documents in page order
+            descriptions = vision.describe_images(
+                [Path(img["path"]) for img in images],
+                context=context,
+                max_workers=VISION_MAX_CONCURRENCY,
+            )
             
-            for img in images:
+            for img, description in zip(images, descriptions):
                 try:
-                    img_path = Path(img["path"])
-                    description = vision.describe_image(img_path, context=context)
                     
                     # Create chunk ID for the image
-                    chunk_id = hashlib.md5(
-                        f"{document_id}:img:{img['page_number']}:{img['image_index']}".encode()
-                    ).hexdigest()[:12]
+                    chunk_id = _chunk_id(f"{document_id}:img:{img['page_number']}:{img['image_index']}")
                     
                     # Create document with image description
-                    doc = Document(
+                    image_metadata = {
+                        "document_id": document_id,
+                        "source_type": "image",
+                        "content_type": "image",
+                        "chunk_id": chunk_id,
+                        "chunk_index": chunk_index,
+                        "image_path": img["path"],
+                        "image_filename": img["filename"],
+                        "page_number": img["page_number"],
+                        "image_width": img["width"],
+                        "image_height": img["height"],
+                    }
+                    image_metadata.update(extra_metadata)
+                    image_docs.append(Document(
                         page_content=f"[Image from Page {img['page_number']}]\n{description}",
-                        metadata={
-                            "document_id": document_id,
-                            "source_type": "image",
-                            "content_type": "image",
-                            "chunk_id": chunk_id,
-                            "chunk_index": len(text_docs) + len(image_docs),
-                            "image_path": img["path"],
-                            "image_filename": img["filename"],
-                            "page_number": img["page_number"],
-                            "image_width": img["width"],
-                            "image_height": img["height"],
-                            **(metadata or {}),
-                        },
-                    )
-                    image_docs.append(doc)
+                        metadata=image_metadata,
+                    ))
+                    chunk_index += 1
                     
                     # Store image info for response
                     image_info.append({
@@ -223,10 +285,9 @@ class MultimodalDocumentProcessor:
                     print(f"Failed to process image {img.get('path')}: {e}")
                     continue
         
-        return text_docs, image_docs, image_info
+        return text_docs, image_docs, image_info, pdf_text
     
     def get_full_text(self, pdf_content: bytes) -> str:
         """Extract just the text from a PDF (for analysis agent)."""
-        from services.pdf_parser import extract_text_from_pdf
         return extract_text_from_pdf(pdf_content)
 
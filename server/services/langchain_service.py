@@ -1,12 +1,50 @@
 """LangChain service configuration for Google Gemini."""
 
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from functools import lru_cache
+from typing import AsyncIterator
+
+from aiolimiter import AsyncLimiter
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Gemini free tier allows 15 requests/min. LLM calls queue here instead
+# of hitting 429s and sitting in the client's exponential backoff.
+# Limits are per worker process.
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "14"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "5"))
+# Chat calls get their own slots so short answers never queue behind
+# decompositions. Both share the rate limiter, but at most
+# GEMINI_MAX_CONCURRENCY analysis calls can be waiting on it at once.
+GEMINI_CHAT_MAX_CONCURRENCY = int(os.getenv("GEMINI_CHAT_MAX_CONCURRENCY", "8"))
+
+# gemini-embedding-001 is trained Matryoshka-style, so its leading
+# dimensions are usable on their own: 768 keeps most of the retrieval
+# quality of the full 3072 at a quarter of the storage and distance cost.
+# After changing this, run server/scripts/reembed_collections.py to
+# migrate existing collections.
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "768"))
+
+_gemini_limiter = AsyncLimiter(GEMINI_REQUESTS_PER_MINUTE, time_period=60)
+_gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+_gemini_chat_semaphore = asyncio.Semaphore(GEMINI_CHAT_MAX_CONCURRENCY)
+
+
+@asynccontextmanager
+async def gemini_slot(fast: bool = False) -> AsyncIterator[None]:
+    """
+    Wait for a concurrency slot and a rate-limit token before an LLM call.
+    
+    Pass fast=True for chat calls (the get_llm(fast=True) model).
+    """
+    async with (_gemini_chat_semaphore if fast else _gemini_semaphore):
+        async with _gemini_limiter:
+            yield
+
 
 class LangChainService:
     """Singleton service for LangChain components."""
@@ -46,6 +84,7 @@ class LangChainService:
         self.embeddings = GoogleGenerativeAIEmbeddings(
             model="models/gemini-embedding-001",
             google_api_key=api_key,
+            output_dimensionality=EMBEDDING_DIMENSIONS,
         )
     
     def get_llm(self, fast: bool = False) -> ChatGoogleGenerativeAI:
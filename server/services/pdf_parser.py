@@ -1,8 +1,14 @@
 """PDF text extraction service using PyMuPDF."""
 
-import fitz  # PyMuPDF
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
 from pathlib import Path
-import tempfile
+from typing import Optional
+
+import fitz  # PyMuPDF
 
 
 class PDFParserError(Exception):
@@ -10,6 +16,102 @@ class PDFParserError(Exception):
     pass
 
 
+def _open_pdf(file_content: bytes) -> "fitz.Document":
+    """Open a PDF straight from memory (no temp file round trip)."""
+    try:
+        return fitz.open(stream=file_content, filetype="pdf")
+    except Exception as e:
+        raise PDFParserError(f"Invalid or corrupted PDF file: {e}")
+
+
+# Plain reading-order text: ligatures are expanded ("ﬁ" -> "fi", which also
+# keeps words searchable) and odd whitespace becomes plain spaces
+PAGE_TEXT_FLAGS = (
+    fitz.TEXTFLAGS_TEXT
+    & ~fitz.TEXT_PRESERVE_LIGATURES
+    & ~fitz.TEXT_PRESERVE_WHITESPACE
+)
+
+
+def _page_texts(doc: "fitz.Document", pages: range) -> list[tuple[int, str]]:
+    """(page number, page-tagged text) for the non-empty pages in range."""
+    return [
+        (index + 1, f"[Page {index + 1}]\n{page_text}")
+        for index in pages
+        # isspace scans without building a stripped copy of the page
+        if (page_text := doc[index].get_text("text", flags=PAGE_TEXT_FLAGS)) and not page_text.isspace()
+    ]
+
+
+def _join_pages(text_parts: list[tuple[int, str]]) -> str:
+    if not text_parts:
+        raise PDFParserError("No text could be extracted from the PDF")
+    
+    return "\n\n".join(text for _, text in text_parts)
+
+
+def _extract_text(doc: "fitz.Document") -> str:
+    """Extract page-tagged text from an open document."""
+    return _join_pages(_page_texts(doc, range(doc.page_count)))
+
+
+class PDFDocument:
+    """
+    A PDF opened once from memory.
+    
+    Text, metadata and images all come from the same parse:
+    
+        with PDFDocument(content) as pdf:
+            text = pdf.text()
+            images = pdf.images(output_dir)
+    """
+    
+    def __init__(self, file_content: bytes):
+        """
+        Args:
+            file_content: Raw bytes of the PDF file
+            
+        Raises:
+            PDFParserError: If the PDF cannot be opened
+        """
+        self.doc = _open_pdf(file_content)
+    
+    def __enter__(self) -> "PDFDocument":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        self.doc.close()
+    
+    @property
+    def page_count(self) -> int:
+        return self.doc.page_count
+    
+    def text(self) -> str:
+        """Page-tagged text of all pages ("[Page N]" headers, empty pages skipped)."""
+        return _extract_text(self.doc)
+    
+    def page_texts(self, pages: range) -> list[tuple[int, str]]:
+        """(page number, page-tagged text) for the non-empty pages in range."""
+        return _page_texts(self.doc, pages)
+    
+    def metadata(self) -> dict:
+        """page_count, title, author and subject."""
+        metadata = self.doc.metadata or {}
+        return {
+            "page_count": self.doc.page_count,
+            "title": metadata.get("title", ""),
+            "author": metadata.get("author", ""),
+            "subject": metadata.get("subject", ""),
+        }
+    
+    def images(self, output_dir: Path | str, max_images: int = 10, min_size: int = 100) -> list[dict]:
+        """Save images to output_dir (see extract_images_from_pdf)."""
+        return _extract_images(self.doc, Path(output_dir), max_images, min_size)
+
+
 def extract_text_from_pdf(file_content: bytes) -> str:
     """
     Extract text content from a PDF file.
@@ -23,39 +125,13 @@ def extract_text_from_pdf(file_content: bytes) -> str:
     Raises:
         PDFParserError: If the PDF cannot be parsed
     """
-    try:
-        # Create a temporary file to work with PyMuPDF
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(file_content)
-            tmp_path = Path(tmp.name)
-        
+    with PDFDocument(file_content) as pdf:
         try:
-            # Open and extract text
-            doc = fitz.open(tmp_path)
-            
-            text_parts = []
-            for page_num, page in enumerate(doc, start=1):
-                page_text = page.get_text("text")
-                if page_text.strip():
-                    text_parts.append(f"[Page {page_num}]\n{page_text}")
-            
-            doc.close()
-            
-            if not text_parts:
-                raise PDFParserError("No text could be extracted from the PDF")
-            
-            return "\n\n".join(text_parts)
-            
-        finally:
-            # Clean up temp file
-            tmp_path.unlink(missing_ok=True)
-            
-    except fitz.FileDataError as e:
-        raise PDFParserError(f"Invalid or corrupted PDF file: {e}")
-    except Exception as e:
-        if isinstance(e, PDFParserError):
-            raise
-        raise PDFParserError(f"Failed to parse PDF: {e}")
+            return pdf.text()
+        except Exception as e:
+            if isinstance(e, PDFParserError):
+                raise
+            raise PDFParserError(f"Failed to parse PDF: {e}")
 
 
 def get_pdf_metadata(file_content: bytes) -> dict:
@@ -69,27 +145,112 @@ def get_pdf_metadata(file_content: bytes) -> dict:
         Dictionary containing PDF metadata
     """
     try:
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(file_content)
-            tmp_path = Path(tmp.name)
-        
-        try:
-            doc = fitz.open(tmp_path)
-            metadata = {
-                "page_count": doc.page_count,
-                "title": doc.metadata.get("title", ""),
-                "author": doc.metadata.get("author", ""),
-                "subject": doc.metadata.get("subject", ""),
-            }
-            doc.close()
-            return metadata
-        finally:
-            tmp_path.unlink(missing_ok=True)
-            
+        with PDFDocument(file_content) as pdf:
+            return pdf.metadata()
     except Exception:
         return {"page_count": 0, "title": "", "author": "", "subject": ""}
 
 
+# Threads writing extracted images to disk while the next one is decoded
+IMAGE_WRITE_WORKERS = 4
+
+
+def _write_file(path: Path, data: bytes) -> None:
+    """Write bytes with raw os calls (no buffered file object)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def _extract_images(
+    doc: "fitz.Document",
+    output_dir: Path,
+    max_images: int,
+    min_size: int,
+) -> list[dict]:
+    """Save images from an open document to output_dir."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Writes release the GIL, so they overlap with decoding the next image
+    with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as writer:
+        pending = _decode_images(doc, output_dir, max_images, min_size, writer)
+    
+    extracted_images = []
+    for future, info in pending:
+        try:
+            future.result()
+        except OSError as e:
+            print(f"Failed to save image {info['image_index']} from page {info['page_number']}: {e}")
+            continue
+        extracted_images.append(info)
+    
+    return extracted_images
+
+
+def _decode_images(
+    doc: "fitz.Document",
+    output_dir: Path,
+    max_images: int,
+    min_size: int,
+    writer: ThreadPoolExecutor,
+) -> list[tuple[Future, dict]]:
+    """Decode images from an open document, submitting each write to writer."""
+    pending = []  # (write future, image info)
+    image_count = 0
+    
+    for page_num in range(len(doc)):
+        if image_count >= max_images:
+            break
+        
+        # Reads the page's image list without building a Page object
+        image_list = doc.get_page_images(page_num, full=True)
+        
+        for img_index, img_info in enumerate(image_list):
+            if image_count >= max_images:
+                break
+            
+            try:
+                xref = img_info[0]
+                
+                # Extract image
+                base_image = doc.extract_image(xref)
+                image_bytes = base_image["image"]
+                image_ext = base_image["ext"]
+                width = base_image.get("width", 0)
+                height = base_image.get("height", 0)
+                
+                # Skip small/decorative images
+                if width < min_size or height < min_size:
+                    continue
+                
+                # Generate unique filename
+                image_filename = f"page{page_num + 1}_img{img_index}.{image_ext}"
+                image_path = output_dir / image_filename
+                
+                # Save image (in the background)
+                pending.append((writer.submit(_write_file, image_path, image_bytes), {
+                    "path": str(image_path),
+                    "filename": image_filename,
+                    "page_number": page_num + 1,
+                    "image_index": img_index,
+                    "width": width,
+                    "height": height,
+                }))
+                
+                image_count += 1
+                
+            except Exception as e:
+                # Skip problematic images
+                print(f"Failed to extract image {img_index} from page {page_num + 1}: {e}")
+                continue
+    
+    return pending
+
+
 def extract_images_from_pdf(
     file_content: bytes,
     output_dir: Path,
@@ -111,78 +272,150 @@ def extract_images_from_pdf(
     Raises:
         PDFParserError: If the PDF cannot be parsed
     """
-    try:
-        # Ensure output directory exists
-        output_dir.mkdir(parents=True, exist_ok=True)
+    with PDFDocument(file_content) as pdf:
+        try:
+            return pdf.images(output_dir, max_images, min_size)
+        except Exception as e:
+            raise PDFParserError(f"Failed to extract images: {e}")
+
+
+def extract_pdf_content(
+    file_content: bytes,
+    output_dir: str,
+    max_images: int = 10,
+    min_size: int = 100,
+) -> tuple[str, list[dict]]:
+    """
+    Extract text and images from a PDF with a single open.
+    
+    Module-level and free of LangChain imports so it can run in a worker
+    process (see get_pdf_pool).
+    
+    Args:
+        file_content: Raw bytes of the PDF file
+        output_dir: Directory to save extracted images
+        max_images: Maximum number of images to extract
+        min_size: Minimum width/height in pixels
         
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(file_content)
-            tmp_path = Path(tmp.name)
+    Returns:
+        Tuple of (text, images) - images as returned by extract_images_from_pdf;
+        image extraction failures yield an empty list rather than an error
         
+    Raises:
+        PDFParserError: If the PDF cannot be opened or has no text
+    """
+    with PDFDocument(file_content) as pdf:
+        text = pdf.text()
         try:
-            doc = fitz.open(tmp_path)
-            extracted_images = []
-            image_count = 0
-            
-            for page_num in range(len(doc)):
-                if image_count >= max_images:
-                    break
-                    
-                page = doc[page_num]
-                image_list = page.get_images(full=True)
-                
-                for img_index, img_info in enumerate(image_list):
-                    if image_count >= max_images:
-                        break
-                    
-                    try:
-                        xref = img_info[0]
-                        
-                        # Extract image
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-                        width = base_image.get("width", 0)
-                        height = base_image.get("height", 0)
-                        
-                        # Skip small/decorative images
-                        if width < min_size or height < min_size:
-                            continue
-                        
-                        # Generate unique filename
-                        image_filename = f"page{page_num + 1}_img{img_index}.{image_ext}"
-                        image_path = output_dir / image_filename
-                        
-                        # Save image
-                        with open(image_path, "wb") as f:
-                            f.write(image_bytes)
-                        
-                        extracted_images.append({
-                            "path": str(image_path),
-                            "filename": image_filename,
-                            "page_number": page_num + 1,
-                            "image_index": img_index,
-                            "width": width,
-                            "height": height,
-                        })
-                        
-                        image_count += 1
-                        
-                    except Exception as e:
-                        # Skip problematic images
-                        print(f"Failed to extract image {img_index} from page {page_num + 1}: {e}")
-                        continue
-            
-            doc.close()
-            return extracted_images
-            
-        finally:
-            tmp_path.unlink(missing_ok=True)
-            
-    except fitz.FileDataError as e:
-        raise PDFParserError(f"Invalid or corrupted PDF file: {e}")
+            images = pdf.images(output_dir, max_images, min_size)
+        except Exception as e:
+            print(f"Image extraction failed: {e}")
+            images = []
+        return text, images
+
+
+def pdf_page_count(file_content: bytes) -> int:
+    """Number of pages in a PDF - only the page tree is read, so it takes milliseconds."""
+    with PDFDocument(file_content) as pdf:
+        return pdf.page_count
+
+
+def extract_page_texts(file_content: bytes, offset: int, step: int) -> list[tuple[int, str]]:
+    """
+    Page-tagged text of every step-th page from offset.
+    
+    One share of a parallel extraction (see extract_pdf_content_async).
+    Interleaved shares stay balanced when text density varies through
+    the document (e.g. prose first, appendices of tables last).
+    """
+    with PDFDocument(file_content) as pdf:
+        return pdf.page_texts(range(offset, pdf.page_count, step))
+
+
+def _extract_images_or_empty(
+    file_content: bytes,
+    output_dir: str,
+    max_images: int,
+    min_size: int,
+) -> list[dict]:
+    """extract_images_from_pdf, with failures logged and yielding no images."""
+    try:
+        return extract_images_from_pdf(file_content, Path(output_dir), max_images, min_size)
     except Exception as e:
-        if isinstance(e, PDFParserError):
-            raise
-        raise PDFParserError(f"Failed to extract images: {e}")
+        print(f"Image extraction failed: {e}")
+        return []
+
+
+# Worker processes for PyMuPDF parsing, so large PDFs don't stall the event
+# loop and concurrent uploads parse on separate cores
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    """Get the shared PDF parsing process pool (created on first use)."""
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: forking a process that already runs an event loop and
+        # client threads is unsafe
+        _pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pdf_pool
+
+
+# PDFs with at least this many pages are split across pool workers:
+# interleaved page shares of PAGES_PER_SHARE or more, plus one worker for
+# images. Smaller PDFs parse in a single task.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+PAGES_PER_SHARE = 32
+
+
+async def extract_pdf_content_async(
+    file_content: bytes,
+    output_dir: str,
+    max_images: int = 10,
+    min_size: int = 100,
+) -> tuple[str, list[dict]]:
+    """
+    extract_pdf_content, run in the PDF worker pool.
+    
+    PyMuPDF holds the GIL and isn't thread-safe, so parallelism within a
+    large PDF comes from several worker processes each opening the bytes
+    and extracting a share of the pages.
+    
+    Raises:
+        PDFParserError: If the PDF cannot be opened or has no text
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_pdf_pool()
+    
+    # Counted in this process: shipping the bytes to a worker just for the
+    # count would cost more than the count itself
+    page_count = pdf_page_count(file_content)
+    shares = min(PDF_PARSE_WORKERS, page_count // PAGES_PER_SHARE)
+    if page_count < PDF_PARALLEL_MIN_PAGES or shares < 2:
+        return await loop.run_in_executor(
+            pool, extract_pdf_content, file_content, output_dir, max_images, min_size,
+        )
+    
+    text_shares, images = await asyncio.gather(
+        asyncio.gather(*(
+            loop.run_in_executor(pool, extract_page_texts, file_content, offset, shares)
+            for offset in range(shares)
+        )),
+        loop.run_in_executor(
+            pool, _extract_images_or_empty, file_content, output_dir, max_images, min_size,
+        ),
+    )
+    return _join_pages(sorted(chain.from_iterable(text_shares))), images
+
 
+def shutdown_pdf_pool() -> None:
+    """Stop the PDF parsing workers (called on app shutdown)."""
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
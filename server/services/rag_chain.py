@@ -1,14 +1,19 @@
 """RAG chain for context-aware generation."""
 
-from typing import List, Optional, Dict, Any
+import asyncio
+import os
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Set, Tuple
+
+from cachetools import TTLCache
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.documents import Document
 from langchain_core.messages import BaseMessage
 
-from services.langchain_service import get_langchain_service
-from services.vector_store import get_vector_store
+from server.services.langchain_service import gemini_slot, get_langchain_service
+from server.services.vector_store import aembed_queries, embed_query, get_vector_store
 
 
 class RAGChain:
@@ -27,11 +32,10 @@ class RAGChain:
     
     def _format_docs(self, docs: List[Document]) -> str:
         """Format retrieved documents for context injection."""
-        formatted = []
-        for i, doc in enumerate(docs, 1):
-            chunk_idx = doc.metadata.get('chunk_index', i)
-            formatted.append(f"[Chunk {chunk_idx}]\n{doc.page_content}")
-        return "\n\n---\n\n".join(formatted)
+        return "\n\n---\n\n".join(
+            f"[Chunk {doc.metadata.get('chunk_index', i)}]\n{doc.page_content}"
+            for i, doc in enumerate(docs, 1)
+        )
     
     def retrieve_context(
         self,
@@ -45,14 +49,30 @@ class RAGChain:
         Args:
             query: Search query
             k: Number of documents to retrieve
-            filter: Optional metadata filter
+            filter: Optional metadata match, e.g. {"source_type": "image"}
         
         Returns:
             List of relevant Document objects
         """
-        return self.vector_store.similarity_search(
-            self.collection_name, query, k=k, filter=filter
-        )
+        return self.vector_store.search_by_vectors(
+            [(self.collection_name, embed_query(query), k, filter)]
+        )[0]
+    
+    async def aretrieve_context(
+        self,
+        query: str,
+        k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        """
+        Async retrieve_context.
+        
+        Unfiltered lookups go through the shared batching retriever; filtered
+        ones run the blocking search in a worker thread.
+        """
+        if filter:
+            return await asyncio.to_thread(self.retrieve_context, query, k, filter)
+        return await get_batching_retriever().aretrieve(self.collection_name, query, k=k)
     
     def query(
         self,
@@ -121,6 +141,32 @@ Context:
         """
         # Retrieve context based on current question
         context_docs = self.retrieve_context(question, k=k)
+        chain = self._history_chain(context_docs, system_prompt)
+        
+        return chain.invoke({
+            "history": history,
+            "question": question,
+        })
+    
+    async def aquery_with_history(
+        self,
+        question: str,
+        history: List[BaseMessage],
+        system_prompt: Optional[str] = None,
+        k: int = 5,
+    ) -> str:
+        """Async query_with_history - never blocks the event loop."""
+        context_docs = await self.aretrieve_context(question, k=k)
+        chain = self._history_chain(context_docs, system_prompt)
+        
+        async with gemini_slot(fast=True):
+            return await chain.ainvoke({
+                "history": history,
+                "question": question,
+            })
+    
+    def _history_chain(self, context_docs: List[Document], system_prompt: Optional[str]):
+        """Build the multi-turn chain with the retrieved context filled in."""
         context = self._format_docs(context_docs)
         
         default_system = """You are a helpful assistant for university students working on their coursework.
@@ -141,9 +187,146 @@ Context from coursework specification:
             ("human", "{question}"),
         ])
         
-        chain = prompt | self.langchain.get_llm(fast=True) | StrOutputParser()
+        return prompt | self.langchain.get_llm(fast=True) | StrOutputParser()
+
+
+@lru_cache(maxsize=128)
+def get_rag_chain(collection_name: str) -> RAGChain:
+    """
+    Get the RAGChain for a collection, built once per collection.
+    
+    RAGChain only holds the shared LangChain and vector store singletons,
+    so one instance can serve concurrent requests.
+    """
+    return RAGChain(collection_name)
+
+
+# Concurrent chat retrievals are coalesced: queries arriving within the
+# window (or until the batch fills) share one embedding request and one
+# Qdrant batch search per collection
+RETRIEVAL_BATCH_WINDOW_SECONDS = 0.01
+RETRIEVAL_MAX_BATCH = 16
+
+# Repeat questions ("what's the deadline?") skip embedding and search.
+# Only touched from the event loop, so no lock is needed.
+_retrieval_cache: TTLCache = TTLCache(
+    maxsize=int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000")),
+    ttl=int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "600")),
+)
+
+
+def invalidate_retrieval_cache(collection_name: str) -> None:
+    """Drop cached retrievals for a collection (call after writing to it)."""
+    for key in [key for key in _retrieval_cache.keys() if key[0] == collection_name]:
+        _retrieval_cache.pop(key, None)
+
+
+class BatchingRetriever:
+    """Async retriever that batches concurrent queries."""
+    
+    def __init__(self):
+        self._pending: List[Tuple[str, str, int, Optional[str], asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._running: Set[asyncio.Task] = set()
+    
+    async def aretrieve(
+        self,
+        collection_name: str,
+        query: str,
+        k: int = 5,
+        source_type: Optional[str] = None,
+    ) -> List[Document]:
+        """
+        Retrieve relevant context for a query.
+        
+        Args:
+            collection_name: Collection to search in
+            query: Search query
+            k: Number of documents to retrieve
+            source_type: Only return chunks of this source_type
+                ("coursework_pdf" text or "image"), filtered in Qdrant
         
-        return chain.invoke({
-            "history": history,
-            "question": question,
-        })
+        Returns:
+            List of relevant Document objects
+        """
+        cache_key = (collection_name, k, source_type, query.strip().lower())
+        cached = _retrieval_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((collection_name, query, k, source_type, future))
+        
+        if len(self._pending) >= RETRIEVAL_MAX_BATCH:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(RETRIEVAL_BATCH_WINDOW_SECONDS, self._flush)
+        docs = await future
+        _retrieval_cache[cache_key] = docs
+        return docs
+    
+    async def aretrieve_multimodal(
+        self,
+        collection_name: str,
+        query: str,
+        k_text: int = 4,
+        k_image: int = 2,
+    ) -> List[Document]:
+        """
+        Retrieve text chunks and image descriptions with a modality balance.
+        
+        Up to k_image image chunks are kept; text fills the remaining
+        k_text + k_image slots, so text-only PDFs still get full context.
+        Both searches join the same batch: one embedding, one Qdrant round trip.
+        """
+        text_docs, image_docs = await asyncio.gather(
+            self.aretrieve(collection_name, query, k=k_text + k_image, source_type="coursework_pdf"),
+            self.aretrieve(collection_name, query, k=k_image, source_type="image"),
+        )
+        return text_docs[:k_text + k_image - len(image_docs)] + image_docs
+    
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Hold a reference so the task isn't garbage collected mid-run
+            task = asyncio.create_task(self._run(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+    
+    async def _run(self, batch: List[Tuple[str, str, int, Optional[str], asyncio.Future]]):
+        try:
+            # Filtered searches for the same question share one embedding
+            vectors = await aembed_queries([query for _, query, _, _, _ in batch])
+            # The Qdrant client is sync - keep it off the event loop
+            results = await asyncio.to_thread(
+                get_vector_store().search_by_vectors,
+                [
+                    (collection_name, vectors[query], k, {"source_type": source_type} if source_type else None)
+                    for collection_name, query, k, source_type, _ in batch
+                ],
+            )
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (*_, future), docs in zip(batch, results):
+            if not future.done():
+                future.set_result(docs)
+
+
+# Singleton instance
+_batching_retriever: Optional[BatchingRetriever] = None
+
+
+def get_batching_retriever() -> BatchingRetriever:
+    """Get singleton batching retriever."""
+    global _batching_retriever
+    if _batching_retriever is None:
+        _batching_retriever = BatchingRetriever()
+    return _batching_retriever
@@ -1,13 +1,155 @@
 """Qdrant Cloud vector store service."""
 
+import asyncio
+import functools
+import heapq
 import os
-from typing import List, Optional, Dict, Any
+import threading
+from collections import defaultdict
+from itertools import chain
+from operator import itemgetter
+from typing import List, Optional, Dict, Any, Set, Tuple
+
+from cachetools import LRUCache
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+from qdrant_client.models import (
+    Distance,
+    HnswConfigDiff,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_qdrant import QdrantVectorStore
 
-from services.langchain_service import get_langchain_service
+from server.services.langchain_service import EMBEDDING_DIMENSIONS, LangChainService, get_langchain_service
+
+# Gemini's batchEmbedContents accepts up to 100 texts per request
+EMBED_BATCH_SIZE = 100
+
+# gRPC has less per-request overhead than REST (falls back to REST when
+# disabled). The pool must cover the batches and searches in flight from
+# worker threads, or requests queue for a connection.
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "1") == "1"
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "32"))
+
+# On-disk cache of chunk embeddings keyed by chunk text: re-ingesting text
+# embedded before (re-chunked or lightly edited PDFs) skips Gemini for it.
+# Opt-in, as it needs a persistent disk.
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "")
+
+# LangChain vector store wrappers kept per process (one per user collection)
+VECTORSTORE_CACHE_SIZE = int(os.getenv("VECTORSTORE_CACHE_SIZE", "128"))
+
+# Async ingestion embeds and upserts batches concurrently (each in a worker
+# thread on the shared client): a bounded number of smaller batches in
+# flight instead of one long serial call
+INGEST_BATCH_SIZE = int(os.getenv("QDRANT_INGEST_BATCH_SIZE", "32"))
+INGEST_CONCURRENCY = int(os.getenv("QDRANT_INGEST_CONCURRENCY", "4"))
+
+# HNSW graph for new collections: denser links and a wider build beam buy
+# recall, so queries can use a narrow search beam (HNSW_SEARCH_EF). Collections
+# under Qdrant's full-scan threshold are searched exactly regardless.
+HNSW_M = 32
+HNSW_EF_CONSTRUCT = 200
+HNSW_SEARCH_EF = 64
+
+# int8 copies of the vectors (4x smaller) stay in RAM and serve
+# the graph search; the float32 originals live on disk and only rescore
+# the top k * QUANTIZATION_OVERSAMPLING candidates
+QUANTIZATION_OVERSAMPLING = 2.0
+
+SEARCH_PARAMS = SearchParams(
+    hnsw_ef=HNSW_SEARCH_EF,
+    quantization=QuantizationSearchParams(
+        rescore=True,
+        oversampling=QUANTIZATION_OVERSAMPLING,
+    ),
+)
+
+
+# Query embeddings by exact question text. Chat turns repeat questions,
+# and the chat cache lookup embeds each one just before retrieval does.
+# Filled from the event loop and from worker threads, hence the lock.
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
+_query_vectors: LRUCache = LRUCache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)
+_query_vectors_lock = threading.Lock()
+
+
+def _cached_query_vectors(queries: List[str]) -> Dict[str, List[float]]:
+    with _query_vectors_lock:
+        return {
+            query: vector
+            for query in queries
+            if (vector := _query_vectors.get(query)) is not None
+        }
+
+
+def _cache_query_vectors(vectors: Dict[str, List[float]]) -> None:
+    with _query_vectors_lock:
+        _query_vectors.update(vectors)
+
+
+def _document_embeddings(embeddings: Embeddings) -> Embeddings:
+    """Wrap embeddings in the on-disk cache when EMBEDDING_CACHE_DIR is set."""
+    if not EMBEDDING_CACHE_DIR:
+        return embeddings
+    try:
+        try:
+            from langchain_classic.embeddings import CacheBackedEmbeddings
+            from langchain_classic.storage import LocalFileStore
+        except ImportError:  # langchain < 1.0
+            from langchain.embeddings import CacheBackedEmbeddings
+            from langchain.storage import LocalFileStore
+    except ImportError:
+        print("Warning: EMBEDDING_CACHE_DIR set but CacheBackedEmbeddings unavailable; not caching.")
+        return embeddings
+    
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings,
+        LocalFileStore(EMBEDDING_CACHE_DIR),
+        # Switching embedding models or sizes starts a fresh namespace
+        namespace=f"{embeddings.model.replace('/', '_')}_{EMBEDDING_DIMENSIONS}",
+        key_encoder="blake2b",
+    )
+
+
+def embed_queries(queries: List[str]) -> Dict[str, List[float]]:
+    """Embed search queries in one request (blocking), skipping ones already cached."""
+    vectors = _cached_query_vectors(queries)
+    missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+    if missing:
+        fresh = dict(zip(missing, get_langchain_service().get_embeddings().embed_documents(
+            missing,
+            task_type="RETRIEVAL_QUERY",
+        )))
+        _cache_query_vectors(fresh)
+        vectors.update(fresh)
+    return vectors
+
+
+def embed_query(query: str) -> List[float]:
+    """Embed a search query (blocking), reusing a cached vector if there is one."""
+    return embed_queries([query])[query]
+
+
+async def aembed_queries(queries: List[str]) -> Dict[str, List[float]]:
+    """Embed search queries in one request, skipping ones already cached."""
+    vectors = _cached_query_vectors(queries)
+    missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+    if missing:
+        fresh = dict(zip(missing, await get_langchain_service().get_embeddings().aembed_documents(
+            missing,
+            task_type="RETRIEVAL_QUERY",
+        )))
+        _cache_query_vectors(fresh)
+        vectors.update(fresh)
+    return vectors
 
 
 class VectorStoreService:
@@ -33,33 +175,71 @@ class VectorStoreService:
             self.client = QdrantClient(
                 url=self.qdrant_url,
                 api_key=self.qdrant_api_key,
+                prefer_grpc=QDRANT_PREFER_GRPC,
+                pool_size=QDRANT_POOL_SIZE,
+                timeout=30,
             )
             self._is_memory = False
         
-        self.langchain = get_langchain_service()
-        self._vectorstores: Dict[str, QdrantVectorStore] = {}
+        # LangChain wrappers for recently used collections (cheap to rebuild);
+        # collections already set up in Qdrant are remembered separately so
+        # an evicted wrapper doesn't cost another existence check
+        self._vectorstores: LRUCache = LRUCache(maxsize=VECTORSTORE_CACHE_SIZE)
+        self._known_collections: Set[str] = set()
+        # Used from worker threads; LRUCache lookups reorder it, so every
+        # access holds the lock (first-time setup is serialized too)
+        self._collections_lock = threading.Lock()
         
-        # Embedding dimension for gemini-embedding-001
-        self._embedding_dim = 3072
+        # Embedding dimension requested from gemini-embedding-001
+        self._embedding_dim = EMBEDDING_DIMENSIONS
+    
+    # The Gemini clients are built on first real use, not by stats or
+    # delete calls that only need Qdrant
+    @functools.cached_property
+    def langchain(self) -> LangChainService:
+        return get_langchain_service()
+    
+    @functools.cached_property
+    def _embeddings(self) -> Embeddings:
+        return _document_embeddings(self.langchain.get_embeddings())
     
     def _ensure_collection(self, collection_name: str):
         """Ensure collection exists with proper configuration."""
         try:
             collection_info = self.client.get_collection(collection_name)
-            current_dim = collection_info.config.params.vectors.size
-            if current_dim != self._embedding_dim:
-                print(f"Recreating collection '{collection_name}': {current_dim} -> {self._embedding_dim} dims")
-                self.client.delete_collection(collection_name)
-                raise Exception("recreate")
         except Exception:
-            self.client.create_collection(
-                collection_name=collection_name,
-                vectors_config=VectorParams(
-                    size=self._embedding_dim,
-                    distance=Distance.COSINE,
-                ),
+            self._create_collection(collection_name)
+            return
+        
+        # Never rebuilt here: that would hold _collections_lock for the whole
+        # re-embed and race other workers. scripts/reembed_collections does it
+        current_dim = collection_info.config.params.vectors.size
+        if current_dim != self._embedding_dim:
+            raise RuntimeError(
+                f"Collection '{collection_name}' stores {current_dim}-dim vectors but "
+                f"EMBEDDING_DIMENSIONS is {self._embedding_dim}; run "
+                "`python -m server.scripts.reembed_collections` to migrate it"
             )
     
+    def _create_collection(self, collection_name: str):
+        self.client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(
+                size=self._embedding_dim,
+                distance=Distance.COSINE,
+                on_disk=True,
+            ),
+            hnsw_config=HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT),
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                ),
+            ),
+            on_disk_payload=True,
+        )
+    
     def get_or_create_collection(self, collection_name: str) -> QdrantVectorStore:
         """
         Get or create a LangChain Qdrant vector store.
@@ -70,19 +250,28 @@ class VectorStoreService:
         Returns:
             QdrantVectorStore instance
         """
-        if collection_name not in self._vectorstores:
-            self._ensure_collection(collection_name)
-            self._vectorstores[collection_name] = QdrantVectorStore(
-                client=self.client,
-                collection_name=collection_name,
-                embedding=self.langchain.get_embeddings(),
-            )
-        return self._vectorstores[collection_name]
+        with self._collections_lock:
+            vectorstore = self._vectorstores.get(collection_name)
+            if vectorstore is None:
+                if collection_name not in self._known_collections:
+                    self._ensure_collection(collection_name)
+                    self._known_collections.add(collection_name)
+                # _ensure_collection checked the vector size; the wrapper's
+                # own check embeds a dummy text to find it
+                vectorstore = QdrantVectorStore(
+                    client=self.client,
+                    collection_name=collection_name,
+                    embedding=self._embeddings,
+                    validate_collection_config=False,
+                )
+                self._vectorstores[collection_name] = vectorstore
+            return vectorstore
     
     def add_documents(
         self,
         collection_name: str,
         documents: List[Document],
+        batch_size: int = EMBED_BATCH_SIZE,
     ) -> List[str]:
         """
         Add documents to a collection.
@@ -90,6 +279,7 @@ class VectorStoreService:
         Args:
             collection_name: Target collection name
             documents: List of Document objects with content and metadata
+            batch_size: Documents per embedding request / upsert
         
         Returns:
             List of document IDs assigned
@@ -97,9 +287,39 @@ class VectorStoreService:
         if not documents:
             return []
         vectorstore = self.get_or_create_collection(collection_name)
-        ids = vectorstore.add_documents(documents)
+        ids = vectorstore.add_documents(documents, batch_size=batch_size)
         return ids
     
+    async def add_documents_async(
+        self,
+        collection_name: str,
+        documents: List[Document],
+        batch_size: int = INGEST_BATCH_SIZE,
+        concurrency: int = INGEST_CONCURRENCY,
+    ) -> List[str]:
+        """
+        Async add_documents, with up to `concurrency` batches in flight.
+        
+        The sync Qdrant client and embedding calls run in worker threads.
+        
+        Returns:
+            List of document IDs assigned, in input order
+        """
+        if not documents:
+            return []
+        vectorstore = await asyncio.to_thread(self.get_or_create_collection, collection_name)
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def add_batch(batch: List[Document]) -> List[str]:
+            async with semaphore:
+                return await asyncio.to_thread(vectorstore.add_documents, batch, batch_size=len(batch))
+        
+        batches = await asyncio.gather(*(
+            add_batch(documents[start:start + batch_size])
+            for start in range(0, len(documents), batch_size)
+        ))
+        return [doc_id for ids in batches for doc_id in ids]
+    
     def similarity_search(
         self,
         collection_name: str,
@@ -120,10 +340,94 @@ class VectorStoreService:
             List of similar Document objects
         """
         vectorstore = self.get_or_create_collection(collection_name)
+        vector = embed_query(query)
         
         if filter:
-            return vectorstore.similarity_search(query, k=k, filter=filter)
-        return vectorstore.similarity_search(query, k=k)
+            return vectorstore.similarity_search_by_vector(
+                vector, k=k, filter=filter, search_params=SEARCH_PARAMS,
+            )
+        return vectorstore.similarity_search_by_vector(vector, k=k, search_params=SEARCH_PARAMS)
+    
+    def batch_similarity_search(
+        self,
+        collection_name: str,
+        queries: List[str],
+        k: int = 5,
+        filter: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Document]]:
+        """
+        Search for several queries with one embedding request and one Qdrant round trip.
+        
+        Args:
+            collection_name: Collection to search in
+            queries: Search query texts
+            k: Number of results per query
+            filter: Optional metadata match applied to every query,
+                e.g. {"source_type": "image"}
+        
+        Returns:
+            Similar documents for each query, in input order
+        """
+        vectors = embed_queries(queries)
+        return self.search_by_vectors(
+            [(collection_name, vectors[query], k, filter) for query in queries]
+        )
+    
+    def search_by_vectors(
+        self,
+        queries: List[Tuple[str, List[float], int, Optional[Dict[str, Any]]]],
+    ) -> List[List[Document]]:
+        """
+        Run several already-embedded searches, one Qdrant round trip per collection.
+        
+        Args:
+            queries: (collection_name, query vector, k, metadata match) per
+                search; the match dict (e.g. {"source_type": "image"}) may
+                be None
+        
+        Returns:
+            Matching documents for each query, in input order
+        """
+        from qdrant_client.models import FieldCondition, Filter, MatchValue, QueryRequest
+        
+        def metadata_filter(match: Optional[Dict[str, Any]]) -> Optional[Filter]:
+            if not match:
+                return None
+            return Filter(must=[
+                FieldCondition(key=f"metadata.{key}", match=MatchValue(value=value))
+                for key, value in match.items()
+            ])
+        
+        by_collection: Dict[str, List[int]] = defaultdict(list)
+        for i, (collection_name, *_) in enumerate(queries):
+            by_collection[collection_name].append(i)
+        
+        results: List[List[Document]] = [[] for _ in queries]
+        for collection_name, indices in by_collection.items():
+            vectorstore = self.get_or_create_collection(collection_name)
+            responses = self.client.query_batch_points(
+                collection_name=collection_name,
+                requests=[
+                    QueryRequest(
+                        query=queries[i][1],
+                        limit=queries[i][2],
+                        filter=metadata_filter(queries[i][3]),
+                        params=SEARCH_PARAMS,
+                        with_payload=True,
+                        with_vector=False,
+                    )
+                    for i in indices
+                ],
+            )
+            for i, response in zip(indices, responses):
+                results[i] = [
+                    Document(
+                        page_content=point.payload.get(vectorstore.content_payload_key, ""),
+                        metadata=point.payload.get(vectorstore.metadata_payload_key) or {},
+                    )
+                    for point in response.points
+                ]
+        return results
     
     def similarity_search_with_score(
         self,
@@ -132,8 +436,45 @@ class VectorStoreService:
         k: int = 5,
     ) -> List[tuple[Document, float]]:
         """Search with relevance scores."""
+        return self._search_with_scores(collection_name, embed_query(query), k)
+    
+    def _search_with_scores(
+        self,
+        collection_name: str,
+        vector: List[float],
+        k: int,
+    ) -> List[tuple[Document, float]]:
         vectorstore = self.get_or_create_collection(collection_name)
-        return vectorstore.similarity_search_with_score(query, k=k)
+        return vectorstore.similarity_search_with_score_by_vector(
+            vector, k=k, search_params=SEARCH_PARAMS,
+        )
+    
+    async def amulti_collection_search(
+        self,
+        collection_names: List[str],
+        query: str,
+        k: int = 5,
+    ) -> List[tuple[Document, float]]:
+        """
+        Search several collections for one query, merged by relevance.
+        
+        The query is embedded once and the collections are searched
+        concurrently (the sync client runs in worker threads).
+        
+        Args:
+            collection_names: Collections to search
+            query: Search query text
+            k: Number of results to return overall
+        
+        Returns:
+            Top k (document, score) pairs across all collections, best first
+        """
+        vector = (await aembed_queries([query]))[query]
+        hits = await asyncio.gather(*(
+            asyncio.to_thread(self._search_with_scores, collection_name, vector, k)
+            for collection_name in collection_names
+        ))
+        return heapq.nlargest(k, chain.from_iterable(hits), key=itemgetter(1))
     
     def delete_document(self, collection_name: str, document_id: str):
         """
@@ -143,8 +484,20 @@ class VectorStoreService:
             collection_name: Collection containing the document
             document_id: Document ID to delete
         """
+        self.delete_documents(collection_name, [document_id])
+    
+    def delete_documents(self, collection_name: str, document_ids: List[str]):
+        """
+        Delete all chunks for several documents in one request.
+        
+        Args:
+            collection_name: Collection containing the documents
+            document_ids: Document IDs to delete
+        """
+        if not document_ids:
+            return
         try:
-            from qdrant_client.models import Filter, FieldCondition, MatchValue
+            from qdrant_client.models import Filter, FieldCondition, MatchAny
             
             self.client.delete(
                 collection_name=collection_name,
@@ -152,7 +505,7 @@ class VectorStoreService:
                     must=[
                         FieldCondition(
                             key="metadata.document_id",
-                            match=MatchValue(value=document_id),
+                            match=MatchAny(any=document_ids),
                         )
                     ]
                 ),
@@ -160,11 +513,54 @@ class VectorStoreService:
         except Exception as e:
             print(f"Delete document error: {e}")
     
+    def find_document(self, collection_name: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Find an already-ingested copy of a PDF in a collection.
+        
+        Args:
+            collection_name: Collection to look in
+            content_hash: Hash of the PDF bytes stored in chunk metadata
+        
+        Returns:
+            Dict with document_id and chunk_count, or None if not ingested
+        """
+        from qdrant_client.models import Filter, FieldCondition, MatchValue
+        
+        try:
+            if collection_name not in self._known_collections and not self.client.collection_exists(collection_name):
+                return None
+            
+            points, _ = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=Filter(must=[
+                    FieldCondition(key="metadata.content_hash", match=MatchValue(value=content_hash)),
+                ]),
+                limit=1,
+                with_payload=["metadata.document_id"],
+                with_vectors=False,
+            )
+            if not points:
+                return None
+            
+            document_id = points[0].payload["metadata"]["document_id"]
+            chunk_count = self.client.count(
+                collection_name=collection_name,
+                count_filter=Filter(must=[
+                    FieldCondition(key="metadata.document_id", match=MatchValue(value=document_id)),
+                ]),
+            ).count
+            return {"document_id": document_id, "chunk_count": chunk_count}
+        except Exception as e:
+            print(f"Find document error: {e}")
+            return None
+    
     def delete_collection(self, collection_name: str):
         """Delete an entire collection."""
         try:
             self.client.delete_collection(collection_name)
-            self._vectorstores.pop(collection_name, None)
+            with self._collections_lock:
+                self._vectorstores.pop(collection_name, None)
+                self._known_collections.discard(collection_name)
         except Exception:
             pass  # Collection might not exist
     
@@ -196,11 +592,15 @@ class VectorStoreService:
 
 # Singleton instance
 _vector_store_instance: Optional[VectorStoreService] = None
+_vector_store_lock = threading.Lock()
 
 
 def get_vector_store() -> VectorStoreService:
     """Get singleton vector store service instance."""
     global _vector_store_instance
     if _vector_store_instance is None:
-        _vector_store_instance = VectorStoreService()
+        # Also reached from worker threads; build one Qdrant client only
+        with _vector_store_lock:
+            if _vector_store_instance is None:
+                _vector_store_instance = VectorStoreService()
     return _vector_store_instance
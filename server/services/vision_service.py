@@ -1,27 +1,156 @@
 """Vision service for generating image descriptions using Gemini."""
 
+import asyncio
 import base64
-import time
+import functools
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
+import fitz  # PyMuPDF
+from aiolimiter import AsyncLimiter
+from cachetools import LRUCache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
 
-from services.langchain_service import get_langchain_service
+from server.services.langchain_service import get_langchain_service
+
+# SIMD base64 straight to str (one copy fewer than b64encode + decode);
+# falls back to the stdlib if pybase64 isn't installed
+try:
+    from pybase64 import b64encode_as_string as _b64encode
+except ImportError:
+    def _b64encode(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+
+# MIME types by image file extension (anything else is sent as PNG)
+MIME_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+# Longest side sent to Gemini - it downsizes anything bigger itself, so
+# larger images are scaled down first to cut upload size and encoding time
+VISION_MAX_DIMENSION = 1568
+
+
+def _read_image(image_path: Path) -> tuple[bytes, str]:
+    """Image bytes and MIME type, downscaled to VISION_MAX_DIMENSION if larger."""
+    mime_type = MIME_TYPES.get(image_path.suffix.lower(), "image/png")
+    image_bytes = image_path.read_bytes()
+    
+    try:
+        pixmap = fitz.Pixmap(image_bytes)
+    except Exception:
+        return image_bytes, mime_type  # Format MuPDF can't decode - send as is
+    
+    longest = max(pixmap.width, pixmap.height)
+    if longest <= VISION_MAX_DIMENSION:
+        return image_bytes, mime_type
+    
+    scale = VISION_MAX_DIMENSION / longest
+    pixmap = fitz.Pixmap(
+        pixmap,
+        max(1, round(pixmap.width * scale)),
+        max(1, round(pixmap.height * scale)),
+    )
+    # Photos stay JPEG; diagrams (and anything with alpha) use lossless PNG
+    # so small text stays legible
+    if mime_type == "image/jpeg" and not pixmap.alpha:
+        return pixmap.tobytes("jpeg", jpg_quality=85), "image/jpeg"
+    return pixmap.tobytes("png"), "image/png"
+
+
+@functools.lru_cache(maxsize=32)
+def _encode_image(path: str, mtime_ns: int) -> str:
+    """
+    Base64 data URL for an image file.
+    
+    Memoized on (path, mtime), so re-describing an image skips the disk
+    read, resizing and encoding, and a rewritten file gets a fresh entry.
+    """
+    image_bytes, mime_type = _read_image(Path(path))
+    image_data = _b64encode(image_bytes)
+    return f"data:{mime_type};base64,{image_data}"
+
+
+def _image_data_url(image_path: Path) -> str:
+    return _encode_image(str(image_path), image_path.stat().st_mtime_ns)
+
+
+# Descriptions by image content and document context, so a logo on every
+# page or a figure shared between specs is described once. Read and
+# filled from worker threads, hence the lock.
+DESCRIPTION_CACHE_SIZE = 512
+
+_descriptions: LRUCache = LRUCache(maxsize=DESCRIPTION_CACHE_SIZE)
+_descriptions_lock = threading.Lock()
+
+
+def _description_key(image_url: str, context: str) -> str:
+    digest = hashlib.blake2b(image_url.encode("ascii"), digest_size=16)
+    digest.update(b"\0")
+    digest.update(context.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cached_description(key: str) -> Optional[str]:
+    with _descriptions_lock:
+        return _descriptions.get(key)
+
+
+def _cache_description(key: str, description: str) -> None:
+    with _descriptions_lock:
+        _descriptions[key] = description
 
 
 class VisionService:
     """Generate textual descriptions of images using Gemini Vision."""
     
-    # Rate limiting: delay between vision API calls (seconds)
+    # Rate limiting: minimum delay between vision API call starts (seconds)
     RATE_LIMIT_DELAY = 0.5
+    # Vision calls in flight per abatch_describe
+    BATCH_CONCURRENCY = 5
     
-    def __init__(self):
-        """Initialize vision service with Gemini model."""
-        langchain = get_langchain_service()
+    @functools.cached_property
+    def model(self) -> ChatGoogleGenerativeAI:
+        """Gemini model, created on first use."""
         # Use the same model - Gemini 2.0 Flash supports vision natively
-        self.model = langchain.get_llm(fast=True)
+        return get_langchain_service().get_llm(fast=True)
+    
+    def _image_message(self, image_url: str, context: str) -> HumanMessage:
+        """Build the multimodal prompt message for one image (as a data URL)."""
+        # Build the prompt for coursework context
+        prompt_text = """Analyze this image from a coursework specification document.
+
+Describe:
+1. **Type**: What kind of diagram/figure is this? (flowchart, architecture, UML, graph, table, screenshot, etc.)
+2. **Components**: What are the main elements, labels, or sections visible?
+3. **Relationships**: How do the components connect or relate to each other?
+4. **Purpose**: What concept or requirement does this image appear to explain?
+
+Be concise but comprehensive. Focus on information that would help a student understand the coursework requirements."""
+
+        if context:
+            prompt_text += f"\n\nDocument context: {context}"
+        
+        # Create multimodal message with image
+        return HumanMessage(
+            content=[
+                {"type": "text", "text": prompt_text},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image_url},
+                },
+            ]
+        )
     
     def describe_image(
         self,
@@ -44,54 +173,87 @@ class VisionService:
             return "[Image file not found]"
         
         try:
-            # Read and encode image as base64
-            with open(image_path, "rb") as f:
-                image_data = base64.b64encode(f.read()).decode("utf-8")
-            
-            # Determine MIME type from extension
-            suffix = image_path.suffix.lower()
-            mime_type = {
-                ".png": "image/png",
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".gif": "image/gif",
-                ".webp": "image/webp",
-            }.get(suffix, "image/png")
-            
-            # Build the prompt for coursework context
-            prompt_text = """Analyze this image from a coursework specification document.
-
-Describe:
-1. **Type**: What kind of diagram/figure is this? (flowchart, architecture, UML, graph, table, screenshot, etc.)
-2. **Components**: What are the main elements, labels, or sections visible?
-3. **Relationships**: How do the components connect or relate to each other?
-4. **Purpose**: What concept or requirement does this image appear to explain?
-
-Be concise but comprehensive. Focus on information that would help a student understand the coursework requirements."""
-
-            if context:
-                prompt_text += f"\n\nDocument context: {context}"
+            image_url = _image_data_url(image_path)
+            key = _description_key(image_url, context)
+            description = _cached_description(key)
+            if description is not None:
+                return description
             
-            # Create multimodal message with image
-            message = HumanMessage(
-                content=[
-                    {"type": "text", "text": prompt_text},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:{mime_type};base64,{image_data}"},
-                    },
-                ]
-            )
+            message = self._image_message(image_url, context)
             
             # Invoke the model
             response = self.model.invoke([message])
             
-            return response.content if hasattr(response, 'content') else str(response)
+            description = response.content if hasattr(response, 'content') else str(response)
+            _cache_description(key, description)
+            return description
+            
+        except Exception as e:
+            print(f"Vision API error for {image_path}: {e}")
+            return f"[Failed to analyze image: {str(e)[:100]}]"
+    
+    async def adescribe_image(
+        self,
+        image_path: Path,
+        context: str = "",
+    ) -> str:
+        """Async describe_image - the file read and encoding run in a worker thread."""
+        image_path = Path(image_path)
+        
+        try:
+            image_url = await asyncio.to_thread(_image_data_url, image_path)
+        except FileNotFoundError:
+            return "[Image file not found]"
+        
+        key = _description_key(image_url, context)
+        description = _cached_description(key)
+        if description is not None:
+            return description
+        
+        try:
+            message = self._image_message(image_url, context)
+            response = await self.model.ainvoke([message])
+            description = response.content if hasattr(response, 'content') else str(response)
+            _cache_description(key, description)
+            return description
             
         except Exception as e:
             print(f"Vision API error for {image_path}: {e}")
             return f"[Failed to analyze image: {str(e)[:100]}]"
     
+    def describe_images(
+        self,
+        image_paths: List[Path],
+        context: str = "",
+        max_workers: int = 4,
+    ) -> List[str]:
+        """
+        Describe images concurrently on a thread pool (blocking).
+        
+        Identical images (e.g. a logo repeated on every page) are sent to
+        Gemini once and share the description.
+        
+        Returns:
+            One description per path, in input order
+        """
+        paths = [Path(path) for path in image_paths]
+        keys = []
+        for path in paths:
+            try:
+                keys.append(_description_key(_image_data_url(path), context))
+            except Exception:
+                keys.append(str(path))  # describe_image reports the failure
+        
+        first_paths = dict(zip(reversed(keys), reversed(paths)))
+        if not first_paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(first_paths), max_workers)) as pool:
+            futures = {
+                key: pool.submit(self.describe_image, path, context)
+                for key, path in first_paths.items()
+            }
+        return [futures[key].result() for key in keys]
+    
     def batch_describe(
         self,
         image_paths: List[Path],
@@ -99,40 +261,73 @@ Be concise but comprehensive. Focus on information that would help a student und
         max_images: int = 10,
     ) -> List[dict]:
         """
-        Describe multiple images with rate limiting.
+        Describe multiple images with rate limiting (blocking abatch_describe).
+        
+        Must not be called from a running event loop - await
+        abatch_describe there instead.
+        """
+        return asyncio.run(self.abatch_describe(image_paths, context, max_images))
+    
+    async def abatch_describe(
+        self,
+        image_paths: List[Path],
+        context: str = "",
+        max_images: int = 10,
+        concurrency: Optional[int] = None,
+    ) -> List[dict]:
+        """
+        Describe multiple images concurrently, with rate limiting.
         
         Args:
             image_paths: List of paths to image files
             context: Optional context about the document
             max_images: Maximum number of images to process
+            concurrency: Maximum vision calls in flight (default BATCH_CONCURRENCY)
         
         Returns:
-            List of dicts with: path, description, success
+            List of dicts with: path, description, success (input order)
         """
-        results = []
+        semaphore = asyncio.Semaphore(concurrency or self.BATCH_CONCURRENCY)
+        # Calls start at most once per RATE_LIMIT_DELAY; they no longer
+        # wait for the previous call to finish
+        limiter = AsyncLimiter(1, self.RATE_LIMIT_DELAY)
         
-        for i, path in enumerate(image_paths[:max_images]):
-            path = Path(path)
-            
-            # Rate limiting delay (skip for first image)
-            if i > 0:
-                time.sleep(self.RATE_LIMIT_DELAY)
-            
+        async def call(path: Path) -> str:
+            async with semaphore, limiter:
+                return await self.adescribe_image(path, context)
+        
+        # Identical images in the batch share one call
+        in_flight: Dict[str, asyncio.Future] = {}
+        
+        async def describe(path: Path) -> str:
             try:
-                description = self.describe_image(path, context)
-                results.append({
-                    "path": str(path),
-                    "description": description,
-                    "success": True,
-                })
-            except Exception as e:
-                results.append({
-                    "path": str(path),
-                    "description": f"[Error: {str(e)[:100]}]",
-                    "success": False,
-                })
-        
-        return results
+                key = _description_key(await asyncio.to_thread(_image_data_url, path), context)
+            except Exception:
+                key = str(path)  # adescribe_image reports the failure
+            if key not in in_flight:
+                in_flight[key] = asyncio.ensure_future(call(path))
+            return await in_flight[key]
+        
+        paths = [Path(path) for path in image_paths[:max_images]]
+        descriptions = await asyncio.gather(
+            *(describe(path) for path in paths),
+            return_exceptions=True,
+        )
+        
+        return [
+            {
+                "path": str(path),
+                "description": f"[Error: {str(description)[:100]}]",
+                "success": False,
+            }
+            if isinstance(description, Exception)
+            else {
+                "path": str(path),
+                "description": description,
+                "success": True,
+            }
+            for path, description in zip(paths, descriptions)
+        ]
 
 
 # Singleton instance
@@ -0,0 +1,112 @@
+import json
+import unittest
+
+from server.services.decomposition_parser import (
+    loads_llm_json,
+    loads_truncated_json,
+    parse_priority,
+    repair_json,
+    validate_decomposition,
+)
+
+
+class RepairJsonTest(unittest.TestCase):
+    def test_valid_json_is_unchanged(self):
+        text = '{"a": [1, 2], "b": "x"}'
+        self.assertEqual(repair_json(text), text)
+
+    def test_strips_markdown_fences(self):
+        self.assertEqual(json.loads(repair_json('```json\n{"a": 1}\n```')), {"a": 1})
+
+    def test_closes_unterminated_string_and_brackets(self):
+        text = '{"tasks": [{"title": "Implement the pars'
+        self.assertEqual(
+            json.loads(repair_json(text)),
+            {"tasks": [{"title": "Implement the pars"}]},
+        )
+
+    def test_escapes_raw_newlines_in_strings(self):
+        self.assertEqual(json.loads(repair_json('{"a": "line 1\nline 2"}')), {"a": "line 1\nline 2"})
+
+    def test_drops_trailing_comma_and_text_after_root(self):
+        self.assertEqual(json.loads(repair_json('{"a": [1, 2,]} trailing')), {"a": [1, 2]})
+
+    def test_unrecoverable_text_gives_empty_object(self):
+        self.assertEqual(repair_json("no json here"), "{}")
+        self.assertEqual(repair_json(""), "{}")
+
+    def test_loads_llm_json_repairs_only_when_needed(self):
+        self.assertEqual(loads_llm_json('```json\n{"a": 1}\n```'), {"a": 1})
+        self.assertEqual(loads_llm_json('{"a": {"b": 1'), {"a": {"b": 1}})
+
+
+class LoadsTruncatedJsonTest(unittest.TestCase):
+    def test_drops_dangling_key(self):
+        text = '{"course_name": "CS101", "tasks": [{"task_id": "t1"}], "deadl'
+        self.assertEqual(
+            loads_truncated_json(text),
+            {"course_name": "CS101", "tasks": [{"task_id": "t1"}]},
+        )
+
+    def test_drops_half_written_row(self):
+        text = '{"tasks": [{"task_id": "t1", "title": "A"}, {"task_id": "t2", "title":'
+        self.assertEqual(loads_truncated_json(text), {"tasks": [{"task_id": "t1", "title": "A"}]})
+
+    def test_complete_json_is_returned_as_is(self):
+        self.assertEqual(loads_truncated_json('{"a": [1]}'), {"a": [1]})
+
+    def test_nothing_recoverable_gives_empty_dict(self):
+        self.assertEqual(loads_truncated_json('{"course_na'), {})
+        self.assertEqual(loads_truncated_json(""), {})
+
+
+class ValidateDecompositionTest(unittest.TestCase):
+    def test_drops_invalid_task_and_keeps_valid_ones(self):
+        result = validate_decomposition({
+            "course_name": "CS101",
+            "tasks": [
+                {"task_id": "t1", "title": "Setup", "description": "d", "estimated_time": "1h"},
+                {"task_id": "t2", "title": "Broken", "estimated_time": {"hours": 2}},
+                {"task_id": "t3", "title": "Write tests", "description": "d", "estimated_time": "2h"},
+            ],
+        })
+        self.assertEqual([task.task_id for task in result.tasks], ["t1", "t3"])
+        self.assertEqual(result.course_name, "CS101")
+
+    def test_fills_row_defaults_and_skips_non_dict_rows(self):
+        result = validate_decomposition({"tasks": [{"title": "Only a title", "description": None}, "junk"]})
+        self.assertEqual(len(result.tasks), 1)
+        task = result.tasks[0]
+        self.assertEqual((task.task_id, task.title, task.description), ("t1", "Only a title", ""))
+        self.assertEqual(task.estimated_time, "Unknown")
+
+    def test_normalizes_priorities(self):
+        result = validate_decomposition({"tasks": [
+            {"title": "a", "priority": "Essential"},
+            {"title": "b", "priority": "nice to have"},
+            {"title": "c", "priority": "2"},
+            {"title": "d"},
+        ]})
+        self.assertEqual([task.priority for task in result.tasks], [0, 2, 2, None])
+
+    def test_malformed_tasks_field_falls_back_to_empty(self):
+        result = validate_decomposition({"course_name": "CS101", "tasks": "not a list"})
+        self.assertEqual(result.tasks, [])
+        self.assertEqual(result.course_name, "CS101")
+
+    def test_invalid_top_level_field_is_dropped(self):
+        result = validate_decomposition({"course_name": {"nested": True}, "tasks": []})
+        self.assertIsNone(result.course_name)
+
+
+class ParsePriorityTest(unittest.TestCase):
+    def test_levels(self):
+        self.assertEqual(parse_priority("must have"), 0)
+        self.assertEqual(parse_priority("strong"), 1)
+        self.assertEqual(parse_priority("unclear"), 1)
+        self.assertIsNone(parse_priority(None))
+        self.assertEqual(parse_priority(3), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()